@@ -196,6 +196,28 @@ EMAIL_HOST = 'localhost'
 
 EMAIL_USE_TLS = False
 
+# Reconnect attempts per email when the mail server drops or refuses the connection, backoff doubles per attempt
+EMAIL_SEND_RETRIES = 3
+
+EMAIL_SEND_RETRY_BACKOFF = 2  # seconds
+
+# Emails that are rejected or given up on are logged to the console of the worker that sent them
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'tunga_utils.emails': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
 PASSWORD_HASHERS = [
     # Default
     'django.contrib.auth.hashers.PBKDF2PasswordHasher',
@@ -221,11 +243,44 @@ CACHES = {
     }
 }
 
+# Seconds responses cached by tunga_utils.cache are kept, they're invalidated by versioning their keys
+RESPONSE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Longest a long-poll for new message events waits.
+# Sync gunicorn workers are held for the whole wait, so keep it short unless the app runs with gevent workers
+# (gunicorn -k gevent, with gevent installed), see tunga_messages.events
+MESSAGE_EVENTS_TIMEOUT = 5  # seconds
+
+# New message events kept per user for clients resuming from a cursor and for how long
+MESSAGE_EVENTS_BACKLOG = 100
+
+MESSAGE_EVENTS_BACKLOG_TIMEOUT = 60 * 60 * 24
+
+# Dotted path of a tunga_utils.search backend, None picks the backend for the database engine
+SEARCH_BACKEND = None
+
+# Rows read per query by the streaming exports in tunga_utils.export
+EXPORT_CHUNK_SIZE = 2000
+
+# Mobbr API the participation scripts of task urls are fetched from, see tunga_utils.mobbr
+MOBBR_API_URL = 'https://api.mobbr.com/api_v1'
+
+# Seconds to wait for a connection to and a response from the Mobbr API
+MOBBR_API_TIMEOUT = (3.05, 10)
+
+# Seconds a participation script is fresh and then for how long it's still served while it's refreshed
+MOBBR_SCRIPT_CACHE_TIMEOUT = 60 * 60
+
+MOBBR_SCRIPT_STALE_TIMEOUT = 60 * 60 * 24
+
 # Use the same redis as with caches for RQ
 RQ_QUEUES = {
     'default': {
         'USE_REDIS_CACHE': 'default',
     },
+    'github': {
+        'USE_REDIS_CACHE': 'default',
+    },
 }
 
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
@@ -331,3 +386,18 @@ TUNGA_SHARE_PERCENTAGE = 13
 TUNGA_URL = 'https://tunga.io'
 
 GITHUB_SCOPES = ['user:email', 'repo', 'admin:repo_hook', 'admin:org_hook']
+
+# GitHub API, see tunga_utils.github.GitHubClient
+GITHUB_API_URL = 'https://api.github.com'
+
+# Seconds to wait for a connection to and a response from the GitHub API
+GITHUB_API_TIMEOUT = (3.05, 20)
+
+# Seconds the ETags and data of GitHub responses are kept for conditional requests
+GITHUB_RESPONSE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Longest a request waits for the GitHub rate limit to reset before it fails
+GITHUB_RATE_LIMIT_MAX_WAIT = 5  # seconds
+
+# Most pages of a GitHub list read for one request
+GITHUB_MAX_PAGES = 10
@@ -0,0 +1,106 @@
+"""
+Batch loader for activity feeds.
+
+Actions point at their actor, action object and target through generic foreign keys which Django resolves one query
+per action and field. The loader groups a page of actions by content type instead, loads each content type's objects
+in one query with the relations its feed serializer reads, and caches them on the actions.
+"""
+from actstream.models import Action
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.manager import Manager
+from rest_framework import serializers
+
+from tunga_comments.models import Comment
+from tunga_profiles.models import Connection
+from tunga_tasks.models import Task, Application, Participation, TaskRequest, ProgressEvent, ProgressReport, \
+    IntegrationActivity
+from tunga_utils.serializers import prefetch_simple_users
+
+ACTION_GENERIC_FIELDS = ('actor', 'action_object', 'target')
+
+# Model -> function that adds the relations its feed serializer reads to a queryset
+FEED_QUERYSETS = dict()
+
+
+def register_feed_queryset(model, get_queryset):
+    FEED_QUERYSETS[model] = get_queryset
+
+
+register_feed_queryset(get_user_model(), lambda queryset: queryset.select_related('userprofile').prefetch_related(
+    'socialaccount_set'
+))
+register_feed_queryset(Comment, lambda queryset: prefetch_simple_users(queryset, 'user').prefetch_related('uploads'))
+register_feed_queryset(Connection, lambda queryset: prefetch_simple_users(queryset, 'from_user', 'to_user'))
+register_feed_queryset(Task, lambda queryset: prefetch_simple_users(queryset, 'user'))
+register_feed_queryset(Application, lambda queryset: prefetch_simple_users(queryset, 'user', 'task__user'))
+register_feed_queryset(
+    Participation, lambda queryset: prefetch_simple_users(queryset, 'user', 'created_by', 'task__user')
+)
+register_feed_queryset(TaskRequest, lambda queryset: prefetch_simple_users(queryset, 'user', 'task__user'))
+register_feed_queryset(ProgressEvent, lambda queryset: prefetch_simple_users(
+    queryset, 'created_by', 'progressreport__user'
+))
+register_feed_queryset(
+    ProgressReport, lambda queryset: prefetch_simple_users(queryset, 'user').prefetch_related('uploads')
+)
+register_feed_queryset(IntegrationActivity, lambda queryset: queryset.select_related('integration', 'event'))
+
+
+def get_feed_queryset(model, pks):
+    queryset = model._default_manager.filter(pk__in=pks)
+    get_queryset = FEED_QUERYSETS.get(model, None)
+    if get_queryset:
+        queryset = get_queryset(queryset)
+    return queryset
+
+
+def prefetch_actions(actions, fields=ACTION_GENERIC_FIELDS):
+    """
+    Resolves generic relations of actions with one query per content type and caches the objects on the actions
+    :param actions: Actions e.g a page of a feed
+    :param fields: Generic foreign keys of Action to resolve
+    :return: list of the actions
+    """
+    actions = list(actions)
+    relations = [getattr(Action, field) for field in fields]
+
+    object_ids = dict()
+    for action in actions:
+        for relation in relations:
+            content_type_id = getattr(action, '%s_id' % relation.ct_field)
+            object_id = getattr(action, relation.fk_field)
+            if content_type_id is not None and object_id is not None and not hasattr(action, relation.cache_attr):
+                object_ids.setdefault(content_type_id, set()).add(object_id)
+
+    objects = dict()
+    for content_type_id, content_type_object_ids in object_ids.iteritems():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            continue
+        pks = [model._meta.pk.to_python(object_id) for object_id in content_type_object_ids]
+        for instance in get_feed_queryset(model, pks):
+            objects[(content_type_id, unicode(instance.pk))] = instance
+
+    for action in actions:
+        for relation in relations:
+            if not hasattr(action, relation.cache_attr):
+                setattr(action, relation.cache_attr, objects.get(
+                    (getattr(action, '%s_id' % relation.ct_field), unicode(getattr(action, relation.fk_field))), None
+                ))
+    return actions
+
+
+class FeedListSerializer(serializers.ListSerializer):
+    """
+    Prefetches the generic relations of a page of actions before serializing them,
+    the child serializer lists the relations it reads in Meta.generic_relations
+    """
+
+    def to_representation(self, data):
+        if isinstance(data, Manager):
+            data = data.all()
+        # Listing a queryset fills its result cache, so the root's instance is made of the prefetched actions too
+        data = list(data)
+        prefetch_actions(data, fields=getattr(self.child.Meta, 'generic_relations', ACTION_GENERIC_FIELDS))
+        return super(FeedListSerializer, self).to_representation(data)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# actstream's Action model isn't ours to add index_together to, so the index for paging
+# a target's activity (e.g task activity) by (timestamp, id) is created here
+ACTION_TARGET_TIMESTAMP_INDEX = 'tunga_activity_action_target_timestamp_id'
+ACTION_TABLE = 'actstream_action'
+
+
+def create_action_index(apps, schema_editor):
+    schema_editor.execute(
+        'CREATE INDEX %s ON %s (target_content_type_id, target_object_id, timestamp, id)' % (
+            ACTION_TARGET_TIMESTAMP_INDEX, ACTION_TABLE
+        )
+    )
+
+
+def drop_action_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        # MySQL indexes belong to their table
+        schema_editor.execute('DROP INDEX %s ON %s' % (ACTION_TARGET_TIMESTAMP_INDEX, ACTION_TABLE))
+    else:
+        schema_editor.execute('DROP INDEX %s' % ACTION_TARGET_TIMESTAMP_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actstream', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_action_index, drop_action_index),
+    ]
@@ -3,6 +3,7 @@ from django.contrib.auth import get_user_model
 from generic_relations.relations import GenericRelatedField
 from rest_framework import serializers
 
+from tunga_activity.feed import FeedListSerializer, ACTION_GENERIC_FIELDS
 from tunga_comments.models import Comment
 from tunga_comments.serializers import CommentSerializer
 from tunga_profiles.models import Connection
@@ -34,6 +35,8 @@ class SimpleActivitySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Action
+        list_serializer_class = FeedListSerializer
+        generic_relations = ('action_object',)
         exclude = (
             'verb', 'actor_object_id', 'actor_content_type', 'action_object_object_id', 'action_object_content_type',
             'target_object_id', 'target_content_type'
@@ -65,7 +68,7 @@ class ActivitySerializer(SimpleActivitySerializer):
     })
 
     class Meta(SimpleActivitySerializer.Meta):
-        pass
+        generic_relations = ACTION_GENERIC_FIELDS
 
     def get_actor_type(self, obj):
         return get_instance_type(obj.actor)
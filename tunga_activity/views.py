@@ -5,6 +5,7 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
 from tunga_activity.filters import ActionFilter
 from tunga_activity.serializers import ActivitySerializer
+from tunga_utils.pagination import KeysetPagination
 
 
 class ActionViewSet(viewsets.ReadOnlyModelViewSet):
@@ -15,3 +16,4 @@ class ActionViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = ActivitySerializer
     permission_classes = [IsAdminUser]
     filter_class = ActionFilter
+    pagination_class = KeysetPagination
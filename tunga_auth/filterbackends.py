@@ -1,12 +1,10 @@
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.aggregates import Count, Sum
-from django.db.models.expressions import When, Case
-from django.db.models.fields import IntegerField
 from django.db.models.query_utils import Q
 from dry_rest_permissions.generics import DRYPermissionFiltersBase
 
 from tunga_auth.models import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER
 from tunga_profiles.models import UserProfile
+from tunga_utils.matching import annotate_skill_matches, get_skill_ids
 
 
 def my_connections_q_filter(user):
@@ -45,22 +43,9 @@ class UserFilterBackend(DRYPermissionFiltersBase):
         elif user_filter == 'relevant':
             queryset = queryset.filter(type=USER_TYPE_DEVELOPER)
             try:
-                user_skills = request.user.userprofile.skills.all()
-                queryset = queryset.filter(userprofile__skills__in=user_skills)
-                when = []
-                for skill in user_skills:
-                    new_when = When(
-                            userprofile__skills=skill,
-                            then=1
-                        )
-                    when.append(new_when)
-                queryset = queryset.annotate(matches=Sum(
-                    Case(
-                        *when,
-                        default=0,
-                        output_field=IntegerField()
-                    )
-                )).order_by('-matches', '-date_joined')
+                queryset = annotate_skill_matches(
+                    get_skill_ids(request.user.userprofile), queryset, skills_model=UserProfile, owner_field='user'
+                ).order_by('-matches', '-date_joined')
             except (ObjectDoesNotExist, UserProfile.DoesNotExist):
                 return queryset.none()
         return queryset
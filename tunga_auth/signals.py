@@ -1,10 +1,12 @@
 from allauth.account.models import EmailAddress
 from allauth.account.signals import user_signed_up
+from allauth.socialaccount.models import SocialAccount
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch.dispatcher import receiver
 
 from tunga_auth.emails import send_new_user_email
+from tunga_utils.cache import bump_fragment_version
 
 
 @receiver(post_save, sender=get_user_model())
@@ -18,6 +20,18 @@ def user_add_email_to_all_auth_handler(sender, instance, created, **kwargs):
                 email_address.save()
 
 
+@receiver(post_save, sender=get_user_model())
+def user_fragment_cache_handler(sender, instance, **kwargs):
+    bump_fragment_version(get_user_model(), instance.id)
+
+
+@receiver(post_save, sender=SocialAccount)
+@receiver(post_delete, sender=SocialAccount)
+def social_account_fragment_cache_handler(sender, instance, **kwargs):
+    # Users without an image show their social account's avatar
+    bump_fragment_version(get_user_model(), instance.user_id)
+
+
 @receiver(user_signed_up)
 def new_user_signup_handler(request, user, **kwargs):
     send_new_user_email.delay(user.id)
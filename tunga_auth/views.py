@@ -10,7 +10,7 @@ from tunga_auth.filters import UserFilter
 from tunga_auth.models import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER
 from tunga_auth.serializers import UserSerializer, AccountInfoSerializer
 from tunga_utils.serializers import SimpleUserSerializer
-from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
+from tunga_utils.filterbackends import FULL_TEXT_FILTER_BACKENDS
 
 
 class VerifyUserView(views.APIView):
@@ -63,7 +63,7 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
     filter_class = UserFilter
-    filter_backends = DEFAULT_FILTER_BACKENDS + (UserFilterBackend,)
+    filter_backends = FULL_TEXT_FILTER_BACKENDS + (UserFilterBackend,)
     search_fields = ('^username', '^first_name', '^last_name', '=email', 'userprofile__skills__name')
 
 
@@ -26,6 +26,8 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        # Comment pages of a task or task request
+        index_together = (('content_type', 'object_id', 'created_at', 'id'),)
 
     @allow_staff_or_superuser
     def has_object_read_permission(self, request):
@@ -6,7 +6,9 @@ from rest_framework.permissions import IsAuthenticated
 from tunga_comments.filters import CommentFilter
 from tunga_comments.models import Comment
 from tunga_comments.serializers import CommentSerializer
+from tunga_utils.filterbackends import FULL_TEXT_FILTER_BACKENDS
 from tunga_utils.models import Upload
+from tunga_utils.pagination import KeysetPagination
 
 
 class CommentViewSet(viewsets.ModelViewSet):
@@ -17,7 +19,9 @@ class CommentViewSet(viewsets.ModelViewSet):
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated, DRYObjectPermissions]
     filter_class = CommentFilter
+    filter_backends = FULL_TEXT_FILTER_BACKENDS
     search_fields = ('user__username', )
+    pagination_class = KeysetPagination
 
     def perform_create(self, serializer):
         comment = serializer.save()
@@ -0,0 +1,145 @@
+"""
+Push delivery of new messages and replies.
+
+Every new message or reply is published as a small event (type, id, channel, message) to a redis pub/sub channel
+per participant and appended to a short per user backlog. Events are numbered with a per user sequence that
+clients send back as a cursor, so a client long-polls for events after its cursor and only fetches messages when
+something changed. The backlog lets a client that reconnects resume from its cursor, a cursor that fell off
+the backlog gets a reset so the client refetches instead.
+
+A waiting long-poll holds its worker until an event arrives or MESSAGE_EVENTS_TIMEOUT runs out.
+With gunicorn's default sync workers every waiting client takes a whole worker, so the default wait is only
+a few seconds and clients simply poll again with their cursor. Longer waits are only safe when the app is served
+by gevent workers (pip install gevent, gunicorn -k gevent), whose monkey patching lets the redis wait yield,
+and the wait must still stay below gunicorn's worker timeout (30 seconds by default).
+"""
+import json
+import time
+
+from django_redis import get_redis_connection
+
+from tunga.settings.base import MESSAGE_EVENTS_TIMEOUT, MESSAGE_EVENTS_BACKLOG, MESSAGE_EVENTS_BACKLOG_TIMEOUT
+from tunga_messages.models import ChannelUser, Reception
+
+MESSAGE_EVENT_MESSAGE = 'message'
+MESSAGE_EVENT_REPLY = 'reply'
+
+
+def get_message_events_channel(user_id):
+    return 'message_events:user:%s' % user_id
+
+
+def get_message_events_backlog_key(user_id):
+    return 'message_events:user:%s:backlog' % user_id
+
+
+def get_message_events_sequence_key(user_id):
+    return 'message_events:user:%s:sequence' % user_id
+
+
+def get_message_audience(message):
+    """
+    :return: ids of the users a message is delivered to, including its sender for their other sessions
+    """
+    if message.channel_id:
+        user_ids = set(ChannelUser.objects.filter(channel_id=message.channel_id).values_list('user_id', flat=True))
+    else:
+        user_ids = set(Reception.objects.filter(message_id=message.id).values_list('user_id', flat=True))
+    user_ids.add(message.user_id)
+    return user_ids
+
+
+def publish_message_event(user_ids, event_type, **data):
+    """
+    Numbers an event for each user, adds it to their backlogs and publishes it to their channels
+    :param data: ids that tell the client what to fetch e.g id and channel of a new message
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    connection = get_redis_connection('default')
+
+    pipeline = connection.pipeline()
+    for user_id in user_ids:
+        pipeline.incr(get_message_events_sequence_key(user_id))
+    sequences = pipeline.execute()
+
+    pipeline = connection.pipeline()
+    for user_id, sequence in zip(user_ids, sequences):
+        event = json.dumps(dict(data, type=event_type, seq=sequence))
+        backlog_key = get_message_events_backlog_key(user_id)
+        pipeline.lpush(backlog_key, event)
+        pipeline.ltrim(backlog_key, 0, MESSAGE_EVENTS_BACKLOG - 1)
+        pipeline.expire(backlog_key, MESSAGE_EVENTS_BACKLOG_TIMEOUT)
+        pipeline.publish(get_message_events_channel(user_id), event)
+    pipeline.execute()
+
+
+def publish_new_messages(messages):
+    """
+    Publishes new messages of one channel, e.g added with add_messages, with one lookup of their audience
+    """
+    if not messages:
+        return
+    user_ids = get_message_audience(messages[0])
+    for message in messages:
+        publish_message_event(user_ids, MESSAGE_EVENT_MESSAGE, id=message.id, channel=message.channel_id)
+
+
+def publish_new_reply(reply):
+    message = reply.message
+    publish_message_event(
+        get_message_audience(message), MESSAGE_EVENT_REPLY,
+        id=reply.id, message=message.id, channel=message.channel_id
+    )
+
+
+def read_message_events_backlog(connection, user_id, since):
+    """
+    :return: (events after since oldest first, current cursor, reset) reset is True if events after since were lost
+    """
+    cursor = int(connection.get(get_message_events_sequence_key(user_id)) or 0)
+    if since is None or since == cursor:
+        return [], cursor, False
+    if since > cursor:
+        # The sequence was lost e.g redis was flushed
+        return [], cursor, True
+
+    backlog = connection.lrange(get_message_events_backlog_key(user_id), 0, -1)
+    events = [json.loads(event) for event in reversed(backlog)]
+    events = [event for event in events if event['seq'] > since]
+    reset = not events or events[0]['seq'] != since + 1
+    return events, cursor, reset
+
+
+def get_message_events(user_id, since=None, timeout=MESSAGE_EVENTS_TIMEOUT):
+    """
+    Waits for the events after a cursor
+    :param since: Cursor of the last event the client has seen, None just returns the current cursor
+    :param timeout: Seconds to wait when there are no events after the cursor yet
+    :return: dict with the events, the cursor to send next and whether the client should refetch everything
+    """
+    connection = get_redis_connection('default')
+    if since is None:
+        events, cursor, reset = read_message_events_backlog(connection, user_id, since)
+        return {'events': events, 'cursor': cursor, 'reset': reset}
+
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    # Subscribing before reading the backlog so that events published in between aren't missed
+    pubsub.subscribe(get_message_events_channel(user_id))
+    try:
+        events, cursor, reset = read_message_events_backlog(connection, user_id, since)
+        deadline = time.time() + timeout
+        while not events and not reset:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            published = pubsub.get_message(timeout=remaining)
+            if published and published['type'] == 'message':
+                event = json.loads(published['data'])
+                if event['seq'] > since:
+                    events.append(event)
+                    cursor = event['seq']
+    finally:
+        pubsub.close()
+    return {'events': events, 'cursor': cursor, 'reset': reset}
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from tunga_messages.tasks import reconcile_latest_activity
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Recompute the last message of every channel and the latest reply of every message and repair drifted ones.
+        """
+        # command to run: python manage.py tunga_reconcile_latest_activity
+
+        repaired = reconcile_latest_activity()
+
+        print "%s channels and messages repaired" % repaired
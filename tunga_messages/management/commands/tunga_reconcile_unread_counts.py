@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from tunga_messages.tasks import reconcile_unread_counts
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Recount unread messages for every channel participant and repair counters that drifted.
+        """
+        # command to run: python manage.py tunga_reconcile_unread_counts
+
+        repaired = reconcile_unread_counts()
+
+        print "%s unread counters repaired" % repaired
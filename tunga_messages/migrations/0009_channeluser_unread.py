@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 17:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def populate_unread_counts(apps, schema_editor):
+    ChannelUser = apps.get_model('tunga_messages', 'ChannelUser')
+    Message = apps.get_model('tunga_messages', 'Message')
+    for channel_user in ChannelUser.objects.all():
+        unread = Message.objects.filter(
+            channel_id=channel_user.channel_id, id__gt=channel_user.last_read
+        ).exclude(user_id=channel_user.user_id).count()
+        if unread:
+            ChannelUser.objects.filter(id=channel_user.id).update(unread=unread)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_messages', '0008_auto_20160626_1756'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channeluser',
+            name='unread',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_unread_counts, migrations.RunPython.noop),
+    ]
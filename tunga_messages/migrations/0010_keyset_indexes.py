@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 17:50
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_messages', '0009_channeluser_unread'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='channel',
+            index_together=set([('created_at', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='message',
+            index_together=set([('channel', 'created_at', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='reply',
+            index_together=set([('message', 'created_at')]),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 18:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models.aggregates import Max
+
+
+def populate_latest_activity(apps, schema_editor):
+    Channel = apps.get_model('tunga_messages', 'Channel')
+    Message = apps.get_model('tunga_messages', 'Message')
+    Reply = apps.get_model('tunga_messages', 'Reply')
+
+    last_messages = dict()
+    for channel_id, message_id, created_at in Message.objects.filter(
+            channel__isnull=False
+    ).order_by('created_at', 'id').values_list('channel_id', 'id', 'created_at'):
+        last_messages[channel_id] = (message_id, created_at)
+    for channel_id, created_at in Channel.objects.values_list('id', 'created_at'):
+        last_message_id, last_message_at = last_messages.get(channel_id, (None, created_at))
+        Channel.objects.filter(id=channel_id).update(last_message_id=last_message_id, last_message_at=last_message_at)
+
+    latest_replies = dict(
+        Reply.objects.values('message_id').annotate(latest=Max('created_at')).values_list('message_id', 'latest')
+    )
+    for message_id, created_at in Message.objects.values_list('id', 'created_at'):
+        Message.objects.filter(id=message_id).update(latest_reply_at=latest_replies.get(message_id, created_at))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_messages', '0010_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tunga_messages.Message'),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='last_message_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='latest_reply_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(populate_latest_activity, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='channel',
+            index_together=set([('created_at', 'id'), ('last_message_at', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='message',
+            index_together=set([('channel', 'created_at', 'id'), ('channel', 'latest_reply_at', 'id')]),
+        ),
+    ]
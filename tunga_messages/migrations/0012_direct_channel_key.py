@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 18:42
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+CHANNEL_TYPE_DIRECT = 1
+CHANNEL_TYPE_TOPIC = 2
+
+
+def dedupe_direct_channels(apps, schema_editor):
+    """
+    Keys direct channels on their pair of participants and merges duplicate direct channels of a pair
+    into the earliest one, which is the one the direct channel lookup used to return
+    """
+    Channel = apps.get_model('tunga_messages', 'Channel')
+    ChannelUser = apps.get_model('tunga_messages', 'ChannelUser')
+    Message = apps.get_model('tunga_messages', 'Message')
+
+    participants = dict()
+    for channel_id, user_id in ChannelUser.objects.filter(
+            channel__type=CHANNEL_TYPE_DIRECT
+    ).values_list('channel_id', 'user_id'):
+        participants.setdefault(channel_id, set()).add(user_id)
+
+    pairs = dict()
+    for channel_id in Channel.objects.filter(type=CHANNEL_TYPE_DIRECT).order_by('created_at', 'id').values_list(
+            'id', flat=True
+    ):
+        user_ids = participants.get(channel_id, set())
+        if len(user_ids) == 2:
+            pairs.setdefault(tuple(sorted(user_ids)), []).append(channel_id)
+        elif len(user_ids) > 2:
+            # What clean_direct_channel does with direct channels that gained participants
+            Channel.objects.filter(id=channel_id).update(type=CHANNEL_TYPE_TOPIC)
+
+    for (min_user_id, max_user_id), channel_ids in pairs.iteritems():
+        channel_id = channel_ids[0]
+        duplicate_ids = channel_ids[1:]
+        if duplicate_ids:
+            Message.objects.filter(channel_id__in=duplicate_ids).update(channel_id=channel_id)
+            for user_id in [min_user_id, max_user_id]:
+                last_read = max(ChannelUser.objects.filter(
+                    channel_id__in=channel_ids, user_id=user_id
+                ).values_list('last_read', flat=True))
+                unread = Message.objects.filter(
+                    channel_id=channel_id, id__gt=last_read
+                ).exclude(user_id=user_id).count()
+                ChannelUser.objects.filter(channel_id=channel_id, user_id=user_id).update(
+                    last_read=last_read, unread=unread
+                )
+            Channel.objects.filter(id__in=duplicate_ids).delete()
+
+            last_message = Message.objects.filter(channel_id=channel_id).order_by('-created_at', '-id').first()
+            if last_message:
+                Channel.objects.filter(id=channel_id).update(
+                    last_message_id=last_message.id, last_message_at=last_message.created_at
+                )
+        Channel.objects.filter(id=channel_id).update(min_user_id=min_user_id, max_user_id=max_user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tunga_messages', '0011_latest_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='max_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='channel',
+            name='min_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(dedupe_direct_channels, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='channel',
+            unique_together=set([('min_user', 'max_user')]),
+        ),
+    ]
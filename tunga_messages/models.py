@@ -3,13 +3,13 @@ from __future__ import unicode_literals
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models.query_utils import Q
+from django.utils import timezone
 from django.utils.html import strip_tags
 from django.utils.translation import ugettext_lazy as _
 from dry_rest_permissions.generics import allow_staff_or_superuser
 
 from tunga import settings
-from tunga_profiles.models import Connection
+from tunga_utils.permissions import get_permission_cache
 
 
 class Attachment(models.Model):
@@ -52,22 +52,38 @@ class Channel(models.Model):
     )
     object_id = models.PositiveIntegerField(blank=True, null=True)
     content_object = GenericForeignKey('content_type', 'object_id')
+    # Latest activity, maintained by tunga_messages.signals.
+    # last_message_at is the channel's creation time until it has a message so channels sort on it alone
+    last_message = models.ForeignKey(
+        'Message', on_delete=models.SET_NULL, related_name='+', blank=True, null=True
+    )
+    last_message_at = models.DateTimeField(default=timezone.now)
+    # Participants of a direct channel ordered by id, the unique pair keeps a direct channel per pair of users
+    min_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, related_name='+', blank=True, null=True
+    )
+    max_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, related_name='+', blank=True, null=True
+    )
 
     def __unicode__(self):
         return '{0} - {1}'.format(self.get_type_display(), self.subject or self.created_by)
 
     class Meta:
         ordering = ['-created_at']
+        # Keyset pagination keys
+        index_together = (('created_at', 'id'), ('last_message_at', 'id'))
+        unique_together = ('min_user', 'max_user')
 
     @allow_staff_or_superuser
     def has_object_read_permission(self, request):
         if self.has_object_write_permission(request):
             return True
-        return self.channeluser_set.filter(user=request.user).count()
+        return get_permission_cache(request).is_channel_member(self.id)
 
     @allow_staff_or_superuser
     def has_object_write_permission(self, request):
-        return request.user == self.created_by
+        return request.user.id == self.created_by_id
 
     @property
     def attachments(self):
@@ -80,6 +96,8 @@ class ChannelUser(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     last_read = models.IntegerField(default=0)
     read_at = models.DateTimeField(blank=True, null=True)
+    # Messages from other participants after last_read, maintained by tunga_messages.signals
+    unread = models.PositiveIntegerField(default=0)
 
     def __unicode__(self):
         return '%s - %s' % (self.channel, self.user.get_short_name() or self.user.username)
@@ -100,30 +118,31 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     read_at = models.DateTimeField(blank=True, null=True)
     attachments = GenericRelation(Attachment, related_query_name='messages')
+    # Time of the latest reply, the message's creation time until it has one, maintained by tunga_messages.signals
+    latest_reply_at = models.DateTimeField(default=timezone.now)
 
     def __unicode__(self):
         return '%s - %s' % (self.user.get_short_name() or self.user.username, self.subject)
 
     class Meta:
         ordering = ['-created_at']
+        # Channel message pages, the latest message per channel and messages by latest reply
+        index_together = (('channel', 'created_at', 'id'), ('channel', 'latest_reply_at', 'id'))
 
     @allow_staff_or_superuser
     def has_object_read_permission(self, request):
         if self.has_object_write_permission(request):
             return True
-        if self.channel:
-            return self.channel.channeluser_set.filter(user=request.user).count()
+        permission_cache = get_permission_cache(request)
+        if self.channel_id:
+            return permission_cache.is_channel_member(self.channel_id)
         if self.is_broadcast:
-            return bool(
-                Connection.objects.exclude(accepted=False).filter(
-                    Q(from_user=self.user, to_user=request.user) | Q(from_user=request.user, to_user=self.user)
-                ).count()
-            )
-        return self.reception_set.filter(user=request.user).count()
+            return permission_cache.is_connected(self.user_id)
+        return permission_cache.is_recipient(self.id)
 
     @allow_staff_or_superuser
     def has_object_write_permission(self, request):
-        return request.user == self.user
+        return request.user.id == self.user_id
 
     @property
     def excerpt(self):
@@ -157,6 +176,7 @@ class Reply(models.Model):
     class Meta:
         verbose_name_plural = 'replies'
         ordering = ['-created_at']
+        index_together = (('message', 'created_at'),)
 
     @allow_staff_or_superuser
     def has_object_read_permission(self, request):
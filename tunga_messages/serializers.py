@@ -2,9 +2,9 @@ from django.contrib.auth import get_user_model
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from tunga_messages.filterbackends import new_messages_filter
-from tunga_messages.models import Message, Attachment, Channel, ChannelUser
-from tunga_messages.tasks import get_or_create_direct_channel
+from tunga.settings.base import MESSAGE_EVENTS_TIMEOUT
+from tunga_messages.models import Message, Attachment, Channel
+from tunga_messages.tasks import get_or_create_direct_channel, add_participants
 from tunga_utils.mixins import GetCurrentUserAnnotatedSerializerMixin
 from tunga_utils.serializers import CreateOnlyCurrentUserDefault, SimpleUploadSerializer, \
     SimpleUserSerializer, DetailAnnotatedModelSerializer
@@ -24,6 +24,13 @@ class ChannelLastReadSerializer(serializers.Serializer):
     last_read = serializers.IntegerField(required=True)
 
 
+class MessageEventsSerializer(serializers.Serializer):
+    since = serializers.IntegerField(required=False, min_value=0)
+    timeout = serializers.IntegerField(
+        required=False, min_value=0, max_value=MESSAGE_EVENTS_TIMEOUT, default=MESSAGE_EVENTS_TIMEOUT
+    )
+
+
 class ChannelDetailsSerializer(serializers.ModelSerializer):
     created_by = SimpleUserSerializer()
     participants = SimpleUserSerializer(many=True)
@@ -46,8 +53,10 @@ class ChannelSerializer(DetailAnnotatedModelSerializer, GetCurrentUserAnnotatedS
 
     class Meta:
         model = Channel
-        read_only_fields = ('created_at', 'type')
+        read_only_fields = ('created_at', 'type', 'last_message', 'last_message_at', 'min_user', 'max_user')
         details_serializer = ChannelDetailsSerializer
+        # min_user and max_user are set from the participants, they aren't required from clients
+        validators = []
 
     def validate_participants(self, value):
         if not isinstance(value, list) or not value:
@@ -83,12 +92,7 @@ class ChannelSerializer(DetailAnnotatedModelSerializer, GetCurrentUserAnnotatedS
 
     def save_participants(self, instance, participants):
         if participants:
-            participants.append(instance.created_by)
-            for user in participants:
-                try:
-                    ChannelUser.objects.update_or_create(channel=instance, user=user)
-                except:
-                    pass
+            add_participants(instance, participants + [instance.created_by])
 
     def get_user(self, obj):
         user = self.get_current_user()
@@ -99,19 +103,27 @@ class ChannelSerializer(DetailAnnotatedModelSerializer, GetCurrentUserAnnotatedS
                         return SimpleUserSerializer(participant).data
         return None
 
-    def get_new(self, obj):
+    def get_current_channel_user(self, obj):
         user = self.get_current_user()
         if user:
-            return new_messages_filter(queryset=obj.messages.all(), user=user).count()
+            channel_users = getattr(obj, 'current_user_channel_users', None)
+            if channel_users is None:
+                channel_users = obj.channeluser_set.filter(user=user)
+            for channel_user in channel_users:
+                if channel_user.user_id == user.id:
+                    return channel_user
+        return None
+
+    def get_new(self, obj):
+        channel_user = self.get_current_channel_user(obj)
+        if channel_user:
+            return channel_user.unread
         return 0
 
     def get_last_read(self, obj):
-        user = self.get_current_user()
-        if user:
-            try:
-                return obj.channeluser_set.get(user=user).last_read
-            except:
-                pass
+        channel_user = self.get_current_channel_user(obj)
+        if channel_user:
+            return channel_user.last_read
         return 0
 
 
@@ -122,6 +134,6 @@ class MessageSerializer(serializers.ModelSerializer, GetCurrentUserAnnotatedSeri
 
     class Meta:
         model = Message
-        read_only_fields = ('created_at',)
+        read_only_fields = ('created_at', 'latest_reply_at')
 
 
@@ -1,13 +1,28 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.expressions import F
+from django.db.models.signals import post_save, post_delete
 from django.dispatch.dispatcher import receiver
 
 from tunga_messages.emails import send_new_message_email
-from tunga_messages.models import Message, Channel, CHANNEL_TYPE_DIRECT, CHANNEL_TYPE_TOPIC, ChannelUser
-from tunga_messages.tasks import clean_direct_channel
+from tunga_messages.events import publish_new_reply, publish_new_messages
+from tunga_messages.models import Message, Channel, CHANNEL_TYPE_DIRECT, CHANNEL_TYPE_TOPIC, ChannelUser, Reply
+from tunga_messages.tasks import clean_direct_channel, update_unread_count, increment_unread_counts, \
+    decrement_unread_counts, start_channel_last_message, update_channel_last_message, refresh_channel_last_message, \
+    start_message_latest_reply, update_message_latest_reply, refresh_message_latest_reply, participants_added, \
+    messages_added, update_unread_counts
+
+
+def deliver_new_messages(messages):
+    publish_new_messages(messages)
+    for message in messages:
+        send_new_message_email.delay(message.id)
 
 
 @receiver(post_save, sender=Channel)
 def activity_handler_channel(sender, instance, created, **kwargs):
+    if created:
+        start_channel_last_message(instance)
+
     if instance.type == CHANNEL_TYPE_DIRECT:
         clean_direct_channel(instance)
 
@@ -17,8 +32,56 @@ def activity_handler_channel_user(sender, instance, created, **kwargs):
     if instance.channel.type == CHANNEL_TYPE_DIRECT:
         clean_direct_channel(instance.channel)
 
+    # Joining a channel or moving last_read changes the participant's unread count
+    update_unread_count(instance)
+
 
 @receiver(post_save, sender=Message)
 def activity_handler_new_message(sender, instance, created, **kwargs):
     if created:
-        send_new_message_email.delay(instance.id)
+        increment_unread_counts(instance)
+        start_message_latest_reply(instance)
+        update_channel_last_message(instance)
+
+        # Workers and long-polling clients read the message, so it's delivered once it's committed
+        transaction.on_commit(lambda: deliver_new_messages([instance]))
+
+
+@receiver(participants_added, sender=ChannelUser)
+def activity_handler_participants_added(sender, channel, user_ids, **kwargs):
+    if channel.type == CHANNEL_TYPE_DIRECT:
+        clean_direct_channel(channel)
+
+    update_unread_counts(channel, user_ids=user_ids)
+
+
+@receiver(messages_added, sender=Message)
+def activity_handler_messages_added(sender, channel, messages, **kwargs):
+    if not messages:
+        return
+    update_unread_counts(channel)
+    # latest_reply_at defaults to a moment before created_at is set, see start_message_latest_reply
+    Message.objects.filter(id__in=[message.id for message in messages]).update(latest_reply_at=F('created_at'))
+    update_channel_last_message(messages[-1])
+
+    # Sent from create_channel's transaction, the messages are delivered once it's committed
+    transaction.on_commit(lambda: deliver_new_messages(messages))
+
+
+@receiver(post_delete, sender=Message)
+def activity_handler_message_deleted(sender, instance, **kwargs):
+    if instance.channel_id:
+        decrement_unread_counts(instance)
+        refresh_channel_last_message(instance.channel_id)
+
+
+@receiver(post_save, sender=Reply)
+def activity_handler_new_reply(sender, instance, created, **kwargs):
+    if created:
+        update_message_latest_reply(instance)
+        transaction.on_commit(lambda: publish_new_reply(instance))
+
+
+@receiver(post_delete, sender=Reply)
+def activity_handler_reply_deleted(sender, instance, **kwargs):
+    refresh_message_latest_reply(instance.message_id)
@@ -1,35 +1,103 @@
+from django.db import transaction, IntegrityError
+from django.db.models.aggregates import Max, Sum
+from django.db.models.expressions import F, Case, When, Value
+from django.db.models.fields import IntegerField
+from django.dispatch.dispatcher import Signal
 from django_rq.decorators import job
 
-from tunga_messages.models import Channel, ChannelUser, Message, CHANNEL_TYPE_TOPIC, CHANNEL_TYPE_DIRECT
+from tunga_messages.models import Channel, ChannelUser, Message, Reply, CHANNEL_TYPE_TOPIC, CHANNEL_TYPE_DIRECT
 from tunga_utils.decorators import convert_first_arg_to_instance, clean_instance
 
+# Sent once per batch by add_participants and add_messages in place of a post_save per row
+participants_added = Signal(providing_args=["channel", "user_ids"])
+
+messages_added = Signal(providing_args=["channel", "messages"])
+
 
 def create_channel(
         initiator, participants, subject=None, messages=None, content_object=None,
         channel_type=CHANNEL_TYPE_TOPIC):
-    channel = Channel.objects.create(
-        subject=subject, created_by=initiator, type=channel_type, content_object=content_object
-    )
     all_participants = [initiator]
     if participants and isinstance(participants, list):
         all_participants.extend(participants)
-    for participant in all_participants:
-        ChannelUser.objects.update_or_create(channel=channel, user=participant)
-    if messages:
-        for message in messages:
-            Message.objects.create(channel=channel, **message)
+    min_user_id = max_user_id = None
+    if channel_type == CHANNEL_TYPE_DIRECT and len(all_participants) == 2:
+        min_user_id, max_user_id = get_direct_channel_key(*all_participants)
+
+    with transaction.atomic():
+        channel = Channel.objects.create(
+            subject=subject, created_by=initiator, type=channel_type, content_object=content_object,
+            min_user_id=min_user_id, max_user_id=max_user_id
+        )
+        add_participants(channel, all_participants)
+        if messages:
+            add_messages(channel, messages)
     return channel
 
 
+def add_participants(channel, users):
+    """
+    Adds users to a channel with one insert, users that already participate are skipped
+    :param users: users or user ids
+    :return: ids of the users that were added
+    """
+    user_ids = set([getattr(user, 'id', user) for user in users])
+    with transaction.atomic():
+        user_ids -= set(
+            ChannelUser.objects.filter(channel=channel, user_id__in=user_ids).values_list('user_id', flat=True)
+        )
+        if not user_ids:
+            return []
+        user_ids = sorted(user_ids)
+        try:
+            with transaction.atomic():
+                ChannelUser.objects.bulk_create([ChannelUser(channel=channel, user_id=user_id) for user_id in user_ids])
+        except IntegrityError:
+            # Some of the users joined at the same time, the others are added one by one with their own signals
+            return [
+                user_id for user_id in user_ids
+                if ChannelUser.objects.get_or_create(channel=channel, user_id=user_id)[1]
+            ]
+        participants_added.send(sender=ChannelUser, channel=channel, user_ids=user_ids)
+    return user_ids
+
+
+def add_messages(channel, messages):
+    """
+    Adds messages to a channel with one insert
+    :param messages: list of dicts of Message fields e.g user and body
+    :return: list of the new messages
+    """
+    with transaction.atomic():
+        last_id = channel.messages.aggregate(last_id=Max('id'))['last_id'] or 0
+        Message.objects.bulk_create([Message(channel=channel, **message) for message in messages])
+        # bulk_create doesn't set ids, the messages are read back
+        new_messages = list(channel.messages.filter(id__gt=last_id).order_by('id'))
+        messages_added.send(sender=Message, channel=channel, messages=new_messages)
+    return new_messages
+
+
+def get_direct_channel_key(initiator, participant):
+    """
+    :return: (min user id, max user id) of a direct channel's participants
+    """
+    return tuple(sorted([initiator.id, participant.id]))
+
+
 def get_or_create_direct_channel(initiator, participant):
+    min_user_id, max_user_id = get_direct_channel_key(initiator, participant)
     try:
-        return Channel.objects.filter(
-            type=CHANNEL_TYPE_DIRECT, participants=initiator
-        ).filter(participants=participant).earliest('created_at')
+        return Channel.objects.get(min_user_id=min_user_id, max_user_id=max_user_id)
     except Channel.DoesNotExist:
+        pass
+
+    try:
         return create_channel(
             initiator=initiator, participants=[participant], channel_type=CHANNEL_TYPE_DIRECT
         )
+    except IntegrityError:
+        # A concurrent request created the channel first, its insert hit the unique pair key
+        return Channel.objects.get(min_user_id=min_user_id, max_user_id=max_user_id)
 
 
 @job
@@ -38,4 +106,173 @@ def clean_direct_channel(channel):
     # A direct channel can't have more than 2 participants
     if channel.type == CHANNEL_TYPE_DIRECT and channel.participants.count() > 2:
         channel.type = CHANNEL_TYPE_TOPIC
+        # Frees the pair for a new direct channel
+        channel.min_user = channel.max_user = None
         channel.save()
+
+
+def get_unread_count(channel_user):
+    return Message.objects.filter(
+        channel_id=channel_user.channel_id, id__gt=channel_user.last_read
+    ).exclude(user_id=channel_user.user_id).count()
+
+
+def annotate_unread_counts(channel_users):
+    """
+    Counts each participant's unread messages in SQL, messages after their last_read from other participants
+    :return: channel users annotated with actual_unread
+    """
+    return channel_users.annotate(actual_unread=Sum(Case(
+        # The participant's own messages come first so they're never counted
+        When(channel__messages__user_id=F('user_id'), then=Value(0)),
+        When(channel__messages__id__gt=F('last_read'), then=Value(1)),
+        default=Value(0), output_field=IntegerField()
+    )))
+
+
+def repair_unread_counts(channel_users):
+    """
+    Stores the actual unread counts of participants whose counters drifted, with one update per count
+    :return: number of counters repaired
+    """
+    changed = dict()
+    for channel_user_id, actual_unread in annotate_unread_counts(channel_users).exclude(
+            unread=F('actual_unread')
+    ).values_list('id', 'actual_unread'):
+        changed.setdefault(actual_unread, []).append(channel_user_id)
+    for unread, channel_user_ids in changed.iteritems():
+        ChannelUser.objects.filter(id__in=channel_user_ids).update(unread=unread)
+    return sum([len(channel_user_ids) for channel_user_ids in changed.values()])
+
+
+def update_unread_counts(channel, user_ids=None):
+    """
+    Recounts the unread messages of a channel's participants
+    :param user_ids: Participants to recount, all of them if None
+    """
+    channel_users = ChannelUser.objects.filter(channel=channel)
+    if user_ids is not None:
+        channel_users = channel_users.filter(user_id__in=user_ids)
+    repair_unread_counts(channel_users)
+
+
+def update_unread_count(channel_user):
+    """
+    Recounts a participant's unread messages after their last_read moves
+    """
+    unread = get_unread_count(channel_user)
+    if unread != channel_user.unread:
+        ChannelUser.objects.filter(id=channel_user.id).update(unread=unread)
+        channel_user.unread = unread
+    return unread
+
+
+def increment_unread_counts(message):
+    """
+    Counts a new message as unread for the other participants in its channel
+    """
+    if message.channel_id:
+        ChannelUser.objects.filter(
+            channel_id=message.channel_id, last_read__lt=message.id
+        ).exclude(user_id=message.user_id).update(unread=F('unread') + 1)
+
+
+def decrement_unread_counts(message):
+    """
+    Stops counting a deleted message as unread for the participants that hadn't read it
+    """
+    if message.channel_id:
+        ChannelUser.objects.filter(
+            channel_id=message.channel_id, last_read__lt=message.id, unread__gt=0
+        ).exclude(user_id=message.user_id).update(unread=F('unread') - 1)
+
+
+@job
+def reconcile_unread_counts():
+    """
+    Repairs unread counters that drifted e.g after messages were bulk deleted or inserted
+    :return: number of counters repaired
+    """
+    return repair_unread_counts(ChannelUser.objects.all())
+
+
+def start_channel_last_message(channel):
+    """
+    Aligns a new channel's last_message_at with its created_at, the field's default is taken a moment earlier
+    """
+    Channel.objects.filter(id=channel.id, last_message__isnull=True).update(last_message_at=channel.created_at)
+    channel.last_message_at = channel.created_at
+
+
+def update_channel_last_message(message):
+    """
+    Moves a channel's last message forward to a new message, the filter keeps concurrent messages from moving it back
+    """
+    if message.channel_id:
+        Channel.objects.filter(
+            id=message.channel_id, last_message_at__lte=message.created_at
+        ).update(last_message=message, last_message_at=message.created_at)
+
+
+def refresh_channel_last_message(channel_id):
+    """
+    Finds a channel's last message again e.g after a message was deleted
+    """
+    last_message = Message.objects.filter(channel_id=channel_id).order_by('-created_at', '-id').first()
+    Channel.objects.filter(id=channel_id).update(
+        last_message=last_message, last_message_at=last_message and last_message.created_at or F('created_at')
+    )
+
+
+def start_message_latest_reply(message):
+    Message.objects.filter(id=message.id, latest_reply_at__lt=message.created_at).update(
+        latest_reply_at=message.created_at
+    )
+    message.latest_reply_at = message.created_at
+
+
+def update_message_latest_reply(reply):
+    Message.objects.filter(
+        id=reply.message_id, latest_reply_at__lt=reply.created_at
+    ).update(latest_reply_at=reply.created_at)
+
+
+def refresh_message_latest_reply(message_id):
+    latest_reply_at = Reply.objects.filter(message_id=message_id).aggregate(latest=Max('created_at'))['latest']
+    Message.objects.filter(id=message_id).update(latest_reply_at=latest_reply_at or F('created_at'))
+
+
+@job
+def reconcile_latest_activity():
+    """
+    Repairs the last message of channels and the latest reply of messages e.g after messages were bulk inserted
+    :return: number of channels and messages repaired
+    """
+    repaired = 0
+    last_messages = dict()
+    for channel_id, message_id, created_at in Message.objects.filter(
+            channel__isnull=False
+    ).order_by('created_at', 'id').values_list('channel_id', 'id', 'created_at').iterator():
+        last_messages[channel_id] = (message_id, created_at)
+
+    for channel_id, created_at, last_message_id, last_message_at in Channel.objects.values_list(
+            'id', 'created_at', 'last_message_id', 'last_message_at'
+    ).iterator():
+        last_message = last_messages.get(channel_id, (None, created_at))
+        if last_message != (last_message_id, last_message_at):
+            Channel.objects.filter(id=channel_id).update(
+                last_message_id=last_message[0], last_message_at=last_message[1]
+            )
+            repaired += 1
+
+    latest_replies = dict(
+        Reply.objects.values('message_id').annotate(latest=Max('created_at')).values_list('message_id', 'latest')
+    )
+    for message_id, created_at, latest_reply_at in Message.objects.values_list(
+            'id', 'created_at', 'latest_reply_at'
+    ).iterator():
+        latest = latest_replies.get(message_id, created_at)
+        if latest != latest_reply_at:
+            Message.objects.filter(id=message_id).update(latest_reply_at=latest)
+            repaired += 1
+    return repaired
@@ -1,3 +1,193 @@
-from django.test import TestCase
+import datetime
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase, APITransactionTestCase, APIRequestFactory, force_authenticate
+
+from tunga_messages.models import Channel, Message, Reply, ChannelUser, CHANNEL_TYPE_DIRECT, CHANNEL_TYPE_TOPIC
+from tunga_messages.tasks import create_channel, reconcile_latest_activity, add_participants, \
+    get_or_create_direct_channel, reconcile_unread_counts
+from tunga_messages.views import ChannelViewSet
+from tunga_utils.permissions import get_permission_cache
+
+
+class APIMessageTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user', 'user@example.com', 'secret')
+        self.other_user = get_user_model().objects.create_user('other', 'other@example.com', 'secret')
+
+    def test_latest_activity(self):
+        """
+        Channels and messages are listed by their latest message and reply, which are kept up to date as they change
+        """
+        old_channel = create_channel(self.user, [self.other_user], subject='Old')
+        new_channel = create_channel(self.user, [self.other_user], subject='New')
+        message = Message.objects.create(channel=old_channel, user=self.other_user, body='Hello')
+
+        old_channel.refresh_from_db()
+        self.assertEqual(old_channel.last_message_id, message.id)
+        self.assertEqual(old_channel.last_message_at, message.created_at)
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('channel-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([channel['id'] for channel in response.data['results']], [old_channel.id, new_channel.id])
+
+        reply = Reply.objects.create(message=message, user=self.user, body='Hi')
+        self.assertEqual(Message.objects.get(id=message.id).latest_reply_at, reply.created_at)
+
+        reply.delete()
+        message.delete()
+        old_channel.refresh_from_db()
+        self.assertIsNone(old_channel.last_message_id)
+        self.assertEqual(old_channel.last_message_at, old_channel.created_at)
+
+        self.assertEqual(reconcile_latest_activity(), 0)
+        Channel.objects.filter(id=new_channel.id).update(last_message_at=datetime.datetime(2000, 1, 1))
+        self.assertEqual(reconcile_latest_activity(), 1)
+        self.assertEqual(Channel.objects.get(id=new_channel.id).last_message_at, new_channel.created_at)
+
+    def test_create_channel(self):
+        """
+        Channels are created with their participants and messages in bulk and the batched signals keep counters
+        """
+        third_user = get_user_model().objects.create_user('third', 'third@example.com', 'secret')
+        channel = create_channel(
+            self.user, [self.other_user, self.other_user], subject='Bulk',
+            messages=[{'user': self.user, 'body': 'One'}, {'user': self.user, 'body': 'Two'}]
+        )
+        self.assertEqual(
+            dict(ChannelUser.objects.filter(channel=channel).values_list('user_id', 'unread')),
+            {self.user.id: 0, self.other_user.id: 2}
+        )
+        channel.refresh_from_db()
+        self.assertEqual(channel.last_message.body, 'Two')
+
+        self.assertEqual(add_participants(channel, [self.other_user, third_user]), [third_user.id])
+        self.assertEqual(ChannelUser.objects.get(channel=channel, user=third_user).unread, 2)
+
+    def test_unread_counts(self):
+        """
+        Deleted messages stop counting as unread and drifted counters are recounted in SQL
+        """
+        channel = create_channel(
+            self.user, [self.other_user], subject='Unread',
+            messages=[{'user': self.user, 'body': 'One'}, {'user': self.user, 'body': 'Two'}]
+        )
+        other_channel = create_channel(self.other_user, [self.user], subject='Empty')
+        reply = Message.objects.create(channel=channel, user=self.other_user, body='Three')
+
+        def get_unread_counts():
+            return dict(ChannelUser.objects.filter(channel=channel).values_list('user_id', 'unread'))
+
+        self.assertEqual(get_unread_counts(), {self.user.id: 1, self.other_user.id: 2})
+
+        channel.messages.filter(body='One').delete()
+        self.assertEqual(get_unread_counts(), {self.user.id: 1, self.other_user.id: 1})
+
+        # Messages the participant has read were never counted
+        ChannelUser.objects.filter(channel=channel, user=self.user).update(last_read=reply.id, unread=0)
+        reply.delete()
+        self.assertEqual(get_unread_counts(), {self.user.id: 0, self.other_user.id: 1})
+
+        self.assertEqual(reconcile_unread_counts(), 0)
+        ChannelUser.objects.filter(channel=channel, user=self.other_user).update(unread=5)
+        ChannelUser.objects.filter(channel=other_channel).update(unread=3)
+        with self.assertNumQueries(3):
+            self.assertEqual(reconcile_unread_counts(), 3)
+        self.assertEqual(get_unread_counts(), {self.user.id: 0, self.other_user.id: 1})
+        self.assertEqual(
+            list(ChannelUser.objects.filter(channel=other_channel).values_list('unread', flat=True)), [0, 0]
+        )
+
+    def test_direct_channel(self):
+        """
+        There's one direct channel per pair of users, whichever of them opens it
+        """
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse('channel-direct'), {'user': self.other_user.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        channel = Channel.objects.get(id=response.data['id'])
+        self.assertEqual(channel.type, CHANNEL_TYPE_DIRECT)
+        self.assertEqual((channel.min_user_id, channel.max_user_id), (self.user.id, self.other_user.id))
+
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.post(reverse('channel-direct'), {'user': self.user.id})
+        self.assertEqual(response.data['id'], channel.id)
+
+        response = self.client.post(
+            reverse('channel-list'), {'subject': 'Topic', 'participants': [self.user.id]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['type'], CHANNEL_TYPE_TOPIC)
+
+        # What a concurrent request that missed the lookup runs into
+        with self.assertRaises(IntegrityError):
+            create_channel(self.other_user, [self.user], channel_type=CHANNEL_TYPE_DIRECT)
+        self.assertEqual(Channel.objects.filter(type=CHANNEL_TYPE_DIRECT).count(), 1)
+
+        third_user = get_user_model().objects.create_user('third', 'third@example.com', 'secret')
+        add_participants(channel, [third_user])
+        channel.refresh_from_db()
+        self.assertEqual((channel.type, channel.min_user_id), (CHANNEL_TYPE_TOPIC, None))
+        self.assertNotEqual(get_or_create_direct_channel(self.user, self.other_user).id, channel.id)
+
+    def test_create_channel_permission_cache(self):
+        """
+        Channels the current user joins in a request are seen by later permission checks of that request
+        """
+        request = APIRequestFactory().post(
+            reverse('channel-list'), {'subject': 'New', 'participants': [self.other_user.id]}, format='json'
+        )
+        request.user = self.user
+        self.assertEqual(get_permission_cache(request).channel_ids, set())
+
+        force_authenticate(request, user=self.user)
+        response = ChannelViewSet.as_view({'post': 'create'})(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(get_permission_cache(request).is_channel_member(response.data['id']))
+
+
+class APIMessageEventsTestCase(APITransactionTestCase):
+    """
+    Events are delivered on commit, so they're tested with transactions that really commit
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user', 'user@example.com', 'secret')
+        self.other_user = get_user_model().objects.create_user('other', 'other@example.com', 'secret')
+
+    def test_message_events(self):
+        """
+        New messages and replies are delivered to the channel participants as events after their cursor
+        """
+        channel = create_channel(self.user, [self.other_user], subject='Events')
+        url = reverse('message-events')
+
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['events'], [])
+        cursor = response.data['cursor']
+
+        response = self.client.get(url, {'since': cursor, 'timeout': 0})
+        self.assertEqual(response.data['events'], [])
+        self.assertFalse(response.data['reset'])
+
+        with transaction.atomic():
+            message = Message.objects.create(channel=channel, user=self.user, body='Hello')
+            reply = Reply.objects.create(message=message, user=self.user, body='Hi')
+            # Nothing is delivered before the message is committed
+            self.assertEqual(self.client.get(url, {'since': cursor, 'timeout': 0}).data['events'], [])
+        response = self.client.get(url, {'since': cursor})
+        self.assertEqual(
+            [(event['type'], event['id'], event['channel']) for event in response.data['events']],
+            [('message', message.id, channel.id), ('reply', reply.id, channel.id)]
+        )
+        self.assertEqual(response.data['cursor'], cursor + 2)
+
+        response = self.client.get(url, {'since': cursor + 3, 'timeout': 0})
+        self.assertTrue(response.data['reset'])
@@ -1,6 +1,4 @@
-from django.db.models.aggregates import Max
-from django.db.models.expressions import Case, When, F
-from django.db.models.fields import DateTimeField
+from django.db.models.query import Prefetch
 from dry_rest_permissions.generics import DRYObjectPermissions
 from rest_framework import viewsets, status
 from rest_framework.decorators import detail_route, list_route
@@ -8,33 +6,25 @@ from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from tunga_messages.events import get_message_events
 from tunga_messages.filterbackends import MessageFilterBackend, ChannelFilterBackend
 from tunga_messages.filters import MessageFilter, ChannelFilter
 from tunga_messages.models import Message, Attachment, Channel, ChannelUser
 from tunga_messages.serializers import MessageSerializer, ChannelSerializer, DirectChannelSerializer, \
-    ChannelLastReadSerializer
+    ChannelLastReadSerializer, MessageEventsSerializer
 from tunga_messages.tasks import get_or_create_direct_channel
-from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
+from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS, FULL_TEXT_FILTER_BACKENDS
+from tunga_utils.mixins import ClearPermissionCacheMixin
+from tunga_utils.pagination import KeysetPagination
+from tunga_utils.permissions import clear_permission_cache
 
 
-class ChannelViewSet(viewsets.ModelViewSet):
+class ChannelViewSet(ClearPermissionCacheMixin, viewsets.ModelViewSet):
     """
     Channel Resource
     """
-    queryset = Channel.objects.all().annotate(
-        latest_message_created_at=Max('messages__created_at')
-    ).annotate(latest_activity_at=Case(
-        When(
-            latest_message_created_at__isnull=True,
-            then='created_at'
-        ),
-        When(
-            latest_message_created_at__gt=F('created_at'),
-            then='latest_message_created_at'
-        ),
-        default='created_at',
-        output_field=DateTimeField()
-    )).order_by('-latest_activity_at')
+    # last_message_at is maintained as messages are sent, see tunga_messages.signals
+    queryset = Channel.objects.all().order_by('-last_message_at')
     serializer_class = ChannelSerializer
     permission_classes = [IsAuthenticated, DRYObjectPermissions]
     filter_class = ChannelFilter
@@ -43,6 +33,20 @@ class ChannelViewSet(viewsets.ModelViewSet):
         'subject', 'channeluser__user__username', 'channeluser__user__first_name',
         'channeluser__user__last_name'
     )
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        queryset = super(ChannelViewSet, self).get_queryset()
+        user = self.request.user
+        if self.action in ['list', 'retrieve'] and user.is_authenticated():
+            # ChannelSerializer reads the current user's unread count and last_read from here
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'channeluser_set', queryset=ChannelUser.objects.filter(user=user),
+                    to_attr='current_user_channel_users'
+                )
+            )
+        return queryset
 
     @list_route(
         methods=['post'], url_path='direct',
@@ -84,6 +88,7 @@ class ChannelViewSet(viewsets.ModelViewSet):
         channel = get_object_or_404(self.get_queryset(), pk=pk)
         if channel.has_object_read_permission(request):
             ChannelUser.objects.update_or_create(user=request.user, channel=channel, defaults={'last_read': last_read})
+            clear_permission_cache(request)
             response_serializer = ChannelSerializer(channel)
             return Response(response_serializer.data)
         return Response(
@@ -96,25 +101,13 @@ class MessageViewSet(viewsets.ModelViewSet):
     """
     Message Resource
     """
-    queryset = Message.objects.all().annotate(
-        latest_reply_created_at=Max('replies__created_at')
-    ).annotate(latest_created_at=Case(
-        When(
-            latest_reply_created_at__isnull=True,
-            then='created_at'
-        ),
-        When(
-            latest_reply_created_at__gt=F('created_at'),
-            then='latest_reply_created_at'
-        ),
-        default='created_at',
-        output_field=DateTimeField()
-    )).order_by('-latest_created_at')
+    queryset = Message.objects.all().order_by('-latest_reply_at')
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated, DRYObjectPermissions]
     filter_class = MessageFilter
-    filter_backends = DEFAULT_FILTER_BACKENDS + (MessageFilterBackend,)
+    filter_backends = FULL_TEXT_FILTER_BACKENDS + (MessageFilterBackend,)
     search_fields = ('user__username', 'body', 'replies__body')
+    pagination_class = KeysetPagination
 
     def perform_create(self, serializer):
         message = serializer.save()
@@ -124,6 +117,31 @@ class MessageViewSet(viewsets.ModelViewSet):
                 attachment = Attachment(content_object=message, file=file)
                 attachment.save()
 
+    @list_route(
+        methods=['get'], url_path='events',
+        permission_classes=[IsAuthenticated], serializer_class=MessageEventsSerializer
+    )
+    def events(self, request):
+        """
+        Waits for new messages and replies after a cursor, see tunga_messages.events
+        Without since the current cursor is returned at once,
+        reset means events after the cursor were lost and messages should be fetched again
+        ---
+        omit_serializer: true
+        parameters:
+            - name: since
+              description: cursor from the last response
+              type: integer
+              paramType: query
+            - name: timeout
+              description: seconds to wait for new events
+              type: integer
+              paramType: query
+        """
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(get_message_events(request.user.id, **serializer.validated_data))
+
     @detail_route(
         methods=['post'], url_path='read',
         permission_classes=[IsAuthenticated]
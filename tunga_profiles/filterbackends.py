@@ -8,4 +8,4 @@ class ConnectionFilterBackend(DRYPermissionFiltersBase):
 
     @dont_filter_staff_or_superuser
     def filter_list_queryset(self, request, queryset, view):
-        return queryset.filter(Q(from_user=request.user) | Q(to__user=request.user))
+        return queryset.filter(Q(from_user=request.user) | Q(to_user=request.user))
@@ -1,10 +1,12 @@
 from actstream.signals import action
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete
 from django.dispatch.dispatcher import receiver
 
 from tunga_activity import verbs
 from tunga_profiles.emails import send_new_developer_email, send_developer_accepted_email
-from tunga_profiles.models import Connection, DeveloperApplication
+from tunga_profiles.models import Connection, DeveloperApplication, UserProfile, Skill
+from tunga_utils.cache import bump_cache_version, CACHE_NAMESPACE_SKILLS, bump_fragment_version
 from tunga_utils.constants import REQUEST_STATUS_ACCEPTED
 
 
@@ -29,3 +31,14 @@ def activity_handler_developer_application(sender, instance, created, **kwargs):
     else:
         if instance.status == REQUEST_STATUS_ACCEPTED and not instance.confirmation_sent_at:
             send_developer_accepted_email.delay(instance.id)
+
+
+@receiver(post_save, sender=Skill)
+@receiver(post_delete, sender=Skill)
+def activity_handler_skill_changed(sender, instance, **kwargs):
+    bump_cache_version(CACHE_NAMESPACE_SKILLS)
+
+
+@receiver(post_save, sender=UserProfile)
+def activity_handler_profile_changed(sender, instance, **kwargs):
+    bump_fragment_version(get_user_model(), instance.user_id)
@@ -1,3 +1,4 @@
+from django.db.models.aggregates import Sum
 from django.db.models.query_utils import Q
 from django.shortcuts import get_object_or_404
 from django_countries.fields import CountryField
@@ -8,8 +9,6 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 
 from tunga_auth.models import USER_TYPE_PROJECT_OWNER
-from tunga_messages.filterbackends import new_messages_filter
-from tunga_messages.models import Message
 from tunga_profiles.filterbackends import ConnectionFilterBackend
 from tunga_profiles.filters import EducationFilter, WorkFilter, ConnectionFilter, SocialLinkFilter, \
     DeveloperApplicationFilter
@@ -17,9 +16,10 @@ from tunga_profiles.models import UserProfile, Education, Work, Connection, Soci
 from tunga_profiles.permissions import IsAdminOrCreateOnly
 from tunga_profiles.serializers import ProfileSerializer, EducationSerializer, WorkSerializer, ConnectionSerializer, \
     SocialLinkSerializer, DeveloperApplicationSerializer
-from tunga_utils import github
+from tunga_utils.cache import cache_response, CACHE_NAMESPACE_COUNTRIES
 from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
-from tunga_utils.github import ISSUE_FIELDS, extract_repo_info
+from tunga_utils.github import ISSUE_FIELDS, extract_repo_info, GitHubClient, GitHubError
+from tunga_utils.mixins import ClearPermissionCacheMixin
 from tunga_utils.views import get_social_token
 
 
@@ -73,7 +73,7 @@ class WorkViewSet(viewsets.ModelViewSet):
     search_fields = ('company', 'position')
 
 
-class ConnectionViewSet(viewsets.ModelViewSet):
+class ConnectionViewSet(ClearPermissionCacheMixin, viewsets.ModelViewSet):
     """
     Connection Resource
     """
@@ -121,6 +121,7 @@ class CountryListView(views.APIView):
     """
     permission_classes = [AllowAny]
 
+    @cache_response([CACHE_NAMESPACE_COUNTRIES])
     def get(self, request):
         countries = []
         for country in CountryField().get_choices():
@@ -152,7 +153,7 @@ class NotificationView(views.APIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
 
-        new_messages = new_messages_filter(queryset=Message.objects.all(), user=user).count()
+        new_messages = user.channeluser_set.aggregate(unread=Sum('unread'))['unread'] or 0
 
         requests = user.connection_requests.filter(responded=False).count()
         tasks = user.tasks_created.filter(closed=False).count() + user.participation_set.filter((Q(accepted=True) | Q(responded=False)), user=user).count()
@@ -211,11 +212,11 @@ class RepoListView(views.APIView):
             return Response({'status': 'Unauthorized'}, status.HTTP_401_UNAUTHORIZED)
 
         if provider == 'github':
-            r = github.api(endpoint='/user/repos', method='get', access_token=social_token.token)
-            if r.status_code == 200:
-                repos = [extract_repo_info(repo) for repo in r.json()]
-                return Response(repos)
-            return Response(r.json(), r.status_code)
+            try:
+                repos = [extract_repo_info(repo) for repo in GitHubClient(social_token.token).iterate('/user/repos')]
+            except GitHubError as e:
+                return Response(e.data, e.status_code)
+            return Response(repos)
         return Response({'status': 'Not implemented'}, status.HTTP_501_NOT_IMPLEMENTED)
 
 
@@ -231,10 +232,9 @@ class IssueListView(views.APIView):
             return Response({'status': 'Unauthorized'}, status.HTTP_401_UNAUTHORIZED)
 
         if provider == 'github':
-            r = github.api(endpoint='/user/issues', method='get', params={'filter': 'all'}, access_token=social_token.token)
-            if r.status_code == 200:
-                issues = []
-                for issue in r.json():
+            issues = []
+            try:
+                for issue in GitHubClient(social_token.token).iterate('/user/issues', params={'filter': 'all'}):
                     if 'pull_request' in issue:
                         continue  # Github returns both issues and pull requests from this endpoint
                     issue_info = {}
@@ -244,6 +244,7 @@ class IssueListView(views.APIView):
                         else:
                             issue_info[key] = issue[key]
                     issues.append(issue_info)
-                return Response(issues)
-            return Response(r.json(), r.status_code)
+            except GitHubError as e:
+                return Response(e.data, e.status_code)
+            return Response(issues)
         return Response({'status': 'Not implemented'}, status.HTTP_501_NOT_IMPLEMENTED)
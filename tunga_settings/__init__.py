@@ -0,0 +1 @@
+default_app_config = 'tunga_settings.apps.TungaSettingsConfig'
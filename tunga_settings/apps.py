@@ -5,3 +5,6 @@ from django.apps import AppConfig
 
 class TungaSettingsConfig(AppConfig):
     name = 'tunga_settings'
+
+    def ready(self):
+        from tunga_settings import signals
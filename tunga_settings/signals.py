@@ -0,0 +1,21 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch.dispatcher import receiver
+
+from tunga_settings.models import SwitchSetting, VisibilitySetting, UserSwitchSetting, UserVisibilitySetting
+from tunga_utils.cache import bump_cache_version, CACHE_NAMESPACE_SETTINGS, CACHE_NAMESPACE_USER_SETTINGS
+
+
+@receiver(post_save, sender=SwitchSetting)
+@receiver(post_delete, sender=SwitchSetting)
+@receiver(post_save, sender=VisibilitySetting)
+@receiver(post_delete, sender=VisibilitySetting)
+def activity_handler_setting_changed(sender, instance, **kwargs):
+    bump_cache_version(CACHE_NAMESPACE_SETTINGS)
+
+
+@receiver(post_save, sender=UserSwitchSetting)
+@receiver(post_delete, sender=UserSwitchSetting)
+@receiver(post_save, sender=UserVisibilitySetting)
+@receiver(post_delete, sender=UserVisibilitySetting)
+def activity_handler_user_setting_changed(sender, instance, **kwargs):
+    bump_cache_version(CACHE_NAMESPACE_USER_SETTINGS.format(user=instance.user_id))
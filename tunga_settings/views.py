@@ -4,6 +4,7 @@ from rest_framework.response import Response
 
 from tunga_settings.models import UserSwitchSetting, UserVisibilitySetting
 from tunga_settings.serializers import UserSettingsUpdateSerializer, UserSettingsSerializer
+from tunga_utils.cache import cache_response, CACHE_NAMESPACE_SETTINGS, CACHE_NAMESPACE_USER_SETTINGS
 
 
 class UserSettingsView(generics.GenericAPIView):
@@ -27,6 +28,7 @@ class UserSettingsView(generics.GenericAPIView):
             status=status.HTTP_401_UNAUTHORIZED
         )
 
+    @cache_response([CACHE_NAMESPACE_SETTINGS, CACHE_NAMESPACE_USER_SETTINGS])
     def get(self, request):
         user = self.get_object()
         if user is None:
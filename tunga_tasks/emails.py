@@ -9,10 +9,12 @@ from django_rq.decorators import job
 from tunga.settings import EMAIL_SUBJECT_PREFIX, TUNGA_URL, TUNGA_STAFF_UPDATE_EMAIL_RECIPIENTS
 from tunga_auth.filterbackends import my_connections_q_filter
 from tunga_auth.models import USER_TYPE_DEVELOPER
+from tunga_profiles.models import UserProfile
 from tunga_settings.models import VISIBILITY_DEVELOPER, VISIBILITY_MY_TEAM
 from tunga_tasks.models import Task, Participation, Application, ProgressEvent
 from tunga_utils.decorators import convert_first_arg_to_instance, clean_instance
-from tunga_utils.emails import send_mail
+from tunga_utils.emails import send_mail, send_mails, render_many, build_mail
+from tunga_utils.matching import annotate_skill_matches, get_skill_ids
 
 
 @job
@@ -25,22 +27,11 @@ def send_new_task_email(instance):
                 my_connections_q_filter(instance.user)
             )
         ordering = []
-        task_skills = instance.skills.all()
-        if task_skills:
-            when = []
-            for skill in task_skills:
-                new_when = When(
-                        userprofile__skills=skill,
-                        then=1
-                    )
-                when.append(new_when)
-            queryset = queryset.annotate(matches=Sum(
-                Case(
-                    *when,
-                    default=0,
-                    output_field=IntegerField()
-                )
-            ))
+        skill_ids = get_skill_ids(instance)
+        if skill_ids:
+            queryset = annotate_skill_matches(
+                skill_ids, queryset, skills_model=UserProfile, owner_field='user', only_matches=False
+            )
             ordering.append('-matches')
         ordering.append('-tasks_completed')
         queryset = queryset.annotate(
@@ -150,31 +141,61 @@ def send_new_task_application_applicant_email(instance):
 @job
 def send_task_application_not_selected_email(instance):
     instance = clean_instance(instance, Task)
-    rejected_applicants = instance.application_set.filter(responded=False)
+    rejected_applicants = list(instance.application_set.filter(responded=False).select_related('user'))
     if rejected_applicants:
         subject = "%s Your application was not accepted for: %s" % (EMAIL_SUBJECT_PREFIX, instance.summary)
-        to = [rejected_applicants[0].user.email]
-        bcc = [dev.user.email for dev in rejected_applicants[1:]] if len(rejected_applicants) > 1 else None
         ctx = {
             'task': instance,
             'task_url': '%s/task/%s/' % (TUNGA_URL, instance.id)
         }
-        send_mail(subject, 'tunga/email/email_task_application_not_selected', to, ctx, bcc=bcc)
+        bodies = render_many(
+            'tunga/email/email_task_application_not_selected',
+            [dict(ctx, applicant=application.user) for application in rejected_applicants]
+        )
+        send_mails([
+            build_mail(subject, application_bodies, [application.user.email])
+            for application, application_bodies in zip(rejected_applicants, bodies)
+        ])
 
 
 @job
 def send_progress_event_reminder_email(instance):
     instance = clean_instance(instance, ProgressEvent)
+    return send_progress_event_reminder_emails([instance.id])
+
+
+@job
+def send_progress_event_reminder_emails(events):
+    """
+    Sends the reminders of several progress events in one job over one mail server connection
+    :param events: Progress event ids
+    :return: number of reminders sent
+    """
     subject = "%s Upcoming Task Update" % (EMAIL_SUBJECT_PREFIX,)
-    participants = instance.task.participation_set.filter(accepted=True)
-    if participants:
-        to = [participants[0].user.email]
-        bcc = [participant.user.email for participant in participants[1:]] if participants.count() > 1 else None
-        ctx = {
-            'owner': instance.task.user,
-            'event': instance,
-            'update_url': '%s/task/%s/event/%s/' % (TUNGA_URL, instance.task.id, instance.id)
-        }
-        if send_mail(subject, 'tunga/email/email_progress_event_reminder', to, ctx, bcc=bcc):
-            instance.last_reminder_at = datetime.datetime.utcnow()
-            instance.save()
+    events = list(ProgressEvent.objects.filter(id__in=events).select_related('task', 'task__user'))
+
+    participants = dict()
+    for participant in Participation.objects.filter(
+            task__in=[event.task_id for event in events], accepted=True
+    ).select_related('user').order_by('id'):
+        participants.setdefault(participant.task_id, []).append(participant)
+
+    reminded_events = [event for event in events if participants.get(event.task_id, None)]
+    bodies = render_many('tunga/email/email_progress_event_reminder', [
+        {
+            'owner': event.task.user,
+            'event': event,
+            'update_url': '%s/task/%s/event/%s/' % (TUNGA_URL, event.task.id, event.id)
+        } for event in reminded_events
+    ])
+    messages = []
+    for event, event_bodies in zip(reminded_events, bodies):
+        task_participants = participants[event.task_id]
+        to = [task_participants[0].user.email]
+        bcc = [participant.user.email for participant in task_participants[1:]] or None
+        messages.append(build_mail(subject, event_bodies, to, bcc=bcc))
+
+    sent_ids = [event.id for event, sent in zip(reminded_events, send_mails(messages)) if sent]
+    if sent_ids:
+        ProgressEvent.objects.filter(id__in=sent_ids).update(last_reminder_at=datetime.datetime.utcnow())
+    return len(sent_ids)
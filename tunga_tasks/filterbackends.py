@@ -1,13 +1,12 @@
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.aggregates import Count, Sum
-from django.db.models.expressions import Case, When
-from django.db.models.fields import IntegerField
 from django.db.models.query_utils import Q
 from dry_rest_permissions.generics import DRYPermissionFiltersBase
 from tunga_auth.models import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER
-from tunga_profiles.models import UserProfile
-from tunga_settings.models import VISIBILITY_DEVELOPER, VISIBILITY_MY_TEAM, VISIBILITY_CUSTOM
+from tunga_profiles.models import UserProfile, Connection
+from tunga_settings.models import VISIBILITY_DEVELOPER
+from tunga_tasks.models import Participation, TaskVisibility
 from tunga_utils.filterbackends import dont_filter_staff_or_superuser
+from tunga_utils.matching import annotate_skill_matches, get_skill_ids
 
 
 class ProjectFilterBackend(DRYPermissionFiltersBase):
@@ -29,45 +28,25 @@ class TaskFilterBackend(DRYPermissionFiltersBase):
                 queryset = queryset.filter(closed=False)
             queryset = queryset.filter(
                 Q(user=request.user) |
-                (
-                    Q(participation__user=request.user) &
-                    (
-                        Q(participation__accepted=True) | Q(participation__responded=False)
-                    )
+                Q(
+                    id__in=Participation.objects.filter(
+                        Q(accepted=True) | Q(responded=False), user=request.user
+                    ).values('task_id')
                 )
             )
         elif label_filter == 'saved':
             queryset = queryset.filter(savedtask__user=request.user)
         elif label_filter == 'skills':
             try:
-                user_skills = request.user.userprofile.skills.all()
-                queryset = queryset.filter(skills__in=user_skills)
-                when = []
-                for skill in user_skills:
-                    new_when = When(
-                        skills=skill,
-                        then=1
-                    )
-                    when.append(new_when)
-                queryset = queryset.annotate(matches=Sum(
-                    Case(
-                        *when,
-                        default=0,
-                        output_field=IntegerField()
-                    )
-                )).order_by('-matches', '-created_at')
+                queryset = annotate_skill_matches(
+                    get_skill_ids(request.user.userprofile), queryset
+                ).order_by('-matches', '-created_at')
             except (ObjectDoesNotExist, UserProfile.DoesNotExist):
                 return queryset.none()
         elif label_filter in ['my-clients', 'project-owners']:
             queryset = queryset.filter(
-                (
-                    Q(user__connections_initiated__to_user=request.user) &
-                    Q(user__connections_initiated__accepted=True)
-                ) |
-                (
-                    Q(user__connection_requests__from_user=request.user) &
-                    Q(user__connection_requests__accepted=True)
-                )
+                Q(user__in=Connection.objects.filter(to_user=request.user, accepted=True).values('from_user_id')) |
+                Q(user__in=Connection.objects.filter(from_user=request.user, accepted=True).values('to_user_id'))
             )
 
         if request.user.is_staff or request.user.is_superuser:
@@ -75,26 +54,12 @@ class TaskFilterBackend(DRYPermissionFiltersBase):
         if request.user.type == USER_TYPE_PROJECT_OWNER:
             queryset = queryset.filter(user=request.user)
         elif request.user.type == USER_TYPE_DEVELOPER:
+            # Tasks the developer owns, participates in or can see through a connection are read from the
+            # denormalized visibility index instead of joining participation and connections
             return queryset.filter(
-                Q(user=request.user) |
-                Q(participation__user=request.user) |
-                (
-                    Q(visibility=VISIBILITY_DEVELOPER) |
-                    (
-                        Q(visibility=VISIBILITY_MY_TEAM) &
-                        (
-                            (
-                                Q(user__connections_initiated__to_user=request.user) &
-                                Q(user__connections_initiated__accepted=True)
-                            ) |
-                            (
-                                Q(user__connection_requests__from_user=request.user) &
-                                Q(user__connection_requests__accepted=True)
-                            )
-                        )
-                    )
-                )
-            ).distinct()
+                Q(visibility=VISIBILITY_DEVELOPER) |
+                Q(id__in=TaskVisibility.objects.filter(user=request.user).values('task_id'))
+            )
         else:
             return queryset.none()
         return queryset
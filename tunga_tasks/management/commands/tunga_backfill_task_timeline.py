@@ -0,0 +1,45 @@
+from actstream.models import Action
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tunga_tasks.models import Task, TaskTimelineEntry
+from tunga_tasks.tasks import get_id_ranges, create_task_timeline_entries
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true', dest='rebuild', default=False,
+            help='Delete all timeline entries and add every task action again'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=500, help='Actions added per transaction'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Add task actions that aren't on their task's timeline yet e.g actions sent before the timeline existed.
+        """
+        # command to run: python manage.py tunga_backfill_task_timeline
+
+        if options['rebuild']:
+            TaskTimelineEntry.objects.all().delete()
+
+        task_content_type = ContentType.objects.get_for_model(Task)
+        queryset = Action.objects.filter(target_content_type=task_content_type, task_timeline_entry__isnull=True)
+
+        total = 0
+        for min_id, max_id in get_id_ranges(queryset, chunk_size=options['batch_size']):
+            actions = list(queryset.filter(id__range=[min_id, max_id]))
+            # Actions outlive deleted tasks, they have no timeline to be added to
+            task_ids = set(Task.objects.filter(
+                id__in=[int(action.target_object_id) for action in actions]
+            ).values_list('id', flat=True))
+            with transaction.atomic():
+                total += create_task_timeline_entries(
+                    [action for action in actions if int(action.target_object_id) in task_ids]
+                )
+
+        print "%s timeline entries created" % total
@@ -1,31 +1,75 @@
-import datetime
+import time
+from multiprocessing import Pool
 
-from dateutil.relativedelta import relativedelta
 from django.core.management.base import BaseCommand
+from django.db import connections
 
-from tunga_tasks.emails import send_progress_event_reminder_email
-from tunga_tasks.models import Task, ProgressEvent
-from tunga_tasks.tasks import initialize_task_progress_events
+from tunga_tasks.models import Task
+from tunga_tasks.tasks import get_id_ranges, manage_task_progress
+
+
+def manage_task_progress_chunk(chunk):
+    min_id, max_id, dry_run = chunk
+    return manage_task_progress(min_id, max_id, dry_run=dry_run)
 
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of processes chunks are spread across, 1 processes them in this process'
+        )
+        parser.add_argument('--chunk-size', type=int, dest='chunk_size', default=500, help='Open tasks per chunk')
+        parser.add_argument(
+            '--rq', action='store_true', dest='rq', default=False,
+            help='Queue each chunk as an RQ job instead of processing it here'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Count the progress events and reminders without creating or sending them'
+        )
+
     def handle(self, *args, **options):
         """
         Update periodic update events and send notifications for upcoming update events.
+        Open tasks are processed in id ranged chunks, optionally across a process pool or RQ workers.
         """
         # command to run: python manage.py tunga_manage_task_progress
 
-        tasks = Task.objects.filter(closed=False)
-        for task in tasks:
-            # Creates the next periodic events and reconciles submit events if necessary
-            initialize_task_progress_events(task)
+        start = time.time()
+        dry_run = options['dry_run']
+        chunks = [
+            (min_id, max_id, dry_run)
+            for min_id, max_id in get_id_ranges(Task.objects.filter(closed=False), chunk_size=options['chunk_size'])
+        ]
+
+        if options['rq']:
+            for min_id, max_id, dry_run in chunks:
+                manage_task_progress.delay(min_id, max_id, dry_run=dry_run)
+            print "%s chunks queued" % len(chunks)
+            return
 
-        min_date = datetime.datetime.utcnow()
-        max_date = min_date + relativedelta(hours=24)
+        totals = {'tasks': 0, 'events': 0, 'reminders': 0}
+        if options['workers'] > 1 and len(chunks) > 1:
+            # Forked workers must open their own database connections
+            connections.close_all()
+            pool = Pool(processes=options['workers'])
+            try:
+                results = list(pool.imap_unordered(manage_task_progress_chunk, chunks))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [manage_task_progress_chunk(chunk) for chunk in chunks]
+        for result in results:
+            for key in totals:
+                totals[key] += result[key]
 
-        events = ProgressEvent.objects.filter(
-            task__closed=False, due_at__range=[min_date, max_date], last_reminder_at__isnull=True
+        elapsed = time.time() - start
+        print "%s%s tasks in %s chunks, %s progress events %s, %s reminders %s" % (
+            dry_run and '[dry run] ' or '', totals['tasks'], len(chunks),
+            totals['events'], dry_run and 'to create' or 'created',
+            totals['reminders'], dry_run and 'to send' or 'sent'
         )
-        for event in events:
-            send_progress_event_reminder_email(event.id)
+        print "%.2fs elapsed, %.1f tasks/s" % (elapsed, elapsed and totals['tasks'] / elapsed or 0)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from tunga_tasks.tasks import process_integration_deliveries
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('deliveries', nargs='*', type=int, help='Ids of the deliveries to process')
+        parser.add_argument(
+            '--replay', action='store_true', dest='replay', default=False,
+            help='Reprocess deliveries that were already processed and replace their activities'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=100, help='Deliveries processed per transaction'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Process stored integration web hook deliveries into activities, e.g to replay deliveries after a parser fix.
+        """
+        # command to run: python manage.py tunga_process_integration_deliveries
+
+        total = process_integration_deliveries(
+            deliveries=options['deliveries'] or None, replay=options['replay'], batch_size=options['batch_size']
+        )
+
+        print "%s integration activities created" % total
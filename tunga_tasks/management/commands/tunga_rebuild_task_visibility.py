@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from tunga_tasks.tasks import rebuild_task_visibility
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        """
+        Rebuild the task visibility index from tasks, participation and connections.
+        """
+        # command to run: python manage.py tunga_rebuild_task_visibility
+
+        total = rebuild_task_visibility()
+
+        print "%s task visibility entries indexed" % total
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 17:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_tasks', '0022_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IntegrationDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery_id', models.CharField(max_length=50, unique=True)),
+                ('event', models.CharField(max_length=50)),
+                ('payload', models.TextField()),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('integration', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='tunga_tasks.Integration')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'verbose_name_plural': 'integration deliveries',
+            },
+        ),
+        migrations.AddField(
+            model_name='integrationactivity',
+            name='delivery',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='activities', to='tunga_tasks.IntegrationDelivery'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 18:29
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actstream', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tunga_tasks', '0023_integrationdelivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskTimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('verb', models.CharField(max_length=255)),
+                ('payload', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('action', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='task_timeline_entry', to='actstream.Action')),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='task_timeline_entries', to=settings.AUTH_USER_MODEL)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='tunga_tasks.Task')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'verbose_name_plural': 'task timeline entries',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='tasktimelineentry',
+            index_together=set([('task', 'created_at', 'id')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-19 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tunga_tasks', '0024_tasktimelineentry'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='tasktimelineentry',
+            name='payload',
+        ),
+    ]
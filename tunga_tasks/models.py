@@ -2,16 +2,14 @@
 from __future__ import unicode_literals
 
 import re
-import urllib
 
-import requests
 import tagulous.models
+from actstream.models import Action
 from allauth.socialaccount import providers
 from django.contrib.contenttypes.fields import GenericRelation, GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from django.db.models.query_utils import Q
 from django.template.defaultfilters import floatformat
 from django.utils.crypto import get_random_string
 from django.utils.html import strip_tags
@@ -23,9 +21,11 @@ from tunga.settings.base import TUNGA_SHARE_PERCENTAGE, TUNGA_SHARE_EMAIL
 from tunga_auth.models import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER
 from tunga_comments.models import Comment
 from tunga_messages.models import Channel
-from tunga_profiles.models import Skill, Connection
+from tunga_profiles.models import Skill
 from tunga_settings.models import VISIBILITY_DEVELOPER, VISIBILITY_MY_TEAM, VISIBILITY_CUSTOM, VISIBILITY_CHOICES
+from tunga_utils.mobbr import get_mobbr_script
 from tunga_utils.models import Upload, Rating
+from tunga_utils.permissions import get_permission_cache
 
 CURRENCY_EUR = 'EUR'
 CURRENCY_USD = 'USD'
@@ -137,6 +137,8 @@ class Task(models.Model):
     class Meta:
         ordering = ['-created_at']
         unique_together = ('user', 'title', 'fee')
+        # Keyset pagination key
+        index_together = (('created_at', 'id'),)
 
     @staticmethod
     @allow_staff_or_superuser
@@ -148,13 +150,9 @@ class Task(models.Model):
         if self.visibility == VISIBILITY_DEVELOPER:
             return request.user.type == USER_TYPE_DEVELOPER
         elif self.visibility == VISIBILITY_MY_TEAM:
-            return bool(
-                Connection.objects.exclude(accepted=False).filter(
-                    Q(from_user=self.user, to_user=request.user) | Q(from_user=request.user, to_user=self.user)
-                ).count()
-            )
+            return get_permission_cache(request).is_connected(self.user_id)
         elif self.visibility == VISIBILITY_CUSTOM:
-            return self.participation_set.filter((Q(accepted=True) | Q(responded=False)), user=request.user).count()
+            return get_permission_cache(request).is_participant(self.id)
         return False
 
     @staticmethod
@@ -169,7 +167,7 @@ class Task(models.Model):
 
     @allow_staff_or_superuser
     def has_object_write_permission(self, request):
-        return request.user == self.user
+        return request.user.id == self.user_id
 
     @allow_staff_or_superuser
     def has_object_update_permission(self, request):
@@ -179,7 +177,7 @@ class Task(models.Model):
         if request.method in ['PUT', 'PATCH']:
             allowed_keys = ['assignee', 'participants', 'confirmed_participants', 'rejected_participants']
             if not [x for x in request.data.keys() if not x in allowed_keys]:
-                return self.participation_set.filter((Q(accepted=True) | Q(responded=False)), user=request.user).count()
+                return get_permission_cache(request).is_participant(self.id)
         return False
 
     def display_fee(self, amount=None):
@@ -204,9 +202,15 @@ class Task(models.Model):
     def skills_list(self):
         return str(self.skills)
 
+    # The properties below filter in python over the related managers
+    # so that they are served from prefetched data when the task was loaded with TaskViewSet's queryset plan
+
     @property
     def milestones(self):
-        return self.progressevent_set.filter(type__in=[PROGRESS_EVENT_TYPE_MILESTONE, PROGRESS_EVENT_TYPE_SUBMIT])
+        return [
+            event for event in self.progressevent_set.all()
+            if event.type in [PROGRESS_EVENT_TYPE_MILESTONE, PROGRESS_EVENT_TYPE_SUBMIT]
+        ]
 
     @property
     def progress_events(self):
@@ -214,14 +218,14 @@ class Task(models.Model):
 
     @property
     def participation(self):
-        return self.participation_set.filter(Q(accepted=True) | Q(responded=False))
+        return [item for item in self.participation_set.all() if item.accepted or not item.responded]
 
     @property
     def assignee(self):
-        try:
-            return self.participation_set.get((Q(accepted=True) | Q(responded=False)), assignee=True)
-        except:
-            return None
+        for item in self.participation:
+            if item.assignee:
+                return item
+        return None
 
     @property
     def update_schedule_display(self):
@@ -236,11 +240,19 @@ class Task(models.Model):
 
     @property
     def applications(self):
-        return self.application_set.filter(responded=False)
+        return [application for application in self.application_set.all() if not application.responded]
 
     @property
     def all_uploads(self):
-        return Upload.objects.filter(Q(tasks=self) | Q(comments__tasks=self) | Q(progress_reports__event__task=self))
+        uploads = list(self.uploads.all())
+        for comment in self.comments.all():
+            uploads.extend(comment.uploads.all())
+        for event in self.progressevent_set.all():
+            try:
+                uploads.extend(event.progressreport.uploads.all())
+            except ProgressReport.DoesNotExist:
+                pass
+        return sorted(uploads, key=lambda upload: upload.created_at, reverse=True)
 
     @property
     def meta_payment(self):
@@ -263,12 +275,10 @@ class Task(models.Model):
         if not self.url:
             return participation_meta, False
 
-        mobbr_info_url = '%s?url=%s' % ('https://api.mobbr.com/api_v1/uris/info', urllib.quote_plus(self.url))
-        r = requests.get(mobbr_info_url, **{'headers': {'Accept': 'application/json'}})
+        # Cached and refreshed in the background, see tunga_utils.mobbr
+        task_script = get_mobbr_script(self.url)
         has_script = False
-        if r.status_code == 200:
-            response = r.json()
-            task_script = response['result']['script']
+        if task_script:
             for meta_key in participation_meta:
                 if meta_key == 'keywords':
                     if isinstance(task_script[meta_key], list):
@@ -377,12 +387,12 @@ class Application(models.Model):
 
     @allow_staff_or_superuser
     def has_object_write_permission(self, request):
-        return request.user == self.user
+        return request.user.id == self.user_id
 
     @allow_staff_or_superuser
     def has_object_update_permission(self, request):
         # Task owner can update applications
-        return request.user == self.user or request.user == self.task.user
+        return request.user.id in (self.user_id, self.task.user_id)
 
 
 class Participation(models.Model):
@@ -482,6 +492,24 @@ class SavedTask(models.Model):
         return request.user == self.user
 
 
+class TaskVisibility(models.Model):
+    """
+    Denormalized index of the users a task is explicitly visible to i.e the owner, participants and
+    for team tasks the owner's connections. Tasks visible to all developers are not indexed.
+    Kept up to date by tunga_tasks.signals and rebuilt by the tunga_rebuild_task_visibility command.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='visible_tasks')
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='visibility_index')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return '%s - %s' % (self.user.get_short_name() or self.user.username, self.task.summary)
+
+    class Meta:
+        unique_together = ('user', 'task')
+        verbose_name_plural = 'task visibility'
+
+
 PROGRESS_EVENT_TYPE_DEFAULT = 1
 PROGRESS_EVENT_TYPE_PERIODIC = 2
 PROGRESS_EVENT_TYPE_MILESTONE = 3
@@ -699,8 +727,30 @@ class IntegrationMeta(models.Model):
         ordering = ['created_at']
 
 
+class IntegrationDelivery(models.Model):
+    """
+    Raw web hook delivery, stored by the hook endpoint and turned into activities by the github queue's worker
+    """
+    integration = models.ForeignKey(Integration, on_delete=models.CASCADE, related_name='deliveries')
+    delivery_id = models.CharField(max_length=50, unique=True)
+    event = models.CharField(max_length=50)
+    payload = models.TextField()
+    processed_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return '%s | %s - %s' % (self.integration, self.event, self.delivery_id)
+
+    class Meta:
+        verbose_name_plural = 'integration deliveries'
+        ordering = ['created_at']
+
+
 class IntegrationActivity(models.Model):
     integration = models.ForeignKey(Integration, on_delete=models.CASCADE, related_name='activities')
+    delivery = models.ForeignKey(
+        IntegrationDelivery, on_delete=models.SET_NULL, related_name='activities', blank=True, null=True
+    )
     event = models.ForeignKey(IntegrationEvent, related_name='integration_activities')
     action = models.CharField(max_length=30, blank=True, null=True)
     url = models.URLField(blank=True, null=True)
@@ -719,3 +769,26 @@ class IntegrationActivity(models.Model):
 
     class Meta:
         ordering = ['created_at']
+
+
+class TaskTimelineEntry(models.Model):
+    """
+    Index of the actions that target a task, so a task's timeline is paged with a range scan on (task, created_at, id)
+    instead of filtering actions on their generic target. Pages are serialized when they're read.
+    """
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='timeline_entries')
+    action = models.OneToOneField(Action, on_delete=models.CASCADE, related_name='task_timeline_entry')
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, related_name='task_timeline_entries',
+        blank=True, null=True
+    )
+    verb = models.CharField(max_length=255)
+    created_at = models.DateTimeField()
+
+    def __unicode__(self):
+        return '%s | %s' % (self.task, self.verb)
+
+    class Meta:
+        verbose_name_plural = 'task timeline entries'
+        ordering = ['-created_at']
+        index_together = (('task', 'created_at', 'id'),)
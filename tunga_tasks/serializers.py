@@ -2,7 +2,6 @@ import datetime
 
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.query_utils import Q
 from rest_framework import serializers
 
 from tunga.settings.base import TUNGA_SHARE_PERCENTAGE
@@ -13,11 +12,18 @@ from tunga_tasks.models import Task, Application, Participation, TaskRequest, Sa
     PROGRESS_EVENT_TYPE_MILESTONE, \
     Project, IntegrationMeta, Integration, IntegrationEvent, IntegrationActivity
 from tunga_tasks.signals import application_response, participation_response, task_applications_closed, task_closed
+from tunga_utils.cache import FragmentCacheSerializerMixin
+from tunga_utils.export import EXPORT_FORMAT_CHOICES, EXPORT_FORMAT_CSV
 from tunga_utils.mixins import GetCurrentUserAnnotatedSerializerMixin
+from tunga_utils.permissions import filter_permitted
 from tunga_utils.models import Rating
 from tunga_utils.serializers import ContentTypeAnnotatedModelSerializer, SkillSerializer, \
     CreateOnlyCurrentUserDefault, SimpleUserSerializer, UploadSerializer, DetailAnnotatedModelSerializer, \
-    SimpleRatingSerializer
+    SimpleRatingSerializer, TagStringField, get_prefetched_tags
+
+
+class ExportSerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=EXPORT_FORMAT_CHOICES, required=False, default=EXPORT_FORMAT_CSV)
 
 
 class SimpleProjectSerializer(ContentTypeAnnotatedModelSerializer):
@@ -27,13 +33,16 @@ class SimpleProjectSerializer(ContentTypeAnnotatedModelSerializer):
         model = Project
 
 
-class SimpleTaskSerializer(ContentTypeAnnotatedModelSerializer):
+class SimpleTaskSerializer(FragmentCacheSerializerMixin, ContentTypeAnnotatedModelSerializer):
     user = SimpleUserSerializer()
 
     class Meta:
         model = Task
         fields = ('id', 'user', 'title', 'currency', 'fee', 'closed', 'paid', 'display_fee')
 
+    def get_fragment_dependencies(self, instance):
+        return [(Task, instance.id), (get_user_model(), instance.user_id)]
+
 
 class SimpleApplicationSerializer(ContentTypeAnnotatedModelSerializer):
     user = SimpleUserSerializer()
@@ -126,22 +135,33 @@ class ProjectSerializer(ContentTypeAnnotatedModelSerializer, DetailAnnotatedMode
 class TaskDetailsSerializer(ContentTypeAnnotatedModelSerializer):
     project = SimpleProjectSerializer()
     user = SimpleUserSerializer()
-    skills = SkillSerializer(many=True)
+    skills = serializers.SerializerMethodField()
     assignee = SimpleParticipationSerializer(required=False, read_only=True)
-    applications = SimpleApplicationSerializer(many=True, source='application_set')
+    applications = serializers.SerializerMethodField()
     participation = SimpleParticipationSerializer(many=True, source='participation_set')
 
     class Meta:
         model = Task
         fields = ('project', 'user', 'skills', 'assignee', 'applications', 'participation')
 
+    def get_skills(self, obj):
+        return SkillSerializer(get_prefetched_tags(obj, 'skills'), many=True).data
+
+    def get_applications(self, obj):
+        # Only the task owner and the applicants themselves can read an application
+        applications = obj.application_set.all()
+        request = self.context.get('request', None)
+        if request:
+            applications = filter_permitted(request, applications, related=['task'])
+        return SimpleApplicationSerializer(applications, many=True).data
+
 
 class TaskSerializer(ContentTypeAnnotatedModelSerializer, DetailAnnotatedModelSerializer,
                      GetCurrentUserAnnotatedSerializerMixin):
     user = serializers.PrimaryKeyRelatedField(required=False, read_only=True, default=CreateOnlyCurrentUserDefault())
     display_fee = serializers.SerializerMethodField(required=False, read_only=True)
     excerpt = serializers.CharField(required=False, read_only=True)
-    skills = serializers.CharField(required=True, allow_blank=True, allow_null=True)
+    skills = TagStringField(required=True, allow_blank=True, allow_null=True)
     deadline = serializers.DateTimeField(required=False, allow_null=True)
     can_apply = serializers.SerializerMethodField(read_only=True, required=False)
     can_save = serializers.SerializerMethodField(read_only=True, required=False)
@@ -167,6 +187,9 @@ class TaskSerializer(ContentTypeAnnotatedModelSerializer, DetailAnnotatedModelSe
         read_only_fields = ('created_at',)
         details_serializer = TaskDetailsSerializer
 
+    def get_details(self, obj):
+        return TaskDetailsSerializer(obj, context=self.context).data
+
     def create(self, validated_data):
         skills = None
         participation = None
@@ -322,49 +345,55 @@ class TaskSerializer(ContentTypeAnnotatedModelSerializer, DetailAnnotatedModelSe
             amount = obj.fee * (1 - TUNGA_SHARE_PERCENTAGE * 0.01)
         return obj.display_fee(amount=amount)
 
+    def get_current_user_participation(self, obj):
+        user = self.get_current_user()
+        if user:
+            for participation in obj.participation_set.all():
+                if participation.user_id == user.id:
+                    return participation
+        return None
+
     def get_can_apply(self, obj):
         if obj.closed or not obj.apply:
             return False
         user = self.get_current_user()
         if user:
-            if obj.user == user or user.pending:
+            if obj.user_id == user.id or user.pending:
                 return False
-            return obj.applicants.filter(id=user.id).count() == 0 and \
-                   obj.participation_set.filter(user=user).count() == 0
+            has_applied = [application for application in obj.application_set.all() if application.user_id == user.id]
+            return not has_applied and self.get_current_user_participation(obj) is None
         return False
 
     def get_can_save(self, obj):
         user = self.get_current_user()
         if user:
-            if obj.user == user:
+            if obj.user_id == user.id:
                 return False
+            # Set by TaskViewSet when the current user's saved tasks are prefetched
+            saved_tasks = getattr(obj, 'current_user_saved_tasks', None)
+            if saved_tasks is not None:
+                return len(saved_tasks) == 0
             return obj.savedtask_set.filter(user=user).count() == 0
         return False
 
     def get_is_participant(self, obj):
-        user = self.get_current_user()
-        if user:
-            return obj.participation_set.filter((Q(accepted=True) | Q(responded=False)), user=user).count() == 1
-        return False
+        participation = self.get_current_user_participation(obj)
+        return bool(participation and (participation.accepted or not participation.responded))
 
     def get_my_participation(self, obj):
-        user = self.get_current_user()
-        if user:
-            try:
-                participation = obj.participation_set.get(user=user)
-                return {
-                    'id': participation.id,
-                    'user': participation.user.id,
-                    'assignee': participation.assignee,
-                    'accepted': participation.accepted,
-                    'responded': participation.responded
-                }
-            except:
-                pass
+        participation = self.get_current_user_participation(obj)
+        if participation:
+            return {
+                'id': participation.id,
+                'user': participation.user_id,
+                'assignee': participation.assignee,
+                'accepted': participation.accepted,
+                'responded': participation.responded
+            }
         return None
 
     def get_open_applications(self, obj):
-        return obj.application_set.filter(responded=False).count()
+        return len(obj.applications)
 
 
 class ApplicationDetailsSerializer(SimpleApplicationSerializer):
@@ -1,15 +1,22 @@
+import threading
+
+from actstream.models import Action
 from actstream.signals import action
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete, post_delete
 from django.dispatch.dispatcher import receiver, Signal
 
 from tunga_activity import verbs
 from tunga_messages.tasks import create_channel
+from tunga_profiles.models import Connection
 from tunga_tasks.emails import send_new_task_application_email, send_new_task_application_applicant_email, \
     send_new_task_invitation_email, send_new_task_application_response_email, send_new_task_invitation_response_email, \
     send_task_application_not_selected_email
 from tunga_tasks.models import Task, Application, Participation, TaskRequest, ProgressEvent, ProgressReport, \
     IntegrationActivity, Integration
-from tunga_tasks.tasks import initialize_task_progress_events, update_task_periodic_updates
+from tunga_tasks.tasks import initialize_task_progress_events, update_task_periodic_updates, update_task_visibility, \
+    update_team_task_visibility, create_task_timeline_entries
+from tunga_utils.cache import bump_fragment_version
+from tunga_utils.mobbr import get_mobbr_script
 
 task_applications_closed = Signal(providing_args=["task"])
 
@@ -19,6 +26,15 @@ application_response = Signal(providing_args=["application"])
 
 participation_response = Signal(providing_args=["participation"])
 
+# Ids of the tasks being deleted by this thread, their cascaded participation doesn't rebuild their visibility
+_deleting_tasks = threading.local()
+
+
+def get_deleting_task_ids():
+    if not hasattr(_deleting_tasks, 'ids'):
+        _deleting_tasks.ids = set()
+    return _deleting_tasks.ids
+
 
 @receiver(post_save, sender=Task)
 def activity_handler_new_task(sender, instance, created, **kwargs):
@@ -27,6 +43,14 @@ def activity_handler_new_task(sender, instance, created, **kwargs):
 
         initialize_task_progress_events.delay(instance.id)
 
+    # Index updates run inline so that task lists are consistent as soon as the request returns
+    update_task_visibility(instance)
+    bump_fragment_version(Task, instance.id)
+
+    if instance.url:
+        # Queues the first fetch of the task's participation script before its page or meta data is requested
+        get_mobbr_script(instance.url)
+
 
 @receiver(task_applications_closed, sender=Task)
 def activity_handler_task_applications_closed(sender, task, **kwargs):
@@ -84,6 +108,25 @@ def activity_handler_new_participant(sender, instance, created, **kwargs):
         if instance.accepted:
             update_task_periodic_updates.delay(instance.task.id)
 
+        update_task_visibility(instance.task)
+
+
+@receiver(pre_delete, sender=Task)
+def activity_handler_task_deleting(sender, instance, **kwargs):
+    # The task's visibility rows are deleted with it, rebuilding them in between would orphan them
+    get_deleting_task_ids().add(instance.id)
+
+
+@receiver(post_delete, sender=Task)
+def activity_handler_task_deleted(sender, instance, **kwargs):
+    get_deleting_task_ids().discard(instance.id)
+
+
+@receiver(post_delete, sender=Participation)
+def activity_handler_participation_removed(sender, instance, **kwargs):
+    if instance.task_id not in get_deleting_task_ids():
+        update_task_visibility(instance.task_id)
+
 
 @receiver(participation_response, sender=Participation)
 def activity_handler_participation_response(sender, participation, **kwargs):
@@ -131,3 +174,17 @@ def activity_handler_integration(sender, instance, created, **kwargs):
 def activity_handler_integration_activity(sender, instance, created, **kwargs):
     if created:
         action.send(instance.integration, verb=verbs.REPORT, action_object=instance, target=instance.integration.task)
+
+
+@receiver(post_save, sender=Connection)
+@receiver(post_delete, sender=Connection)
+def activity_handler_connection_changed(sender, instance, **kwargs):
+    update_team_task_visibility(instance.from_user_id)
+    update_team_task_visibility(instance.to_user_id)
+
+
+@receiver(post_save, sender=Action)
+def activity_handler_task_timeline(sender, instance, created, **kwargs):
+    # Every action sent with a task as its target e.g task, comment and integration activity is added to its timeline
+    if created:
+        create_task_timeline_entries([instance])
@@ -1,12 +1,24 @@
 import datetime
+import json
 
+from actstream.models import Action
 from dateutil.relativedelta import relativedelta
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from django.db.models.aggregates import Min, Max
 from django_rq.decorators import job
 
+from tunga_activity import verbs
+from tunga_profiles.models import Connection
+from tunga_settings.models import VISIBILITY_MY_TEAM
+from tunga_tasks import slugs
+from tunga_tasks.emails import send_progress_event_reminder_emails
 from tunga_tasks.models import ProgressEvent, PROGRESS_EVENT_TYPE_SUBMIT, PROGRESS_EVENT_TYPE_PERIODIC, \
     UPDATE_SCHEDULE_ANNUALLY, UPDATE_SCHEDULE_HOURLY, UPDATE_SCHEDULE_DAILY, UPDATE_SCHEDULE_WEEKLY, \
-    UPDATE_SCHEDULE_MONTHLY, UPDATE_SCHEDULE_QUATERLY, Task
+    UPDATE_SCHEDULE_MONTHLY, UPDATE_SCHEDULE_QUATERLY, Task, Participation, TaskVisibility, Integration, \
+    IntegrationEvent, IntegrationDelivery, IntegrationActivity, TaskTimelineEntry
+from tunga_utils import github
 from tunga_utils.decorators import convert_first_arg_to_instance, clean_instance
 
 
@@ -27,45 +39,362 @@ def update_task_submit_milestone(task):
         ProgressEvent.objects.update_or_create(task=task, type=PROGRESS_EVENT_TYPE_SUBMIT, defaults=defaults)
 
 
+PERIODIC_UPDATE_DELTAS = {
+    UPDATE_SCHEDULE_HOURLY: ('hours', 1),
+    UPDATE_SCHEDULE_DAILY: ('days', 1),
+    UPDATE_SCHEDULE_WEEKLY: ('weeks', 1),
+    UPDATE_SCHEDULE_MONTHLY: ('months', 1),
+    UPDATE_SCHEDULE_QUATERLY: ('months', 3),
+    UPDATE_SCHEDULE_ANNUALLY: ('years', 1)
+}
+
+
+def get_periodic_update_dates(start_date, update_interval, update_interval_units, deadline=None, now=None):
+    """
+    Computes the due dates of a periodic update schedule in memory
+    :param start_date: Schedule start, e.g the latest periodic update or when the first participant was activated
+    :return: list of due dates after the start date, up to and including the first one after now
+    and stopping at the deadline
+    """
+    period_info = PERIODIC_UPDATE_DELTAS.get(update_interval_units, None)
+    if not start_date or not update_interval or not period_info:
+        return []
+    now = now or datetime.datetime.utcnow()
+    unit, multiplier = period_info
+
+    due_dates = []
+    step = 1
+    while True:
+        # Offsets from the start date rather than from the previous date so month ends don't drift
+        due_at = start_date + relativedelta(**{unit: multiplier * update_interval * step})
+        if deadline and due_at >= deadline:
+            break
+        due_dates.append(due_at)
+        if due_at > now:
+            break
+        step += 1
+    return due_dates
+
+
+def create_periodic_updates(tasks, now=None, batch_size=1000, dry_run=False):
+    """
+    Creates the missing periodic progress events of one or more tasks.
+    Schedules are computed in memory and diffed against the tasks' existing (task, due_at) rows in one query.
+    Events are unique per (task, due_at), so a slot that's taken by any event, e.g the submit milestone,
+    is skipped instead of failing the insert.
+    The events are bulk created so their create actions and timeline entries are bulk created here as well.
+    :param tasks: Task instances
+    :param dry_run: Only count the missing events
+    :return: number of progress events created
+    """
+    tasks = [task for task in tasks if task and task.update_interval and task.update_interval_units]
+    if not tasks:
+        return 0
+    now = now or datetime.datetime.utcnow()
+    task_ids = [task.id for task in tasks]
+
+    start_dates = dict(
+        ProgressEvent.objects.filter(
+            task_id__in=task_ids, type=PROGRESS_EVENT_TYPE_PERIODIC
+        ).order_by().values_list('task_id').annotate(latest_date=Max('due_at'))
+    )
+    unscheduled_task_ids = [task_id for task_id in task_ids if task_id not in start_dates]
+    if unscheduled_task_ids:
+        start_dates.update(
+            Participation.objects.filter(
+                task_id__in=unscheduled_task_ids, accepted=True
+            ).order_by().values_list('task_id').annotate(start_date=Min('activated_at'))
+        )
+
+    due_dates = dict()
+    for task in tasks:
+        start_date = start_dates.get(task.id, None)
+        if start_date and start_date <= now:
+            task_due_dates = get_periodic_update_dates(
+                start_date, task.update_interval, task.update_interval_units, deadline=task.deadline, now=now
+            )
+            if task_due_dates:
+                due_dates[task.id] = task_due_dates
+    if not due_dates:
+        return 0
+
+    first_due_at = min([task_due_dates[0] for task_due_dates in due_dates.itervalues()])
+    scheduled_events = ProgressEvent.objects.filter(task_id__in=due_dates.keys(), due_at__gte=first_due_at)
+    existing = set(scheduled_events.values_list('task_id', 'due_at'))
+    events = [
+        ProgressEvent(task_id=task_id, type=PROGRESS_EVENT_TYPE_PERIODIC, due_at=due_at)
+        for task_id, task_due_dates in due_dates.iteritems() for due_at in task_due_dates
+        if (task_id, due_at) not in existing
+    ]
+    if not events or dry_run:
+        return len(events)
+
+    with transaction.atomic():
+        ProgressEvent.objects.bulk_create(events, batch_size=batch_size)
+        # bulk_create doesn't set ids, read the new events back for their actions
+        created_events = [
+            event for event in scheduled_events.only('id', 'task_id', 'due_at')
+            if (event.task_id, event.due_at) not in existing
+        ]
+
+        # Same actions activity_handler_progress_event sends for events created one at a time
+        owner_ids = dict([(task.id, task.user_id) for task in tasks])
+        user_content_type = ContentType.objects.get_for_model(get_user_model())
+        event_content_type = ContentType.objects.get_for_model(ProgressEvent)
+        task_content_type = ContentType.objects.get_for_model(Task)
+        Action.objects.bulk_create([
+            Action(
+                actor_content_type=user_content_type, actor_object_id=owner_ids[event.task_id],
+                verb=verbs.CREATE,
+                action_object_content_type=event_content_type, action_object_object_id=event.id,
+                target_content_type=task_content_type, target_object_id=event.task_id,
+                timestamp=now
+            ) for event in created_events
+        ], batch_size=batch_size)
+        # bulk_create doesn't send post_save either, so the new actions are added to the task timelines here
+        create_task_timeline_entries(Action.objects.filter(
+            action_object_content_type=event_content_type,
+            action_object_object_id__in=[str(event.id) for event in created_events]
+        ))
+    return len(events)
+
+
 @job
 def update_task_periodic_updates(task):
     task = clean_instance(task, Task)
-    if task.update_interval and task.update_interval_units:
-        periodic_start_date = task.progressevent_set.filter(
-            task=task, type=PROGRESS_EVENT_TYPE_PERIODIC
-        ).aggregate(latest_date=Max('due_at'))['latest_date']
-
-        now = datetime.datetime.utcnow()
-        if periodic_start_date and periodic_start_date > now:
-            return
-
-        if not periodic_start_date:
-            periodic_start_date = task.participation_set.filter(
-                task=task, accepted=True
-            ).aggregate(start_date=Min('activated_at'))['start_date']
-
-        if periodic_start_date:
-            period_map = {
-                UPDATE_SCHEDULE_HOURLY: 'hours',
-                UPDATE_SCHEDULE_DAILY: 'days',
-                UPDATE_SCHEDULE_WEEKLY: 'weeks',
-                UPDATE_SCHEDULE_MONTHLY: 'months',
-                UPDATE_SCHEDULE_QUATERLY: {'months': 3},
-                UPDATE_SCHEDULE_ANNUALLY: 'years'
-            }
-            period_info = period_map.get(task.update_interval_units, None)
-            if period_info:
-                unit = isinstance(period_info, dict) and period_info.keys()[0] or period_info
-                multiplier = isinstance(period_info, dict) and period_info.values()[0] or 1
-                delta = {unit: multiplier*task.update_interval_units}
-                last_update_at = periodic_start_date
-                while True:
-                    next_update_at = last_update_at + relativedelta(**delta)
-                    if not task.deadline or next_update_at < task.deadline:
-                        ProgressEvent.objects.update_or_create(
-                            task=task, type=PROGRESS_EVENT_TYPE_PERIODIC, due_at=next_update_at
-                        )
-                    if next_update_at > now:
-                        break
-                    else:
-                        last_update_at = next_update_at
+    return create_periodic_updates([task])
+
+
+def get_id_ranges(queryset, chunk_size=500):
+    """
+    Streams the ids of a queryset in order and groups them into (first id, last id) ranges of up to chunk_size rows
+    """
+    first_id = last_id = None
+    count = 0
+    for object_id in queryset.order_by('id').values_list('id', flat=True).iterator():
+        if first_id is None:
+            first_id = object_id
+        last_id = object_id
+        count += 1
+        if count == chunk_size:
+            yield first_id, last_id
+            first_id = None
+            count = 0
+    if first_id is not None:
+        yield first_id, last_id
+
+
+@job
+def manage_task_progress(min_id, max_id, dry_run=False):
+    """
+    Creates the next progress events of the open tasks in an id range and sends reminders for their upcoming events
+    :param dry_run: Count what would be created and sent without changing anything
+    :return: dict with the number of tasks, progress events created and reminders sent
+    """
+    now = datetime.datetime.utcnow()
+    tasks = list(Task.objects.filter(closed=False, id__range=[min_id, max_id]))
+    if not dry_run:
+        for task in tasks:
+            # Reconciles the submit milestone with the deadline
+            update_task_submit_milestone(task)
+    events = create_periodic_updates(tasks, now=now, dry_run=dry_run)
+
+    reminder_event_ids = list(
+        ProgressEvent.objects.filter(
+            task__closed=False, task__id__range=[min_id, max_id],
+            due_at__range=[now, now + relativedelta(hours=24)], last_reminder_at__isnull=True
+        ).values_list('id', flat=True)
+    )
+    reminders = len(reminder_event_ids)
+    if not dry_run and reminder_event_ids:
+        # Reminders that couldn't be sent keep last_reminder_at empty and are picked up by the next run
+        reminders = send_progress_event_reminder_emails(reminder_event_ids)
+    return {'tasks': len(tasks), 'events': events, 'reminders': reminders}
+
+
+def get_connected_user_ids(user):
+    """
+    Ids of the users with an accepted connection to the user in either direction
+    """
+    connections = Connection.objects.filter(accepted=True).filter(from_user=user).values_list('to_user_id', flat=True)
+    requests = Connection.objects.filter(accepted=True).filter(to_user=user).values_list('from_user_id', flat=True)
+    return set(connections) | set(requests)
+
+
+def sync_task_visibility(task, user_ids):
+    """
+    Makes the task's visibility index rows match user_ids
+    """
+    indexed_user_ids = set(TaskVisibility.objects.filter(task=task).values_list('user_id', flat=True))
+    removed_user_ids = indexed_user_ids - user_ids
+    if removed_user_ids:
+        TaskVisibility.objects.filter(task=task, user_id__in=removed_user_ids).delete()
+    new_user_ids = user_ids - indexed_user_ids
+    if new_user_ids:
+        TaskVisibility.objects.bulk_create(
+            [TaskVisibility(task_id=task.id, user_id=user_id) for user_id in new_user_ids]
+        )
+
+
+@job
+def update_task_visibility(task):
+    task = clean_instance(task, Task)
+    if not task:
+        return
+    user_ids = set(task.participation_set.values_list('user_id', flat=True))
+    user_ids.add(task.user_id)
+    if task.visibility == VISIBILITY_MY_TEAM:
+        user_ids |= get_connected_user_ids(task.user_id)
+    sync_task_visibility(task, user_ids)
+
+
+@job
+def update_team_task_visibility(user):
+    """
+    Re-indexes the team tasks of a user after one of the user's connections changes
+    """
+    user = clean_instance(user, get_user_model())
+    if not user:
+        return
+    tasks = Task.objects.filter(user=user, visibility=VISIBILITY_MY_TEAM)
+    if not tasks:
+        return
+    connected_user_ids = get_connected_user_ids(user)
+    participants = dict()
+    for task_id, user_id in Participation.objects.filter(task__in=tasks).values_list('task_id', 'user_id'):
+        participants.setdefault(task_id, set()).add(user_id)
+    for task in tasks:
+        sync_task_visibility(task, connected_user_ids | participants.get(task.id, set()) | set([user.id]))
+
+
+def rebuild_task_visibility(batch_size=1000):
+    """
+    Rebuilds the whole task visibility index
+    :return: number of index rows created
+    """
+    participants = dict()
+    for task_id, user_id in Participation.objects.values_list('task_id', 'user_id'):
+        participants.setdefault(task_id, set()).add(user_id)
+
+    connections = dict()
+    for from_user_id, to_user_id in Connection.objects.filter(accepted=True).values_list('from_user_id', 'to_user_id'):
+        connections.setdefault(from_user_id, set()).add(to_user_id)
+        connections.setdefault(to_user_id, set()).add(from_user_id)
+
+    rows = []
+    for task_id, owner_id, visibility in Task.objects.values_list('id', 'user_id', 'visibility'):
+        user_ids = participants.get(task_id, set()) | set([owner_id])
+        if visibility == VISIBILITY_MY_TEAM:
+            user_ids |= connections.get(owner_id, set())
+        rows.extend([TaskVisibility(task_id=task_id, user_id=user_id) for user_id in user_ids])
+
+    with transaction.atomic():
+        TaskVisibility.objects.all().delete()
+        TaskVisibility.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+@job('github')
+def process_integration_deliveries(deliveries=None, replay=False, batch_size=100):
+    """
+    Turns stored web hook deliveries into integration activities and their activity stream actions in bulk
+    :param deliveries: Ids of the deliveries to process, all unprocessed deliveries if not set
+    :param replay: Reprocess deliveries that were processed before, their activities and actions are replaced
+    :param batch_size: Deliveries parsed and inserted per transaction
+    :return: number of activities created
+    """
+    queryset = IntegrationDelivery.objects.select_related('integration')
+    if deliveries is not None:
+        queryset = queryset.filter(id__in=deliveries)
+    if not replay:
+        queryset = queryset.filter(processed_at__isnull=True)
+    delivery_ids = list(queryset.order_by('id').values_list('id', flat=True))
+
+    total = 0
+    for start in range(0, len(delivery_ids), batch_size):
+        total += process_integration_delivery_batch(
+            queryset.filter(id__in=delivery_ids[start:start + batch_size]), replay=replay
+        )
+    return total
+
+
+def process_integration_delivery_batch(deliveries, replay=False):
+    deliveries = list(deliveries)
+    if not deliveries:
+        return 0
+
+    event_ids = set(IntegrationEvent.objects.values_list('id', flat=True))
+    activities = []
+    for delivery in deliveries:
+        try:
+            activity = github.extract_activity(delivery.event, json.loads(delivery.payload))
+        except (ValueError, TypeError, KeyError, IndexError):
+            # Malformed payloads are marked as processed below instead of failing the whole batch
+            activity = None
+        if activity and activity[slugs.ACTIVITY_EVENT_ID] in event_ids:
+            activities.append(IntegrationActivity(integration=delivery.integration, delivery=delivery, **activity))
+
+    now = datetime.datetime.utcnow()
+    activity_content_type = ContentType.objects.get_for_model(IntegrationActivity)
+    with transaction.atomic():
+        existing_activities = IntegrationActivity.objects.filter(delivery__in=deliveries)
+        if replay:
+            existing_activity_ids = [str(activity_id) for activity_id in existing_activities.values_list('id', flat=True)]
+            Action.objects.filter(
+                action_object_content_type=activity_content_type, action_object_object_id__in=existing_activity_ids
+            ).delete()
+            existing_activities.delete()
+        else:
+            # A delivery only ever produces one activity, e.g a retried job doesn't duplicate them
+            processed_delivery_ids = set(existing_activities.values_list('delivery_id', flat=True))
+            activities = [activity for activity in activities if activity.delivery_id not in processed_delivery_ids]
+
+        if activities:
+            IntegrationActivity.objects.bulk_create(activities)
+            # bulk_create doesn't set ids, read the new activities back for their actions
+            created_activities = IntegrationActivity.objects.filter(
+                delivery__in=[activity.delivery_id for activity in activities]
+            ).select_related('integration')
+
+            # Same actions activity_handler_integration_activity sends for activities created one at a time
+            integration_content_type = ContentType.objects.get_for_model(Integration)
+            task_content_type = ContentType.objects.get_for_model(Task)
+            Action.objects.bulk_create([
+                Action(
+                    actor_content_type=integration_content_type, actor_object_id=activity.integration_id,
+                    verb=verbs.REPORT,
+                    action_object_content_type=activity_content_type, action_object_object_id=activity.id,
+                    target_content_type=task_content_type, target_object_id=activity.integration.task_id,
+                    timestamp=now
+                ) for activity in created_activities
+            ])
+            # bulk_create doesn't send post_save either, so the new actions are added to the task timelines here
+            create_task_timeline_entries(Action.objects.filter(
+                action_object_content_type=activity_content_type,
+                action_object_object_id__in=[str(activity.id) for activity in created_activities]
+            ))
+
+        IntegrationDelivery.objects.filter(id__in=[delivery.id for delivery in deliveries]).update(processed_at=now)
+    return len(activities)
+
+
+def create_task_timeline_entries(actions):
+    """
+    Adds actions that target tasks to the timelines of their tasks
+    :param actions: Actions e.g an action that was just sent or a batch of existing actions being backfilled
+    :return: number of timeline entries created
+    """
+    task_content_type = ContentType.objects.get_for_model(Task)
+    user_content_type = ContentType.objects.get_for_model(get_user_model())
+    actions = [action for action in actions if action.target_content_type_id == task_content_type.id]
+    if not actions:
+        return 0
+
+    TaskTimelineEntry.objects.bulk_create([
+        TaskTimelineEntry(
+            task_id=int(action.target_object_id), action=action,
+            actor_id=action.actor_content_type_id == user_content_type.id and int(action.actor_object_id) or None,
+            verb=action.verb, created_at=action.timestamp
+        ) for action in actions
+    ])
+    return len(actions)
@@ -1,14 +1,58 @@
 import datetime
+import hashlib
+import hmac
+import json
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, IntegrityError
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils.crypto import get_random_string
+from django_rq.queues import get_queue
 from django_rq.workers import get_worker
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
+from rq.worker import SimpleWorker
 
+from tunga_activity import verbs
 from tunga_auth.models import USER_TYPE_PROJECT_OWNER, USER_TYPE_DEVELOPER
-from tunga_tasks.models import Task
+from tunga_comments.models import Comment
+from tunga_profiles.models import Connection, UserProfile
+from tunga_settings.models import VISIBILITY_MY_TEAM, VISIBILITY_CUSTOM
+from tunga_tasks.models import Task, Application, Participation, SavedTask, TaskVisibility, Integration, \
+    IntegrationEvent, IntegrationDelivery, IntegrationActivity, INTEGRATION_TYPE_REPO, ProgressEvent, \
+    PROGRESS_EVENT_TYPE_PERIODIC, PROGRESS_EVENT_TYPE_SUBMIT, UPDATE_SCHEDULE_WEEKLY, TaskTimelineEntry
+from tunga_tasks.tasks import rebuild_task_visibility, process_integration_deliveries, create_periodic_updates, \
+    update_task_periodic_updates, get_id_ranges, manage_task_progress
+from tunga_utils.cache import bump_cache_version, CACHE_NAMESPACE_FRAGMENTS
+from tunga_utils import mobbr
+from tunga_utils.export import iterate_values
+from tunga_utils.permissions import filter_permitted
+
+
+class MobbrStubHandler(BaseHTTPRequestHandler):
+    """
+    Answers participation script lookups like Mobbr's uris/info, failing while the server's status is an error
+    """
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({'result': {'script': {
+            'keywords': ['django'],
+            'participants': [{'id': 'mailto:developer@example.com', 'role': 'Developer', 'share': '100'}]
+        }}}))
+
+    def log_message(self, *args):
+        pass
 
 
 class APITaskTestCase(APITestCase):
@@ -142,5 +186,526 @@ class APITaskTestCase(APITestCase):
         response = self.client.patch(url, data)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_task_meta_mobbr_script(self):
+        """
+        Task meta data never waits on Mobbr, participation scripts are fetched and refreshed by background jobs
+        """
+        server = HTTPServer(('127.0.0.1', 0), MobbrStubHandler)
+        server.requests = 0
+        server.status = 200
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.shutdown)
+
+        api_url = mobbr.MOBBR_API_URL
+        mobbr.MOBBR_API_URL = 'http://127.0.0.1:%s/api_v1' % server.server_port
+        self.addCleanup(setattr, mobbr, 'MOBBR_API_URL', api_url)
+
+        task_url = 'https://example.com/%s/' % get_random_string()
+        self.addCleanup(cache.delete_many, [
+            mobbr.get_mobbr_script_key(task_url), mobbr.get_mobbr_refresh_lock_key(task_url)
+        ])
+        task = Task.objects.create(**{'title': 'Task 1', 'fee': 10, 'user': self.project_owner, 'url': task_url})
+        queue = get_queue('default')
+
+        def get_participants():
+            response = self.client.get(reverse('task-meta', kwargs={'pk': task.id}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [participant['id'] for participant in json.loads(response.data['participation'])['participants']]
+
+        self.client.force_authenticate(user=self.project_owner)
+        self.assertEqual(get_participants(), ['mailto:admin@tunga.io'])
+        self.assertEqual(server.requests, 0)
+
+        SimpleWorker([queue], connection=queue.connection).work(burst=True)
+        self.assertEqual(server.requests, 1)
+        expected_participants = ['mailto:admin@tunga.io', 'mailto:developer@example.com']
+        self.assertEqual(get_participants(), expected_participants)
+        self.assertEqual(get_participants(), expected_participants)
+        self.assertEqual(server.requests, 1)
+
+        # Stale scripts are served while they're refreshed, failed refreshes keep them
+        script_key = mobbr.get_mobbr_script_key(task_url)
+        cache.set(script_key, dict(cache.get(script_key), fetched_at=0))
+        server.status = 500
+        self.assertEqual(get_participants(), expected_participants)
+        SimpleWorker([queue], connection=queue.connection).work(burst=True)
+        self.assertEqual(server.requests, 2)
+        self.assertEqual(get_participants(), expected_participants)
+
+    def test_list_tasks_query_count(self):
+        """
+        Listing tasks takes the same number of queries regardless of the number of tasks
+        """
+        url = reverse('task-list')
+
+        def create_tasks(start, end):
+            for i in range(start, end):
+                task = Task.objects.create(
+                    **{'title': 'Task %s' % i, 'skills': 'Django, React.js', 'fee': 10, 'user': self.project_owner}
+                )
+                Application.objects.create(task=task, user=self.developer, pitch='Pitch')
+                Participation.objects.create(
+                    task=task, user=self.developer, created_by=self.project_owner, accepted=True, responded=True
+                )
+                SavedTask.objects.create(task=task, user=self.developer)
+
+        self.client.force_authenticate(user=self.admin)
+
+        create_tasks(0, 2)
+        with CaptureQueriesContext(connection) as few_tasks_context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+
+        create_tasks(2, 10)
+        with CaptureQueriesContext(connection) as many_tasks_context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 10)
+        self.assertEqual(len(few_tasks_context), len(many_tasks_context))
+
+        self.client.force_authenticate(user=self.developer)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        task_data = response.data['results'][0]
+        self.assertFalse(task_data['can_apply'])
+        self.assertFalse(task_data['can_save'])
+        self.assertTrue(task_data['is_participant'])
+        self.assertEqual(task_data['my_participation']['user'], self.developer.id)
+        self.assertEqual(task_data['open_applications'], 1)
+
+    def test_task_activity_query_count(self):
+        """
+        Task activity takes the same number of queries regardless of the number of actions on a page
+        """
+        task = Task.objects.create(title='Activity', fee=15, user=self.project_owner)
+        url = reverse('task-detail', args=[task.id]) + 'activity/'
+
+        def create_activity(start, end):
+            for i in range(start, end):
+                developer = get_user_model().objects.create_user(
+                    'activity_developer_%s' % i, 'activity%s@example.com' % i, 'secret',
+                    **{'type': USER_TYPE_DEVELOPER}
+                )
+                Participation.objects.create(task=task, user=developer, created_by=self.project_owner)
+                Comment.objects.create(content_object=task, user=developer, body='Comment %s' % i)
+
+        self.client.force_authenticate(user=self.project_owner)
+
+        create_activity(0, 2)
+        bump_cache_version(CACHE_NAMESPACE_FRAGMENTS)
+        with CaptureQueriesContext(connection) as few_actions_context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 4)
+
+        create_activity(2, 10)
+        bump_cache_version(CACHE_NAMESPACE_FRAGMENTS)
+        with CaptureQueriesContext(connection) as many_actions_context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 15)
+        self.assertEqual(len(few_actions_context), len(many_actions_context))
+        self.assertEqual(
+            set([activity['activity_type'] for activity in response.data['results']]), {'participation', 'comment'}
+        )
+        self.assertIn('Comment 9', [activity['activity'].get('body') for activity in response.data['results']])
+
+    def test_task_timeline_backfill(self):
+        """
+        Backfilled timeline entries serve the same task activity as entries written when the actions were sent,
+        activity is serialized when it's read so later changes to its objects are shown
+        """
+        task = Task.objects.create(title='Timeline', fee=15, user=self.project_owner)
+        participation = Participation.objects.create(task=task, user=self.developer, created_by=self.project_owner)
+        Comment.objects.create(content_object=task, user=self.developer, body='Timeline comment')
+        url = reverse('task-detail', args=[task.id]) + 'activity/'
+
+        self.client.force_authenticate(user=self.project_owner)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        self.assertFalse(response.data['results'][1]['activity']['accepted'])
+
+        participation.accepted = True
+        participation.responded = True
+        participation.save()
+        response = self.client.get(url)
+        self.assertTrue(response.data['results'][1]['activity']['accepted'])
+        self.assertEqual(
+            [entry.verb for entry in TaskTimelineEntry.objects.filter(task=task)], ['comment', 'add']
+        )
+
+        TaskTimelineEntry.objects.filter(task=task).delete()
+        self.assertEqual(self.client.get(url).data['count'], 0)
+
+        call_command('tunga_backfill_task_timeline')
+        self.assertEqual(self.client.get(url).data['results'], response.data['results'])
+
+    def test_list_tasks_visibility(self):
+        """
+        Developers only list team and custom tasks they are connected to or participate in
+        """
+        url = reverse('task-list')
+        team_task = Task.objects.create(
+            **{'title': 'Team Task', 'fee': 10, 'user': self.project_owner, 'visibility': VISIBILITY_MY_TEAM}
+        )
+        custom_task = Task.objects.create(
+            **{'title': 'Custom Task', 'fee': 10, 'user': self.project_owner, 'visibility': VISIBILITY_CUSTOM}
+        )
+
+        def list_task_ids():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted([task['id'] for task in response.data['results']])
+
+        self.client.force_authenticate(user=self.developer)
+        self.assertEqual(list_task_ids(), [])
+
+        connection_request = Connection.objects.create(from_user=self.project_owner, to_user=self.developer)
+        self.assertEqual(list_task_ids(), [])
+
+        connection_request.accepted = True
+        connection_request.save()
+        self.assertEqual(list_task_ids(), [team_task.id])
+
+        participation = Participation.objects.create(
+            task=custom_task, user=self.developer, created_by=self.project_owner
+        )
+        self.assertEqual(list_task_ids(), [team_task.id, custom_task.id])
+
+        participation.delete()
+        connection_request.delete()
+        self.assertEqual(list_task_ids(), [])
+
+        Participation.objects.create(task=custom_task, user=self.developer, created_by=self.project_owner)
+        TaskVisibility.objects.all().delete()
+        rebuild_task_visibility()
+        self.assertEqual(list_task_ids(), [custom_task.id])
+
+        # Deleting a task deletes its visibility without its participation indexing it again
+        custom_task_id = custom_task.id
+        custom_task.delete()
+        self.assertFalse(TaskVisibility.objects.filter(task_id=custom_task_id).exists())
+        self.assertEqual(list_task_ids(), [])
+
+    def test_list_tasks_matching_skills(self):
+        """
+        The skills filter ranks tasks by the number of skills they share with the developer
+        """
+        url = reverse('task-list')
+        profile = UserProfile.objects.create(user=self.developer, skills='Django, React.js, Python')
+        best_task = Task.objects.create(
+            **{'title': 'Task 1', 'skills': 'Django, React.js', 'fee': 10, 'user': self.project_owner}
+        )
+        task = Task.objects.create(**{'title': 'Task 2', 'skills': 'Python, PHP', 'fee': 10, 'user': self.project_owner})
+        Task.objects.create(**{'title': 'Task 3', 'skills': 'PHP', 'fee': 10, 'user': self.project_owner})
+
+        self.client.force_authenticate(user=self.developer)
+        response = self.client.get(url, {'filter': 'skills'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['results']], [best_task.id, task.id])
+
+        profile.skills = 'PHP'
+        profile.save()
+        response = self.client.get(url, {'filter': 'skills'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertNotIn(best_task.id, [item['id'] for item in response.data['results']])
+
+        # Developers are ranked against the current user's skills the same way
+        other_developer = get_user_model().objects.create_user(
+            'other_developer', 'other@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+        UserProfile.objects.create(user=other_developer, skills='PHP, Python')
+        UserProfile.objects.create(user=self.project_owner, skills='Python, PHP, Django')
+        self.client.force_authenticate(user=self.project_owner)
+        response = self.client.get(reverse('tungauser-list'), {'filter': 'relevant'})
+        self.assertEqual([item['id'] for item in response.data['results']], [other_developer.id, self.developer.id])
+
+    def test_filter_permitted_tasks(self):
+        """
+        Object permissions for many tasks are checked with one query per relation set of the current user
+        """
+        other_project_owner = get_user_model().objects.create_user(
+            'other_project_owner', 'other_po@example.com', 'secret', **{'type': USER_TYPE_PROJECT_OWNER})
+        Connection.objects.create(from_user=self.project_owner, to_user=self.developer, accepted=True, responded=True)
+
+        tasks = []
+        for i, visibility in enumerate([VISIBILITY_MY_TEAM, VISIBILITY_CUSTOM] * 3):
+            tasks.append(Task.objects.create(**{
+                'title': 'Task %s' % i, 'fee': 10, 'visibility': visibility,
+                'user': i < 2 and self.project_owner or other_project_owner
+            }))
+        participation = Participation.objects.create(
+            task=tasks[3], user=self.developer, created_by=other_project_owner
+        )
+
+        request = self.factory.get('/')
+        request.user = self.developer
+        with self.assertNumQueries(2):
+            permitted_tasks = filter_permitted(request, tasks)
+        self.assertEqual([task.id for task in permitted_tasks], [tasks[0].id, tasks[3].id])
+
+        # The participation and its tasks, the user's relation sets are already loaded for this request
+        with self.assertNumQueries(2):
+            permitted_participation = filter_permitted(
+                request, Participation.objects.filter(id=participation.id), related=['task']
+            )
+        self.assertEqual(permitted_participation, [participation])
+
+    def test_task_details_applications(self):
+        """
+        Task details only list the applications the current user can read
+        """
+        other_developer = get_user_model().objects.create_user(
+            'other_developer', 'other_developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+        task = Task.objects.create(title='Task 1', fee=10, user=self.project_owner)
+        application = Application.objects.create(task=task, user=self.developer)
+        other_application = Application.objects.create(task=task, user=other_developer)
+
+        url = reverse('task-detail', kwargs={'pk': task.id})
+
+        def list_application_ids():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted([item['id'] for item in response.data['details']['applications']])
+
+        self.client.force_authenticate(user=self.admin)
+        self.assertEqual(list_application_ids(), [application.id, other_application.id])
+
+        self.client.force_authenticate(user=self.developer)
+        self.assertEqual(list_application_ids(), [application.id])
+
+        self.client.force_authenticate(user=other_developer)
+        self.assertEqual(list_application_ids(), [other_application.id])
+
+    def test_list_tasks_cursor_pagination(self):
+        """
+        Cursor pages walk (created_at, id) without skipping or repeating tasks, previous polls for newer tasks
+        """
+        url = reverse('task-list')
+        tasks = [
+            Task.objects.create(**{'title': 'Task %s' % i, 'fee': 10, 'user': self.project_owner}) for i in range(20)
+        ]
+        # Ties on created_at are broken by id
+        Task.objects.filter(id__in=[task.id for task in tasks[5:15]]).update(created_at=tasks[5].created_at)
+
+        self.client.force_authenticate(user=self.project_owner)
+        response = self.client.get(url, {'filter': 'my-tasks', 'cursor': ''})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        newer_url = response.data['previous']
+
+        task_ids = []
+        next_url = url + '?filter=my-tasks&cursor='
+        while next_url:
+            response = self.client.get(next_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            task_ids.extend([item['id'] for item in response.data['results']])
+            next_url = response.data['next']
+        expected_ids = [task.id for task in tasks[15:][::-1] + tasks[5:15][::-1] + tasks[:5][::-1]]
+        self.assertEqual(task_ids, expected_ids)
+
+        response = self.client.get(newer_url)
+        self.assertEqual(response.data['results'], [])
+        new_task = Task.objects.create(**{'title': 'Task 20', 'fee': 10, 'user': self.project_owner})
+        response = self.client.get(newer_url)
+        self.assertEqual([item['id'] for item in response.data['results']], [new_task.id])
+
+        # Offset pagination is unchanged without a cursor
+        response = self.client.get(url, {'filter': 'my-tasks', 'page': 2})
+        self.assertEqual(response.data['count'], 21)
+
+        response = self.client.get(url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export_tasks(self):
+        """
+        Staff stream the filtered tasks and payments as CSV or JSON lines, read in id ordered chunks
+        """
+        tasks = [
+            Task.objects.create(**{'title': u'T\xe2sk %s' % i, 'fee': 10, 'user': self.project_owner}) for i in range(5)
+        ]
+        Task.objects.filter(id=tasks[0].id).update(closed=True)
+        for task in tasks[:3]:
+            Participation.objects.create(task=task, user=self.developer, created_by=self.admin, accepted=True, share=50)
+            Participation.objects.create(task=task, user=self.admin, created_by=self.admin, accepted=True, share=50)
+
+        url = reverse('task-export')
+        self.client.force_authenticate(user=self.project_owner)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(url, {'closed': 'False'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = ''.join(response.streaming_content).splitlines()
+        self.assertEqual(rows[0].split(',')[:5], ['id', 'project', 'user', 'username', 'title'])
+        self.assertEqual(
+            [row.split(',')[4] for row in rows[1:]], [task.title.encode('utf-8') for task in tasks[1:]]
+        )
+
+        response = self.client.get(reverse('participation-payments'), {'output': 'ndjson', 'user': self.developer.id})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        payments = [json.loads(line) for line in ''.join(response.streaming_content).splitlines()]
+        self.assertEqual([payment['task'] for payment in payments], [task.id for task in tasks[:3]])
+        self.assertEqual((payments[0]['share'], payments[0]['fee'], payments[0]['paid']), (50, 10, False))
+
+        response = self.client.get(url, {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Joins that repeat tasks and chunk boundaries don't repeat or skip rows
+        queryset = Task.objects.filter(participants__in=[self.developer, self.admin])
+        self.assertEqual(
+            [row[0] for row in iterate_values(queryset, ['title'], chunk_size=2)], [task.id for task in tasks[:3]]
+        )
+
+    def test_integration_hook(self):
+        """
+        Signed GitHub deliveries are stored once, acknowledged with 202 and turned into activities by the github queue
+        """
+        task = Task.objects.create(**{'title': 'Task 1', 'fee': 10, 'user': self.project_owner})
+        integration = Integration.objects.create(
+            task=task, provider='github', type=INTEGRATION_TYPE_REPO, created_by=self.project_owner
+        )
+        IntegrationEvent.objects.create(id='push', name='Push')
+        url = '%shook/github/' % reverse('task-detail', args=[task.id])
+        body = json.dumps({
+            'head_commit': {
+                'url': 'https://github.com/tunga/tunga/commit/abc', 'id': 'abc', 'tree_id': 'def',
+                'message': 'Fix tests', 'timestamp': '2016-07-01T10:00:00Z'
+            },
+            'sender': {'login': 'developer', 'avatar_url': 'https://github.com/developer.png'}
+        })
+        signature = 'sha1=%s' % hmac.new(str(integration.secret), body, hashlib.sha1).hexdigest()
+
+        response = self.client.post(
+            url, body, content_type='application/json',
+            HTTP_X_GITHUB_EVENT='push', HTTP_X_GITHUB_DELIVERY='delivery-1', HTTP_X_HUB_SIGNATURE='sha1=invalid'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        for i in range(2):
+            response = self.client.post(
+                url, body, content_type='application/json',
+                HTTP_X_GITHUB_EVENT='push', HTTP_X_GITHUB_DELIVERY='delivery-1', HTTP_X_HUB_SIGNATURE=signature
+            )
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(IntegrationDelivery.objects.count(), 1)
+        self.assertEqual(IntegrationActivity.objects.count(), 0)
+
+        # A redelivery that loses the race to store the delivery is still acknowledged
+        manager = IntegrationDelivery.objects
+
+        def get_or_create(**kwargs):
+            raise IntegrityError('UNIQUE constraint failed: tunga_tasks_integrationdelivery.delivery_id')
+        manager.get_or_create = get_or_create
+        try:
+            response = self.client.post(
+                url, body, content_type='application/json',
+                HTTP_X_GITHUB_EVENT='push', HTTP_X_GITHUB_DELIVERY='delivery-1', HTTP_X_HUB_SIGNATURE=signature
+            )
+        finally:
+            del manager.get_or_create
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        # Work the queue in process, a forked worker's writes don't reach the test database
+        queue = get_queue('github')
+        SimpleWorker([queue], connection=queue.connection).work(burst=True)
+        activity = IntegrationActivity.objects.get()
+        self.assertEqual(activity.ref, 'abc')
+        self.assertEqual(activity.event_id, 'push')
+        self.assertEqual(task.target_actions.filter(verb='report').count(), 1)
+
+        # Replays replace the delivery's activity and action instead of duplicating them
+        self.assertEqual(process_integration_deliveries(), 0)
+        self.assertEqual(process_integration_deliveries(replay=True), 1)
+        self.assertEqual(IntegrationActivity.objects.count(), 1)
+        self.assertEqual(task.target_actions.filter(verb='report').count(), 1)
+
+    def test_create_periodic_updates(self):
+        """
+        Periodic updates are scheduled every update_interval units from the first activated participant
+        with a fixed number of queries for any number of tasks
+        """
+        now = datetime.datetime.utcnow()
+        tasks = []
+        for i in range(3):
+            task = Task.objects.create(**{
+                'title': 'Task %s' % i, 'fee': 10, 'user': self.project_owner,
+                'update_interval': 1, 'update_interval_units': UPDATE_SCHEDULE_WEEKLY
+            })
+            Participation.objects.create(
+                task=task, user=self.developer, accepted=True, responded=True,
+                activated_at=now - datetime.timedelta(days=20), created_by=self.project_owner
+            )
+            tasks.append(task)
+        Task.objects.filter(id=tasks[2].id).update(deadline=now + datetime.timedelta(days=1))
+        tasks[2].deadline = now + datetime.timedelta(days=1)
+
+        # Latest periodic updates, start dates and existing events, then in a transaction the inserts of the events,
+        # their actions and timeline entries and the reads of the events and actions that bulk_create gave no ids
+        ContentType.objects.get_for_model(ProgressEvent)
+        with self.assertNumQueries(10):
+            self.assertEqual(create_periodic_updates(tasks, now=now), 8)
+        due_dates = ProgressEvent.objects.filter(
+            task=tasks[0], type=PROGRESS_EVENT_TYPE_PERIODIC
+        ).order_by('due_at').values_list('due_at', flat=True)
+        self.assertEqual(
+            list(due_dates), [now - datetime.timedelta(days=20 - days) for days in [7, 14, 21]]
+        )
+        self.assertEqual(ProgressEvent.objects.filter(task=tasks[2], type=PROGRESS_EVENT_TYPE_PERIODIC).count(), 2)
+
+        # Bulk created events get the create actions and timeline entries of events created one at a time
+        event = ProgressEvent.objects.filter(task=tasks[0], type=PROGRESS_EVENT_TYPE_PERIODIC).first()
+        self.assertEqual(
+            list(TaskTimelineEntry.objects.filter(
+                task=tasks[0], action__action_object_content_type=ContentType.objects.get_for_model(ProgressEvent),
+                action__action_object_object_id=str(event.id)
+            ).values_list('verb', 'actor_id')),
+            [(verbs.CREATE, self.project_owner.id)]
+        )
+
+        # Events are unique per due date, a submit milestone that's due at the same time takes the slot
+        ProgressEvent.objects.filter(task=tasks[1], type=PROGRESS_EVENT_TYPE_PERIODIC).delete()
+        ProgressEvent.objects.create(
+            task=tasks[1], type=PROGRESS_EVENT_TYPE_SUBMIT, due_at=now - datetime.timedelta(days=13)
+        )
+        self.assertEqual(create_periodic_updates([tasks[1]], now=now), 2)
+
+        # Rescheduling only adds the next update once the latest one is due
+        self.assertEqual(update_task_periodic_updates(tasks[0]), 0)
+        self.assertEqual(create_periodic_updates(tasks, now=now + datetime.timedelta(days=2)), 2)
+
+    def test_manage_task_progress_chunks(self):
+        """
+        Task progress is managed per id ranged chunk of open tasks, dry runs only count
+        """
+        now = datetime.datetime.utcnow()
+        for i in range(5):
+            task = Task.objects.create(**{
+                'title': 'Task %s' % i, 'fee': 10, 'user': self.project_owner, 'closed': i == 4,
+                'update_interval': 1, 'update_interval_units': UPDATE_SCHEDULE_WEEKLY
+            })
+            Participation.objects.create(
+                task=task, user=self.developer, accepted=True, responded=True,
+                activated_at=now - datetime.timedelta(days=6, hours=12), created_by=self.project_owner
+            )
+        open_tasks = Task.objects.filter(closed=False)
+        chunks = list(get_id_ranges(open_tasks, chunk_size=3))
+        self.assertEqual(len(chunks), 2)
+
+        stats = [manage_task_progress(min_id, max_id, dry_run=True) for min_id, max_id in chunks]
+        self.assertEqual([chunk_stats['tasks'] for chunk_stats in stats], [3, 1])
+        self.assertEqual(sum([chunk_stats['events'] for chunk_stats in stats]), 4)
+        self.assertFalse(ProgressEvent.objects.exists())
+
+        stats = [manage_task_progress(min_id, max_id) for min_id, max_id in chunks]
+        self.assertEqual(sum([chunk_stats['reminders'] for chunk_stats in stats]), 4)
+        self.assertEqual(ProgressEvent.objects.filter(task__in=open_tasks, last_reminder_at__isnull=False).count(), 4)
+
     def tearDown(self):
         self.__process_jobs()
@@ -1,32 +1,64 @@
+import hashlib
 import json
 
-from dateutil.parser import parse
+from django.db import IntegrityError
+from django.db.models.query import Prefetch
 from django.shortcuts import render, redirect
 from django.utils.crypto import get_random_string
 from dry_rest_permissions.generics import DRYPermissions, DRYObjectPermissions
 from rest_framework import viewsets, status
-from rest_framework.decorators import detail_route
+from rest_framework.decorators import detail_route, list_route
 from rest_framework.generics import get_object_or_404
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 
 from tunga_activity.serializers import SimpleActivitySerializer
-from tunga_tasks import slugs
 from tunga_tasks.filterbackends import TaskFilterBackend, ApplicationFilterBackend, ParticipationFilterBackend, \
     TaskRequestFilterBackend, SavedTaskFilterBackend, ProjectFilterBackend, ProgressReportFilterBackend, \
     ProgressEventFilterBackend
 from tunga_tasks.filters import TaskFilter, ApplicationFilter, ParticipationFilter, TaskRequestFilter, SavedTaskFilter, \
     ProjectFilter, ProgressReportFilter, ProgressEventFilter
 from tunga_tasks.models import Task, Application, Participation, TaskRequest, SavedTask, Project, ProgressReport, ProgressEvent, \
-    Integration, IntegrationMeta, IntegrationActivity
+    Integration, IntegrationMeta, IntegrationDelivery, TaskTimelineEntry
 from tunga_tasks.serializers import TaskSerializer, ApplicationSerializer, ParticipationSerializer, \
     TaskRequestSerializer, SavedTaskSerializer, ProjectSerializer, ProgressReportSerializer, ProgressEventSerializer, \
-    IntegrationSerializer
+    IntegrationSerializer, ExportSerializer
+from tunga_tasks.tasks import process_integration_deliveries
 from tunga_utils import github
-from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS
-from tunga_utils.mixins import SaveUploadsMixin
+from tunga_utils.export import export_queryset
+from tunga_utils.filterbackends import DEFAULT_FILTER_BACKENDS, FULL_TEXT_FILTER_BACKENDS
+from tunga_utils.mixins import SaveUploadsMixin, ClearPermissionCacheMixin
+from tunga_utils.models import Rating
+from tunga_utils.pagination import KeysetPagination
+from tunga_utils.serializers import prefetch_simple_users
 from tunga_utils.views import get_social_token
 
+TASK_EXPORT_COLUMNS = [
+    ('project', 'project_id'), ('user', 'user_id'), ('username', 'user__username'), ('title', 'title'),
+    ('fee', 'fee'), ('currency', 'currency'), ('closed', 'closed'), ('paid', 'paid'),
+    ('created_at', 'created_at'), ('closed_at', 'closed_at'), ('paid_at', 'paid_at')
+]
+
+PARTICIPATION_EXPORT_COLUMNS = [
+    ('task', 'task_id'), ('task_title', 'task__title'), ('user', 'user_id'), ('username', 'user__username'),
+    ('role', 'role'), ('accepted', 'accepted'), ('responded', 'responded'), ('assignee', 'assignee'),
+    ('share', 'share'), ('created_at', 'created_at'), ('activated_at', 'activated_at')
+]
+
+PAYMENT_EXPORT_COLUMNS = [
+    ('task', 'task_id'), ('task_title', 'task__title'), ('user', 'user_id'), ('username', 'user__username'),
+    ('email', 'user__email'), ('share', 'share'), ('fee', 'task__fee'), ('currency', 'task__currency'),
+    ('paid', 'task__paid'), ('paid_at', 'task__paid_at')
+]
+
+
+def get_export_response(view, request, queryset, columns, filename):
+    serializer = view.get_serializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    return export_queryset(
+        view.filter_queryset(queryset), columns, filename, export_format=serializer.validated_data['output']
+    )
+
 
 class ProjectViewSet(viewsets.ModelViewSet):
     """
@@ -48,7 +80,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
     search_fields = ('title', 'description')
 
 
-class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
+class TaskViewSet(ClearPermissionCacheMixin, viewsets.ModelViewSet, SaveUploadsMixin):
     """
     Task Resource
     ---
@@ -64,8 +96,53 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
     serializer_class = TaskSerializer
     permission_classes = [IsAuthenticated, DRYPermissions]
     filter_class = TaskFilter
-    filter_backends = DEFAULT_FILTER_BACKENDS + (TaskFilterBackend,)
+    filter_backends = FULL_TEXT_FILTER_BACKENDS + (TaskFilterBackend,)
     search_fields = ('title', 'description', 'skills__name')
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        queryset = super(TaskViewSet, self).get_queryset()
+        if self.action not in ['list', 'retrieve']:
+            # Writes render from the saved instance, prefetched data would be stale
+            return queryset
+
+        # Load everything TaskSerializer and TaskDetailsSerializer read in a fixed number of queries
+        queryset = prefetch_simple_users(queryset, 'user', 'project__user').prefetch_related(
+            Prefetch('skills', to_attr='prefetched_skills'), 'uploads',
+            Prefetch('ratings', queryset=prefetch_simple_users(Rating.objects.all(), 'created_by')),
+            Prefetch('application_set', queryset=prefetch_simple_users(Application.objects.all(), 'user')),
+            Prefetch('participation_set', queryset=prefetch_simple_users(Participation.objects.all(), 'user')),
+            Prefetch(
+                'progressevent_set',
+                queryset=prefetch_simple_users(ProgressEvent.objects.select_related('progressreport'), 'progressreport__user')
+            ),
+            'progressevent_set__progressreport__uploads',
+            'comments__uploads'
+        )
+
+        user = self.request.user
+        if user.is_authenticated():
+            queryset = queryset.prefetch_related(
+                Prefetch('savedtask_set', queryset=SavedTask.objects.filter(user=user), to_attr='current_user_saved_tasks')
+            )
+        return queryset
+
+    @list_route(
+        methods=['get'], url_path='export',
+        permission_classes=[IsAdminUser], serializer_class=ExportSerializer
+    )
+    def export(self, request):
+        """
+        Streams the filtered tasks as CSV or JSON lines, see tunga_utils.export
+        ---
+        omit_serializer: true
+        parameters:
+            - name: output
+              description: Export format e.g [csv, ndjson]
+              type: string
+              paramType: query
+        """
+        return get_export_response(self, request, self.get_queryset(), TASK_EXPORT_COLUMNS, 'tunga_tasks')
 
     @detail_route(
         methods=['get'], url_path='meta',
@@ -103,13 +180,14 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         task = get_object_or_404(self.get_queryset(), pk=pk)
         self.check_object_permissions(request, task)
 
-        queryset = task.target_actions.all()
+        # Timeline entries index the task's actions, see create_task_timeline_entries
+        queryset = TaskTimelineEntry.objects.filter(task=task).select_related('action')
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
+            serializer = self.get_serializer([entry.action for entry in page], many=True)
             return self.get_paginated_response(serializer.data)
 
-        serializer = self.get_serializer(queryset, many=True)
+        serializer = self.get_serializer([entry.action for entry in queryset], many=True)
         return Response(serializer.data)
 
     @detail_route(
@@ -182,7 +260,12 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
             if not social_token:
                 return Response({'status': 'Unauthorized'}, status.HTTP_401_UNAUTHORIZED)
 
-            r = github.api(endpoint=web_hook_endpoint, method=hook_method, data=data, access_token=social_token.token)
+            try:
+                r = github.api(
+                    endpoint=web_hook_endpoint, method=hook_method, data=data, access_token=social_token.token
+                )
+            except github.GitHubError as e:
+                return Response(e.data, e.status_code)
             if r.status_code in [200, 201]:
                 hook = r.json()
                 integration = serializer.save(secret=secret)
@@ -213,111 +296,31 @@ class TaskViewSet(viewsets.ModelViewSet, SaveUploadsMixin):
         except:
             integration = None
         if integration:
+            # Read the raw body before anything parses it, the signature is computed over it
+            body = request.body
+            if integration.secret and not github.verify_signature(
+                    integration.secret, body, request.META.get(github.HEADER_SIGNATURE, None)
+            ):
+                return Response({'status': 'Invalid signature'}, status.HTTP_403_FORBIDDEN)
+
             github_event_name = request.META.get(github.HEADER_EVENT_NAME, None)
-            delivery_id = request.META.get(github.HEADER_DELIVERY_ID, None)
-            activity = {}
             if github_event_name:
-                payload = request.data
-
-                if github_event_name == github.EVENT_PUSH:
-                    # Push event
-                    if payload[github.PAYLOAD_HEAD_COMMIT]:
-                        head_commit = payload[github.PAYLOAD_HEAD_COMMIT]
-                        activity[slugs.ACTIVITY_URL] = head_commit[github.PAYLOAD_URL]
-                        activity[slugs.ACTIVITY_REF] = head_commit[github.PAYLOAD_ID]
-                        activity[slugs.ACTIVITY_REF_NAME] = head_commit[github.PAYLOAD_TREE_ID]
-                        activity[slugs.ACTIVITY_USERNAME] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_USERNAME]
-                        activity[slugs.ACTIVITY_AVATAR_URL] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_AVATAR_URL]
-                        activity[slugs.ACTIVITY_BODY] = head_commit[github.PAYLOAD_MESSAGE]
-                        activity[slugs.ACTIVITY_CREATED_AT] = parse(head_commit[github.PAYLOAD_TIMESTAMP])
-                elif github_event_name == github.EVENT_ISSUE:
-                    # Issue
-                    issue_actions = [
-                        github.PAYLOAD_ACTION_OPENED, github.PAYLOAD_ACTION_CLOSED,
-                        github.PAYLOAD_ACTION_EDITED, github.PAYLOAD_ACTION_REOPENED
-                    ]
-                    if payload[github.PAYLOAD_ISSUE] and payload[github.PAYLOAD_ACTION] in issue_actions:
-                        issue = payload[github.PAYLOAD_ISSUE]
-                        activity[slugs.ACTIVITY_ACTION] = payload[github.PAYLOAD_ACTION]
-                        activity[slugs.ACTIVITY_URL] = issue[github.PAYLOAD_HTML_URL]
-                        activity[slugs.ACTIVITY_REF] = issue[github.PAYLOAD_ID]
-                        activity[slugs.ACTIVITY_REF_NAME] = issue[github.PAYLOAD_NUMBER]
-                        activity[slugs.ACTIVITY_USERNAME] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_USERNAME]
-                        activity[slugs.ACTIVITY_AVATAR_URL] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_AVATAR_URL]
-                        activity[slugs.ACTIVITY_TITLE] = issue[github.PAYLOAD_TITLE]
-                        activity[slugs.ACTIVITY_BODY] = issue[github.PAYLOAD_BODY]
-                        activity[slugs.ACTIVITY_CREATED_AT] = parse(issue[github.PAYLOAD_CREATED_AT])
-                elif github_event_name == github.EVENT_PULL_REQUEST:
-                    # Pull Request
-                    pull_request_actions = [
-                        github.PAYLOAD_ACTION_OPENED, github.PAYLOAD_ACTION_CLOSED,
-                        github.PAYLOAD_ACTION_EDITED, github.PAYLOAD_ACTION_REOPENED
-                    ]
-                    if payload[github.PAYLOAD_PULL_REQUEST] and payload[github.PAYLOAD_ACTION] in pull_request_actions:
-                        pull_request = payload[github.PAYLOAD_PULL_REQUEST]
-                        is_merged = payload[github.PAYLOAD_ACTION] == github.PAYLOAD_ACTION_CLOSED and pull_request[github.PAYLOAD_MERGED]
-                        activity[slugs.ACTIVITY_ACTION] = is_merged and slugs.ACTION_MERGED or payload[github.PAYLOAD_ACTION]
-                        activity[slugs.ACTIVITY_URL] = pull_request[github.PAYLOAD_HTML_URL]
-                        activity[slugs.ACTIVITY_REF] = pull_request[github.PAYLOAD_ID]
-                        activity[slugs.ACTIVITY_REF_NAME] = pull_request[github.PAYLOAD_NUMBER]
-                        activity[slugs.ACTIVITY_USERNAME] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_USERNAME]
-                        activity[slugs.ACTIVITY_AVATAR_URL] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_AVATAR_URL]
-                        activity[slugs.ACTIVITY_TITLE] = pull_request[github.PAYLOAD_TITLE]
-                        activity[slugs.ACTIVITY_BODY] = pull_request[github.PAYLOAD_BODY]
-                        activity[slugs.ACTIVITY_CREATED_AT] = parse(pull_request[github.PAYLOAD_CREATED_AT])
-                elif github_event_name in [github.EVENT_CREATE, github.EVENT_DELETE]:
-                    # Branch and Tag creation and deletion
-                    tracked_ref_types = [github.PAYLOAD_REF_TYPE_BRANCH, github.PAYLOAD_REF_TYPE_TAG]
-                    if payload[github.PAYLOAD_REF_TYPE] in tracked_ref_types:
-                        activity[slugs.ACTIVITY_EVENT_ID] = payload[github.PAYLOAD_REF_TYPE] == github.PAYLOAD_REF_TYPE_BRANCH and slugs.BRANCH or slugs.TAG
-                        activity[slugs.ACTIVITY_ACTION] = github_event_name == github.EVENT_CREATE and slugs.ACTION_CREATED or slugs.ACTION_DELETED
-                        activity[slugs.ACTIVITY_URL] = '%s/tree/%s' % (
-                            payload[github.PAYLOAD_REPOSITORY][github.PAYLOAD_HTML_URL], payload[github.PAYLOAD_REF]
-                        )
-                        activity[slugs.ACTIVITY_REF] = payload[github.PAYLOAD_REF]
-                        activity[slugs.ACTIVITY_USERNAME] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_USERNAME]
-                        activity[slugs.ACTIVITY_AVATAR_URL] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_AVATAR_URL]
-                elif github_event_name in [github.EVENT_COMMIT_COMMENT, github.EVENT_ISSUE_COMMENT, github.EVENT_PULL_REQUEST_REVIEW_COMMENT]:
-                    # Commit, Issue and Pull Request comments
-                    if payload[github.PAYLOAD_ACTION] == github.PAYLOAD_ACTION_CREATED:
-                        comment = payload[github.PAYLOAD_COMMENT]
-                        activity[slugs.ACTIVITY_ACTION] = slugs.ACTION_CREATED
-                        activity[slugs.ACTIVITY_URL] = comment[github.PAYLOAD_HTML_URL]
-                        activity[slugs.ACTIVITY_REF] = comment[github.PAYLOAD_ID]
-                        activity[slugs.ACTIVITY_USERNAME] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_USERNAME]
-                        activity[slugs.ACTIVITY_AVATAR_URL] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_AVATAR_URL]
-                        activity[slugs.ACTIVITY_BODY] = comment[github.PAYLOAD_BODY]
-                        activity[slugs.ACTIVITY_CREATED_AT] = parse(comment[github.PAYLOAD_CREATED_AT])
-                elif github_event_name == github.EVENT_RELEASE:
-                    # Release
-                    release_actions = [github.PAYLOAD_ACTION_PUBLISHED]
-                    if payload[github.PAYLOAD_RELEASE] and payload[github.PAYLOAD_ACTION] in release_actions:
-                        release = payload[github.PAYLOAD_RELEASE]
-                        activity[slugs.ACTIVITY_ACTION] = payload[github.PAYLOAD_ACTION]
-                        activity[slugs.ACTIVITY_URL] = release[github.PAYLOAD_HTML_URL]
-                        activity[slugs.ACTIVITY_REF] = release[github.PAYLOAD_ID]
-                        activity[slugs.ACTIVITY_REF_NAME] = release[github.PAYLOAD_TAG_NAME]
-                        activity[slugs.ACTIVITY_USERNAME] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_USERNAME]
-                        activity[slugs.ACTIVITY_AVATAR_URL] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_AVATAR_URL]
-                        activity[slugs.ACTIVITY_TITLE] = release[github.PAYLOAD_TITLE]
-                        activity[slugs.ACTIVITY_BODY] = release[github.PAYLOAD_BODY]
-                        activity[slugs.ACTIVITY_CREATED_AT] = parse(release[github.PAYLOAD_CREATED_AT])
-                elif github_event_name == github.EVENT_GOLLUM:
-                    # Wiki creation and updates
-                    if payload[github.PAYLOAD_PAGES]:
-                        first_page = payload[github.PAYLOAD_PAGES][0]
-                        activity[slugs.ACTIVITY_ACTION] = first_page[github.PAYLOAD_ACTION] == github.PAYLOAD_ACTION_CREATED and slugs.ACTION_CREATED or slugs.ACTION_EDITED
-                        activity[slugs.ACTIVITY_URL] = first_page[github.PAYLOAD_HTML_URL]
-                        activity[slugs.ACTIVITY_REF] = payload[github.PAYLOAD_PAGE_NAME]
-                        activity[slugs.ACTIVITY_USERNAME] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_USERNAME]
-                        activity[slugs.ACTIVITY_AVATAR_URL] = payload[github.PAYLOAD_SENDER][github.PAYLOAD_AVATAR_URL]
-                        activity[slugs.ACTIVITY_BODY] = first_page[github.PAYLOAD_SUMMARY]
-
-                if activity:
-                    if not activity.get(slugs.ACTIVITY_EVENT_ID, None):
-                        activity[slugs.ACTIVITY_EVENT_ID] = github.transform_to_tunga_event(github_event_name)
-                    activity[slugs.ACTIVITY_INTEGRATION] = integration
-                    IntegrationActivity.objects.create(**activity)
+                # Deliveries are stored and processed by the github queue's worker,
+                # redeliveries of the same delivery id are acknowledged without being queued again
+                delivery_id = request.META.get(github.HEADER_DELIVERY_ID, None) or hashlib.sha1(
+                    '%s:%s' % (github_event_name, body)
+                ).hexdigest()
+                try:
+                    delivery, created = IntegrationDelivery.objects.get_or_create(
+                        delivery_id=delivery_id,
+                        defaults={'integration': integration, 'event': github_event_name, 'payload': body}
+                    )
+                except IntegrityError:
+                    # A concurrent redelivery stored it first, e.g before this transaction's snapshot could see it
+                    created = False
+                if created:
+                    process_integration_deliveries.delay([delivery.id])
+                return Response({'status': 'Accepted'}, status.HTTP_202_ACCEPTED)
         return Response({'status': 'Received'})
 
 
@@ -333,7 +336,7 @@ class ApplicationViewSet(viewsets.ModelViewSet):
     search_fields = ('task__title', 'task__skills__name', '^user__username', '^user__first_name', '^user__last_name')
 
 
-class ParticipationViewSet(viewsets.ModelViewSet):
+class ParticipationViewSet(ClearPermissionCacheMixin, viewsets.ModelViewSet):
     """
     Task Participation Resource
     """
@@ -344,6 +347,45 @@ class ParticipationViewSet(viewsets.ModelViewSet):
     filter_backends = DEFAULT_FILTER_BACKENDS + (ParticipationFilterBackend,)
     search_fields = ('task__title', 'task__skills__name', '^user__username', '^user__first_name', '^user__last_name')
 
+    @list_route(
+        methods=['get'], url_path='export',
+        permission_classes=[IsAdminUser], serializer_class=ExportSerializer
+    )
+    def export(self, request):
+        """
+        Streams the filtered participation as CSV or JSON lines, see tunga_utils.export
+        ---
+        omit_serializer: true
+        parameters:
+            - name: output
+              description: Export format e.g [csv, ndjson]
+              type: string
+              paramType: query
+        """
+        return get_export_response(
+            self, request, self.get_queryset(), PARTICIPATION_EXPORT_COLUMNS, 'tunga_participation'
+        )
+
+    @list_route(
+        methods=['get'], url_path='payments',
+        permission_classes=[IsAdminUser], serializer_class=ExportSerializer
+    )
+    def payments(self, request):
+        """
+        Streams the filtered accepted participants with their share and their task's fee and payment status
+        as CSV or JSON lines for payout reports, see tunga_utils.export
+        ---
+        omit_serializer: true
+        parameters:
+            - name: output
+              description: Export format e.g [csv, ndjson]
+              type: string
+              paramType: query
+        """
+        return get_export_response(
+            self, request, self.get_queryset().filter(accepted=True), PAYMENT_EXPORT_COLUMNS, 'tunga_payments'
+        )
+
 
 class TaskRequestViewSet(viewsets.ModelViewSet):
     """
@@ -392,7 +434,7 @@ class ProgressReportViewSet(viewsets.ModelViewSet):
     serializer_class = ProgressReportSerializer
     permission_classes = [IsAuthenticated, DRYPermissions]
     filter_class = ProgressReportFilter
-    filter_backends = DEFAULT_FILTER_BACKENDS + (ProgressReportFilterBackend,)
+    filter_backends = FULL_TEXT_FILTER_BACKENDS + (ProgressReportFilterBackend,)
     search_fields = (
         '^user__username', '^user__first_name', '^user__last_name', 'accomplished', 'next_steps', 'remarks',
         'event__task__title', 'event__task__skills__name'
@@ -9,3 +9,6 @@ class TungaUtilsConfig(AppConfig):
 
     def ready(self):
         from tunga_utils import signals
+        from tunga_utils import search_indexes
+        from tunga_utils.emails import load_mail_templates
+        load_mail_templates()
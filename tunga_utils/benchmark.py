@@ -0,0 +1,585 @@
+import datetime
+import json
+import os
+import random
+import threading
+import time
+
+from actstream.models import Action
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.mail.message import EmailMultiAlternatives
+from django.db import connection
+from django.template.exceptions import TemplateDoesNotExist
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from tunga.settings import DEFAULT_FROM_EMAIL
+from tunga_activity import verbs
+from tunga_auth.models import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER
+from tunga_comments.models import Comment
+from tunga_messages.models import Channel, ChannelUser, Message, CHANNEL_TYPE_TOPIC
+from tunga_messages.tasks import reconcile_unread_counts, create_channel
+from tunga_profiles.models import UserProfile, Connection, Skill, Education, Work, DeveloperApplication
+from tunga_settings.models import VISIBILITY_DEVELOPER, VISIBILITY_MY_TEAM, VISIBILITY_CUSTOM
+from tunga_tasks.models import Project, Task, Application, Participation, SavedTask, TaskRequest, ProgressEvent, \
+    ProgressReport, PROGRESS_EVENT_TYPE_MILESTONE, PROGRESS_REPORT_STATUS_ON_SCHEDULE, TASK_REQUEST_CLOSE
+from tunga_tasks.tasks import rebuild_task_visibility
+from tunga_utils.cache import bump_cache_version, SHARED_CACHE_NAMESPACES
+from tunga_utils.emails import render_mail, send_mails, render_many
+from tunga_utils.github import extract_activity
+
+BUDGETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_budgets.json')
+GITHUB_PAYLOADS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'github_payloads.json')
+
+ROLE_DEVELOPER = 'developer'
+ROLE_PROJECT_OWNER = 'project_owner'
+ROLE_STAFF = 'staff'
+
+ROLES = [ROLE_DEVELOPER, ROLE_PROJECT_OWNER, ROLE_STAFF]
+
+SEED_PREFIX = 'bench'
+
+
+def seed_dataset(size=1, seed=0):
+    """
+    Seeds a synthetic dataset of users, tasks, applications, participation, channels, messages and activity.
+    Rows are bulk inserted so no signals (emails, actions, rq jobs) fire.
+    The first developer and project owner are the benchmark users and take part in a large share of the data
+    so that their list pages are always full.
+    :param size: Multiplier for the number of rows, size=1 gives a few hundred rows, size=25 a few thousand users
+    :param seed: Seed for the random generator so that datasets are reproducible
+    :return: dict with the benchmark users for each role
+    """
+    rand = random.Random(seed)
+    user_model = get_user_model()
+
+    user_model.objects.bulk_create(
+        [
+            user_model(
+                username='%s-dev-%s' % (SEED_PREFIX, i), email='%s-dev-%s@example.com' % (SEED_PREFIX, i),
+                first_name='Developer', last_name='%s' % i, type=USER_TYPE_DEVELOPER, pending=False, password='!'
+            ) for i in range(40 * size)
+        ] + [
+            user_model(
+                username='%s-po-%s' % (SEED_PREFIX, i), email='%s-po-%s@example.com' % (SEED_PREFIX, i),
+                first_name='Owner', last_name='%s' % i, type=USER_TYPE_PROJECT_OWNER, pending=False, password='!'
+            ) for i in range(10 * size)
+        ] + [
+            user_model(
+                username='%s-staff' % SEED_PREFIX, email='%s-staff@example.com' % SEED_PREFIX,
+                first_name='Staff', is_staff=True, is_superuser=True, pending=False, password='!'
+            )
+        ]
+    )
+    developers = list(user_model.objects.filter(username__startswith='%s-dev-' % SEED_PREFIX).order_by('id'))
+    owners = list(user_model.objects.filter(username__startswith='%s-po-' % SEED_PREFIX).order_by('id'))
+    staff = user_model.objects.get(username='%s-staff' % SEED_PREFIX)
+    developer = developers[0]
+    owner = owners[0]
+
+    UserProfile.objects.bulk_create(
+        [
+            UserProfile(user=user, bio='Bio of %s' % user.username, company='Company %s' % user.id)
+            for user in developers + owners
+        ]
+    )
+
+    skills = [Skill.objects.get_or_create(name='%s skill %s' % (SEED_PREFIX, i))[0] for i in range(10)]
+    skill_relation = UserProfile._meta.get_field('skills').rel.through
+    skill_relation.objects.bulk_create(
+        [
+            skill_relation(userprofile=profile, skill=skill)
+            for profile in UserProfile.objects.filter(user__in=developers)
+            for skill in rand.sample(skills, 3)
+        ]
+    )
+
+    Education.objects.bulk_create(
+        [
+            Education(user=user, institution='University', award='BSc', start_month=1, start_year=2010)
+            for user in developers
+        ]
+    )
+    Work.objects.bulk_create(
+        [Work(user=user, company='Company', position='Developer', start_month=1, start_year=2012) for user in developers]
+    )
+    DeveloperApplication.objects.bulk_create(
+        [
+            DeveloperApplication(
+                first_name='Applicant', last_name='%s' % i, email='%s-applicant-%s@example.com' % (SEED_PREFIX, i),
+                phone_number='0700000000', country='UG', city='Kampala', stack='Django', experience='5 years',
+                discovery_story='Search'
+            ) for i in range(20 * size)
+        ]
+    )
+
+    connections = []
+    for user in developers[1:] + owners:
+        connections.append(Connection(from_user=user, to_user=developer, accepted=True, responded=True))
+        if user not in owners:
+            connections.append(Connection(from_user=owner, to_user=user, accepted=True, responded=True))
+    for user in developers[1:]:
+        other = rand.choice(developers[1:])
+        if other != user:
+            connections.append(Connection(from_user=user, to_user=other, accepted=rand.random() > 0.3, responded=True))
+    Connection.objects.bulk_create(connections)
+
+    Project.objects.bulk_create(
+        [Project(user=user, title='%s project %s' % (SEED_PREFIX, i)) for user in owners for i in range(3)]
+    )
+    projects = list(Project.objects.filter(title__startswith=SEED_PREFIX).order_by('id'))
+
+    visibilities = [VISIBILITY_DEVELOPER, VISIBILITY_DEVELOPER, VISIBILITY_MY_TEAM, VISIBILITY_CUSTOM]
+    tasks = []
+    for i in range(100 * size):
+        task_owner = i % 4 == 0 and owner or rand.choice(owners)
+        tasks.append(
+            Task(
+                user=task_owner, project=rand.choice([None] + [p for p in projects if p.user_id == task_owner.id]),
+                title='%s task %s' % (SEED_PREFIX, i), description='Description of task %s' % i,
+                fee=rand.randint(10, 1000), visibility=rand.choice(visibilities), closed=rand.random() > 0.8
+            )
+        )
+    Task.objects.bulk_create(tasks)
+    tasks = list(Task.objects.filter(title__startswith='%s task ' % SEED_PREFIX).order_by('id'))
+
+    task_skill_relation = Task._meta.get_field('skills').rel.through
+    task_skill_relation.objects.bulk_create(
+        [task_skill_relation(task=task, skill=skill) for task in tasks for skill in rand.sample(skills, 2)]
+    )
+
+    applications = []
+    participation = []
+    saved_tasks = []
+    for i, task in enumerate(tasks):
+        applicants = rand.sample(developers[1:], 3)
+        participants = rand.sample([user for user in developers[1:] if user not in applicants], 2)
+        if i % 3 == 0:
+            participants.append(developer)
+        else:
+            applicants.append(developer)
+            saved_tasks.append(SavedTask(user=developer, task=task))
+        for user in applicants:
+            applications.append(
+                Application(
+                    user=user, task=task, pitch='Pitch', hours_needed=10, hours_available=20,
+                    deliver_at=datetime.datetime.utcnow(), responded=rand.random() > 0.5
+                )
+            )
+        for user in participants:
+            participation.append(
+                Participation(
+                    user=user, task=task, created_by=task.user, accepted=True, responded=True,
+                    assignee=user == participants[0], activated_at=datetime.datetime.utcnow()
+                )
+            )
+    Application.objects.bulk_create(applications)
+    Participation.objects.bulk_create(participation)
+    SavedTask.objects.bulk_create(saved_tasks)
+    TaskRequest.objects.bulk_create(
+        [TaskRequest(user=developer, task=task, type=TASK_REQUEST_CLOSE) for task in tasks[::3]]
+    )
+
+    now = datetime.datetime.utcnow()
+    ProgressEvent.objects.bulk_create(
+        [
+            ProgressEvent(
+                task=task, type=PROGRESS_EVENT_TYPE_MILESTONE, title='Milestone %s' % j, created_by=task.user,
+                due_at=now + datetime.timedelta(days=j)
+            ) for task in tasks for j in range(3)
+        ]
+    )
+    ProgressReport.objects.bulk_create(
+        [
+            ProgressReport(
+                event=event, user=developer, status=PROGRESS_REPORT_STATUS_ON_SCHEDULE, percentage=50,
+                accomplished='Some work'
+            ) for event in ProgressEvent.objects.filter(task__in=tasks[::3], title='Milestone 0')
+        ]
+    )
+
+    task_content_type = ContentType.objects.get_for_model(Task)
+    Comment.objects.bulk_create(
+        [
+            Comment(user=rand.choice([task.user, developer]), body='Comment %s' % j,
+                    content_type=task_content_type, object_id=task.id)
+            for task in tasks for j in range(2)
+        ]
+    )
+
+    Channel.objects.bulk_create(
+        [
+            Channel(subject='%s channel %s' % (SEED_PREFIX, i), created_by=rand.choice(owners), type=CHANNEL_TYPE_TOPIC)
+            for i in range(30 * size)
+        ]
+    )
+    channels = list(Channel.objects.filter(subject__startswith=SEED_PREFIX).order_by('id'))
+    channel_users = []
+    messages = []
+    for i, channel in enumerate(channels):
+        members = set(rand.sample(developers[1:] + owners[1:], 3))
+        members.add(channel.created_by)
+        if i % 2 == 0:
+            members.update([developer, owner])
+        for user in members:
+            channel_users.append(ChannelUser(channel=channel, user=user))
+        members = list(members)
+        for j in range(10):
+            messages.append(Message(channel=channel, user=rand.choice(members), body='Message %s' % j))
+    ChannelUser.objects.bulk_create(channel_users)
+    Message.objects.bulk_create(messages)
+
+    user_content_type = ContentType.objects.get_for_model(user_model)
+    application_content_type = ContentType.objects.get_for_model(Application)
+    participation_content_type = ContentType.objects.get_for_model(Participation)
+    comment_content_type = ContentType.objects.get_for_model(Comment)
+    actions = []
+    for task in tasks:
+        actions.append(
+            Action(
+                actor_content_type=user_content_type, actor_object_id=task.user_id, verb=verbs.CREATE,
+                action_object_content_type=task_content_type, action_object_object_id=task.id
+            )
+        )
+    for application in Application.objects.filter(task__in=tasks):
+        actions.append(
+            Action(
+                actor_content_type=user_content_type, actor_object_id=application.user_id, verb=verbs.APPLY,
+                action_object_content_type=application_content_type, action_object_object_id=application.id,
+                target_content_type=task_content_type, target_object_id=application.task_id
+            )
+        )
+    for item in Participation.objects.filter(task__in=tasks):
+        actions.append(
+            Action(
+                actor_content_type=user_content_type, actor_object_id=item.created_by_id, verb=verbs.ADD,
+                action_object_content_type=participation_content_type, action_object_object_id=item.id,
+                target_content_type=task_content_type, target_object_id=item.task_id
+            )
+        )
+    for comment in Comment.objects.filter(content_type=task_content_type, object_id__in=[task.id for task in tasks]):
+        actions.append(
+            Action(
+                actor_content_type=user_content_type, actor_object_id=comment.user_id, verb=verbs.COMMENT,
+                action_object_content_type=comment_content_type, action_object_object_id=comment.id,
+                target_content_type=task_content_type, target_object_id=comment.object_id
+            )
+        )
+    Action.objects.bulk_create(actions)
+
+    # bulk inserts skip the signals that maintain the visibility index
+    rebuild_task_visibility()
+    reconcile_unread_counts()
+
+    return {ROLE_DEVELOPER: developer, ROLE_PROJECT_OWNER: owner, ROLE_STAFF: staff}
+
+
+def get_router_endpoints():
+    """
+    Lists the url names of the list and detail routes of every viewset registered on the api router
+    :return: list of (prefix, list url name, detail url name)
+    """
+    from tunga.urls import router
+
+    endpoints = []
+    for prefix, viewset, base_name in router.registry:
+        if not base_name:
+            base_name = router.get_default_base_name(viewset)
+        endpoints.append((prefix, '%s-list' % base_name, '%s-detail' % base_name))
+    return endpoints
+
+
+def measure_request(client, url):
+    """
+    Requests a url and measures its database and serialization cost
+    :return: dict with the status code, query count, sql time, serialization time and response size
+    """
+    # Budgets are for building responses, not for serving them from the response cache
+    for namespace in SHARED_CACHE_NAMESPACES:
+        bump_cache_version(namespace)
+    with CaptureQueriesContext(connection) as context:
+        start = time.time()
+        response = client.get(url)
+        total_time = time.time() - start
+    sql_time = sum([float(query['time']) for query in context.captured_queries])
+    return {
+        'status': response.status_code,
+        'queries': len(context.captured_queries),
+        'sql_time': sql_time,
+        'serialization_time': max(total_time - sql_time, 0),
+        'size': len(response.content),
+        'response': response
+    }
+
+
+def benchmark_endpoints(users):
+    """
+    Hits the list route, and the detail route of the first listed object, of every router endpoint for each role
+    :param users: dict of role -> user as returned by seed_dataset
+    :return: list of results, one per endpoint and role
+    """
+    client = APIClient()
+    results = []
+    for role in ROLES:
+        client.force_authenticate(user=users[role])
+        for prefix, list_name, detail_name in get_router_endpoints():
+            measurement = measure_request(client, reverse(list_name))
+            response = measurement.pop('response')
+            measurement.update({'endpoint': list_name, 'role': role})
+            results.append(measurement)
+
+            items = []
+            if response.status_code == 200:
+                items = isinstance(response.data, dict) and response.data.get('results', []) or response.data
+            if isinstance(items, list) and items and 'id' in items[0]:
+                measurement = measure_request(client, reverse(detail_name, args=[items[0]['id']]))
+                measurement.pop('response')
+                measurement.update({'endpoint': detail_name, 'role': role})
+                results.append(measurement)
+        client.force_authenticate(user=None)
+    return results
+
+
+def read_budgets(path=BUDGETS_FILE):
+    """
+    Reads the committed query budgets
+    :return: dict with the dataset size and seed the budgets were recorded with and the budgets per endpoint and role
+    """
+    try:
+        with open(path) as budgets_file:
+            return json.load(budgets_file)
+    except IOError:
+        return {'size': 1, 'seed': 0, 'budgets': {}}
+
+
+def write_budgets(results, size, seed, path=BUDGETS_FILE):
+    budgets = {}
+    for result in results:
+        budgets.setdefault(result['endpoint'], {})[result['role']] = {
+            'status': result['status'], 'queries': result['queries']
+        }
+    with open(path, 'w') as budgets_file:
+        json.dump(
+            {'size': size, 'seed': seed, 'budgets': budgets}, budgets_file,
+            indent=4, sort_keys=True, separators=(',', ': ')
+        )
+        budgets_file.write('\n')
+    return budgets
+
+
+def check_budgets(results, budgets):
+    """
+    Compares query counts and status codes against the committed budgets.
+    A budget only holds for the status it was recorded with e.g the query count of a 403 says nothing about a 200
+    :param budgets: dict of endpoint -> role -> dict with the status code and maximum number of queries
+    :return: list of results that changed status or went over budget, each annotated with its budget
+    """
+    failures = []
+    for result in results:
+        budget = budgets.get(result['endpoint'], {}).get(result['role'], None)
+        if budget is None:
+            continue
+        if result['status'] != budget['status'] or result['queries'] > budget['queries']:
+            failure = dict(result)
+            failure['budget'] = budget
+            failures.append(failure)
+    return failures
+
+
+def describe_budget_failure(failure):
+    """
+    :param failure: result as returned by check_budgets
+    """
+    budget = failure['budget']
+    if failure['status'] != budget['status']:
+        problem = 'status %s, budget recorded with %s' % (failure['status'], budget['status'])
+    else:
+        problem = '%s > %s queries' % (failure['queries'], budget['queries'])
+    return '%s as %s (%s)' % (failure['endpoint'], failure['role'], problem)
+
+
+def read_github_payloads(path=GITHUB_PAYLOADS_FILE):
+    """
+    Reads the recorded GitHub web hook payloads
+    :return: list of dicts with the event name and the payload
+    """
+    with open(path) as payloads_file:
+        return json.load(payloads_file)
+
+
+def benchmark_github_extractors(samples, iterations=10000):
+    """
+    Times decoding and extracting activities from recorded GitHub web hook payloads
+    :param samples: list of dicts with the event name and the payload as returned by read_github_payloads
+    :return: list of results with the event, number of extracted fields and seconds per decode and extraction
+    """
+    results = []
+    for sample in samples:
+        event = sample['event']
+        body = json.dumps(sample['payload'])
+        payload = json.loads(body)
+
+        start = time.time()
+        for i in xrange(iterations):
+            json.loads(body)
+        decode_time = (time.time() - start) / iterations
+
+        start = time.time()
+        for i in xrange(iterations):
+            activity = extract_activity(event, payload)
+        extract_time = (time.time() - start) / iterations
+
+        results.append({
+            'event': event, 'fields': len(activity), 'decode_time': decode_time, 'extract_time': extract_time
+        })
+    return results
+
+
+MAIL_BENCHMARK_TEMPLATE = 'tunga/email/email_progress_event_reminder'
+
+
+def start_smtp_sink():
+    """
+    Starts a local SMTP server that accepts and discards every email, as a stand-in for a real mail server
+    :return: (server, port), close the server to stop it
+    """
+    import asyncore
+    import smtpd
+
+    class SMTPSink(smtpd.SMTPServer):
+        def process_message(self, peer, mailfrom, rcpttos, data):
+            return None
+
+    server = SMTPSink(('127.0.0.1', 0), None)
+    thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1})
+    thread.daemon = True
+    thread.start()
+    return server, server.socket.getsockname()[1]
+
+
+def get_mail_benchmark_contexts(count):
+    due_at = datetime.datetime.utcnow()
+    return [
+        {
+            'owner': {'display_name': 'Owner %s' % i},
+            'event': {'due_at': due_at, 'title': 'Update %s' % i, 'task': {'summary': 'Task %s' % i}},
+            'update_url': 'https://tunga.io/task/%s/event/%s/' % (i, i)
+        } for i in xrange(count)
+    ]
+
+
+def benchmark_mail_dispatch(count=100, smtp=False):
+    """
+    Times sending reminder emails one by one (templates rendered from scratch and a new connection per email)
+    against the batched dispatcher (compiled templates and one connection for all emails)
+    :param smtp: Send to a local SMTP sink instead of the locmem backend
+    :return: dict with the seconds per email of each strategy
+    """
+    contexts = get_mail_benchmark_contexts(count)
+    to = ['developer@example.com']
+    server = None
+    mail_settings = {'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend'}
+    if smtp:
+        server, port = start_smtp_sink()
+        mail_settings = {
+            'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+            'EMAIL_HOST': '127.0.0.1', 'EMAIL_PORT': port, 'EMAIL_USE_TLS': False,
+            'EMAIL_HOST_USER': '', 'EMAIL_HOST_PASSWORD': ''
+        }
+
+    try:
+        with override_settings(**mail_settings):
+            start = time.time()
+            for ctx in contexts:
+                # What every email cost before the dispatcher, the templates were loaded on every render
+                bodies = dict([
+                    (ext, render_to_string('%s.%s' % (MAIL_BENCHMARK_TEMPLATE, ext), ctx).strip())
+                    for ext in ['html', 'txt']
+                ])
+                msg = EmailMultiAlternatives('Reminder', bodies['txt'], DEFAULT_FROM_EMAIL, to)
+                msg.attach_alternative(bodies['html'], 'text/html')
+                msg.send()
+            single_time = (time.time() - start) / count
+
+            start = time.time()
+            messages = [render_mail('Reminder', MAIL_BENCHMARK_TEMPLATE, to, ctx) for ctx in contexts]
+            sent = send_mails(messages)
+            batch_time = (time.time() - start) / count
+    finally:
+        if server:
+            server.close()
+    return {'count': count, 'sent': sum(sent), 'single_time': single_time, 'batch_time': batch_time}
+
+
+def benchmark_mail_rendering(count=100, template_prefix=MAIL_BENCHMARK_TEMPLATE):
+    """
+    Times rendering an email's bodies by looking up its template variants on every email
+    against rendering the registry's compiled templates with render_many
+    :return: dict with the seconds per email of each strategy
+    """
+    contexts = get_mail_benchmark_contexts(count)
+
+    start = time.time()
+    for ctx in contexts:
+        # How render_mail resolved and loaded the variants of a template for every email
+        bodies = {}
+        for ext in ['html', 'txt']:
+            try:
+                bodies[ext] = render_to_string('{0}.{1}'.format(template_prefix, ext), ctx).strip()
+            except TemplateDoesNotExist:
+                if ext == 'txt' and not bodies:
+                    raise
+    lookup_time = (time.time() - start) / count
+
+    start = time.time()
+    render_many(template_prefix, contexts)
+    registry_time = (time.time() - start) / count
+    return {'count': count, 'lookup_time': lookup_time, 'registry_time': registry_time}
+
+
+CHANNEL_BENCHMARK_SIZES = [10, 100, 1000]
+
+
+def benchmark_channel_creation(sizes=CHANNEL_BENCHMARK_SIZES):
+    """
+    Times creating channels by adding every participant with its own queries
+    against create_channel's batched inserts and signals
+    :param sizes: Numbers of participants per channel
+    :return: list of results with the query count and seconds of each strategy per channel size
+    """
+    user_model = get_user_model()
+    user_model.objects.bulk_create([
+        user_model(
+            username='%s-channel-%s' % (SEED_PREFIX, i), email='%s-channel-%s@example.com' % (SEED_PREFIX, i),
+            first_name='Participant', last_name='%s' % i, type=USER_TYPE_DEVELOPER, pending=False, password='!'
+        ) for i in range(max(sizes))
+    ])
+    users = list(user_model.objects.filter(username__startswith='%s-channel-' % SEED_PREFIX).order_by('id'))
+    initiator = users[0]
+
+    results = []
+    for size in sizes:
+        participants = users[1:size]
+
+        with CaptureQueriesContext(connection) as single_context:
+            start = time.time()
+            # What create_channel cost before the batched path, one update_or_create and post_save per participant
+            channel = Channel.objects.create(subject='Single %s' % size, created_by=initiator, type=CHANNEL_TYPE_TOPIC)
+            for participant in [initiator] + participants:
+                ChannelUser.objects.update_or_create(channel=channel, user=participant)
+            single_time = time.time() - start
+
+        with CaptureQueriesContext(connection) as batch_context:
+            start = time.time()
+            create_channel(initiator, participants, subject='Batch %s' % size)
+            batch_time = time.time() - start
+
+        results.append({
+            'size': size,
+            'single_queries': len(single_context.captured_queries), 'single_time': single_time,
+            'batch_queries': len(batch_context.captured_queries), 'batch_time': batch_time
+        })
+    return results
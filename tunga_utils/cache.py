@@ -0,0 +1,364 @@
+"""
+Response and serialized fragment caches for read heavy endpoints.
+
+Cached responses are keyed on the versions of the namespaces their data comes from (e.g skills or a user's settings),
+so invalidating a namespace is a single version bump from a post_save/post_delete receiver and stale entries
+are never read again, they just expire. Every cached response carries an ETag of its data so clients that send
+If-None-Match get a 304 without the response being rebuilt or rendered.
+
+Fragments are the serialized dicts of small nested serializers (e.g SimpleUserSerializer) stored per object
+with the versions of the objects they were built from, see FragmentCacheSerializerMixin.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import translation
+from generic_relations.serializers import GenericSerializerMixin
+from rest_framework import status
+from rest_framework.fields import FileField
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer, ListSerializer
+from rest_framework.settings import api_settings
+
+from tunga.settings.base import RESPONSE_CACHE_TIMEOUT
+
+CACHE_NAMESPACE_SKILLS = 'skills'
+CACHE_NAMESPACE_COUNTRIES = 'countries'
+CACHE_NAMESPACE_SETTINGS = 'settings'
+CACHE_NAMESPACE_USER_SETTINGS = 'settings:user:{user}'
+# Every fragment depends on it, bump it when the fields of a fragment cached serializer change
+CACHE_NAMESPACE_FRAGMENTS = 'fragments'
+
+# Namespaces of data shared by all users
+SHARED_CACHE_NAMESPACES = [
+    CACHE_NAMESPACE_SKILLS, CACHE_NAMESPACE_COUNTRIES, CACHE_NAMESPACE_SETTINGS, CACHE_NAMESPACE_FRAGMENTS
+]
+
+
+def get_cache_version_key(namespace):
+    return 'cache_version:%s' % namespace
+
+
+def start_cache_versions(version_keys, versions):
+    """
+    Starts the versions that aren't in the cache yet
+    :param versions: dict of version key -> version as read from the cache, updated in place
+    """
+    for version_key in version_keys:
+        if versions.get(version_key, None) is None:
+            # Starting from the clock keeps a lost version from pointing back at entries cached before it was lost
+            versions[version_key] = int(time.time() * 1000)
+            cache.add(version_key, versions[version_key], timeout=None)
+    return versions
+
+
+def get_cache_versions(namespaces):
+    """
+    :return: list with the current version of each namespace, missing versions are started
+    """
+    version_keys = [get_cache_version_key(namespace) for namespace in namespaces]
+    versions = start_cache_versions(version_keys, cache.get_many(version_keys))
+    return [versions[version_key] for version_key in version_keys]
+
+
+def bump_cache_version(namespace):
+    """
+    Invalidates every response cached for the namespace
+    """
+    version_key = get_cache_version_key(namespace)
+    try:
+        return cache.incr(version_key)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(version_key, version, timeout=None)
+        return version
+
+
+def get_response_cache_key(request, namespaces):
+    versions = get_cache_versions(namespaces)
+    variant = hashlib.md5(
+        ('%s %s' % (translation.get_language(), request.build_absolute_uri())).encode('utf-8')
+    ).hexdigest()
+    return 'response:%s:%s' % (
+        ':'.join(['%s.%s' % (namespace, version) for namespace, version in zip(namespaces, versions)]), variant
+    )
+
+
+def get_etag(data):
+    return '"%s"' % hashlib.md5(json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)).hexdigest()
+
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', None)
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+
+def cache_response(namespaces, timeout=RESPONSE_CACHE_TIMEOUT):
+    """
+    Caches the data of successful responses of a view method and answers matching If-None-Match headers with a 304
+    :param namespaces: Namespaces the response data comes from,
+    {user} is replaced with the current user's id for namespaces of per user data
+    :param timeout: Seconds cached responses are kept, invalidation doesn't rely on it
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, request, *args, **kwargs):
+            user_id = request.user.is_authenticated() and request.user.id or None
+            key = get_response_cache_key(request, [namespace.format(user=user_id) for namespace in namespaces])
+            cached = cache.get(key)
+            if cached is None:
+                response = func(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                etag = get_etag(response.data)
+                cache.set(key, (etag, response.data), timeout=timeout)
+            else:
+                etag, data = cached
+                response = Response(data)
+
+            if etag_matches(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
+
+
+def get_fragment_namespace(model, pk):
+    return 'fragment:%s:%s' % (model._meta.label_lower, pk)
+
+
+def bump_fragment_version(model, pk):
+    """
+    Invalidates the cached fragments built from an object
+    """
+    return bump_cache_version(get_fragment_namespace(model, pk))
+
+
+def get_fragment_key(serializer, instance):
+    return 'fragment:%s:%s' % (type(serializer).__name__, instance.pk)
+
+
+def get_prefetched_objects(manager):
+    """
+    :return: list of the objects of a to-many relation if they were prefetched, otherwise None
+    """
+    queryset = manager.all()
+    if queryset._result_cache is None:
+        return None
+    return list(queryset)
+
+
+def collect_fragment_instances(serializer, instances, collected):
+    """
+    Walks a serializer's fields and collects the instances that its fragment cached serializers will serialize
+    :param instances: Instances the serializer will serialize
+    :param collected: dict of fragment key -> (serializer, instance), updated in place
+    """
+    if isinstance(serializer, ListSerializer):
+        serializer = serializer.child
+    if getattr(serializer, 'fragment_cached', False):
+        for instance in instances:
+            collected.setdefault(get_fragment_key(serializer, instance), (serializer, instance))
+        # Fragments nested in a cached fragment aren't needed, see FragmentLoader.load
+        return
+    collect_nested_fragment_instances(serializer, instances, collected)
+
+
+def collect_nested_fragment_instances(serializer, instances, collected):
+    if not hasattr(serializer, 'fields'):
+        return
+
+    for field in serializer.fields.values():
+        if field.write_only or not isinstance(field, (BaseSerializer, GenericSerializerMixin)):
+            continue
+        values = []
+        for instance in instances:
+            try:
+                value = field.get_attribute(instance)
+            except (AttributeError, KeyError, ObjectDoesNotExist):
+                continue
+            if value is None:
+                continue
+            if isinstance(field, ListSerializer):
+                if hasattr(value, 'all'):
+                    # Relations that weren't prefetched would be queried twice, they're looked up when serialized
+                    value = get_prefetched_objects(value)
+                values.extend(value or [])
+            else:
+                values.append(value)
+
+        if isinstance(field, GenericSerializerMixin):
+            nested = dict()
+            for value in values:
+                try:
+                    nested_serializer = field.get_serializer_for_instance(value)
+                except ValidationError:
+                    continue
+                nested.setdefault(id(nested_serializer), (nested_serializer, []))[1].append(value)
+            for nested_serializer, nested_values in nested.values():
+                collect_fragment_instances(nested_serializer, nested_values, collected)
+        elif values:
+            collect_fragment_instances(field, values, collected)
+
+
+class FragmentLoader(object):
+    """
+    Loads the fragments of one response, see FragmentCacheSerializerMixin
+    """
+
+    def __init__(self, timeout=RESPONSE_CACHE_TIMEOUT):
+        self.timeout = timeout
+        self.collected = dict()
+        self.fragments = dict()
+        # Depth of fragments being built, fragments nested in them are kept without the request's urls
+        self.building = 0
+
+    def load(self, collected):
+        """
+        Reads fragments and the versions of the objects they depend on with one multi-get,
+        then builds the fragments that were missing or stale and stores them with one multi-set.
+        :param collected: dict of fragment key -> (serializer, instance) as collected by collect_fragment_instances
+        """
+        self.collected.update(collected)
+        dependencies = dict()
+        for key, (serializer, instance) in collected.iteritems():
+            dependencies[key] = [get_cache_version_key(CACHE_NAMESPACE_FRAGMENTS)] + [
+                get_cache_version_key(get_fragment_namespace(model, pk))
+                for model, pk in serializer.get_fragment_dependencies(instance)
+            ]
+        version_keys = set([version_key for version_keys in dependencies.values() for version_key in version_keys])
+        cached = cache.get_many(collected.keys() + list(version_keys))
+        versions = start_cache_versions(version_keys, cached)
+
+        stale = dict()
+        for key in collected:
+            fragment_versions = [versions[version_key] for version_key in dependencies[key]]
+            fragment = cached.get(key, None)
+            if fragment and fragment[0] == fragment_versions:
+                self.fragments[key] = fragment[1]
+            else:
+                stale[key] = fragment_versions
+        if not stale:
+            return
+
+        # Building stale fragments needs the fragments nested in them, they're read together
+        nested = dict()
+        for key in stale:
+            serializer, instance = collected[key]
+            collect_nested_fragment_instances(serializer, [instance], nested)
+        nested = dict([(key, value) for key, value in nested.iteritems() if key not in self.collected])
+        if nested:
+            self.load(nested)
+
+        for key in stale:
+            self.get(*collected[key])
+        cache.set_many(
+            dict([(key, (fragment_versions, self.fragments[key])) for key, fragment_versions in stale.iteritems()]),
+            timeout=self.timeout
+        )
+
+    def get(self, serializer, instance):
+        key = get_fragment_key(serializer, instance)
+        if key not in self.fragments:
+            if key in self.collected:
+                self.building += 1
+                try:
+                    self.fragments[key] = serializer.to_fragment(instance)
+                finally:
+                    self.building -= 1
+            else:
+                # Not reachable from the root's fields e.g serialized in a method field
+                self.load({key: (serializer, instance)})
+        return self.fragments[key]
+
+
+class FragmentCacheSerializerMixin(object):
+    """
+    Serves a model serializer's output from the fragment cache.
+
+    The first time a fragment cached serializer is used in a response, the instances every fragment cached serializer
+    in the response will serialize are collected from the root serializer and their fragments are loaded at once
+    by a FragmentLoader. Fragments are invalidated by bumping the version of an object they depend on
+    with bump_fragment_version, e.g from a post_save receiver.
+    Only the class that mixes this in is cached, subclasses can add fields and are serialized as usual.
+    Fragments don't depend on the request, urls of files and images are cached relative
+    and made absolute on the request's host when a fragment is read.
+    """
+
+    @property
+    def fragment_cached(self):
+        return FragmentCacheSerializerMixin in type(self).__bases__
+
+    def get_fragment_dependencies(self, instance):
+        """
+        :return: list of (model, pk) of the objects the fragment of an instance is built from
+        """
+        return [(type(instance), instance.pk)]
+
+    def get_url_field_names(self):
+        """
+        :return: names of the fields that are absolute urls when there's a request e.g images
+        """
+        return [
+            field.field_name for field in self.fields.values()
+            if not field.write_only and isinstance(field, FileField) and
+            getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+        ]
+
+    def to_fragment(self, instance):
+        fragment = super(FragmentCacheSerializerMixin, self).to_representation(instance)
+        for field_name in self.get_url_field_names():
+            value = self.fields[field_name].get_attribute(instance)
+            fragment[field_name] = value and getattr(value, 'url', None) or None
+        return fragment
+
+    def localize_fragment(self, fragment):
+        """
+        Makes the urls of a fragment, and of the fragments nested in it, absolute on the request's host
+        """
+        request = self.context.get('request', None)
+        if request is None:
+            return fragment
+        fragment = OrderedDict(fragment)
+        for field_name in self.get_url_field_names():
+            if fragment.get(field_name, None):
+                fragment[field_name] = request.build_absolute_uri(fragment[field_name])
+        for field_name, field in self.fields.items():
+            value = fragment.get(field_name, None)
+            if not value:
+                continue
+            if isinstance(field, ListSerializer) and getattr(field.child, 'fragment_cached', False):
+                fragment[field_name] = [field.child.localize_fragment(item) for item in value]
+            elif getattr(field, 'fragment_cached', False):
+                fragment[field_name] = field.localize_fragment(value)
+        return fragment
+
+    def to_representation(self, instance):
+        if not self.fragment_cached or instance.pk is None:
+            return self.to_fragment(instance)
+
+        root = self.root
+        loader = getattr(root, '_fragment_loader', None)
+        if loader is None:
+            loader = root._fragment_loader = FragmentLoader()
+            collected = dict()
+            if root.instance is not None:
+                instances = root.instance
+                if not isinstance(root, ListSerializer):
+                    instances = [instances]
+                collect_fragment_instances(root, instances, collected)
+            if collected:
+                loader.load(collected)
+        fragment = loader.get(self, instance)
+        if loader.building:
+            return fragment
+        return self.localize_fragment(fragment)
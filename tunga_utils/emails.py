@@ -1,28 +1,97 @@
 import datetime
+import logging
+import os
+import socket
+import time
+from smtplib import SMTPServerDisconnected, SMTPConnectError, SMTPException
+
+from django.core.mail import get_connection
 from django.core.mail.message import EmailMultiAlternatives, EmailMessage
+from django.template import engines
 from django.template.exceptions import TemplateDoesNotExist
-from django.template.loader import render_to_string
+from django.template.loader import get_template
 from django_rq.decorators import job
 
 from tunga.settings import DEFAULT_FROM_EMAIL
-from tunga.settings.base import EMAIL_SUBJECT_PREFIX, CONTACT_REQUEST_EMAIL_RECIPIENT
+from tunga.settings.base import EMAIL_SUBJECT_PREFIX, CONTACT_REQUEST_EMAIL_RECIPIENT, EMAIL_SEND_RETRIES, \
+    EMAIL_SEND_RETRY_BACKOFF
 from tunga_utils.decorators import convert_first_arg_to_instance, clean_instance
 from tunga_utils.models import ContactRequest
 
+logger = logging.getLogger(__name__)
 
-def render_mail(subject, template_prefix, to_emails, context, bcc=None, cc=None, **kwargs):
-    from_email = DEFAULT_FROM_EMAIL
+# Compiled html and txt templates of every email by template prefix, see load_mail_templates
+MAIL_TEMPLATES = dict()
+
+MAIL_TEMPLATE_DIRECTORY = 'tunga/email'
+MAIL_TEMPLATE_PREFIX = 'email_'
+MAIL_TEMPLATE_EXTENSIONS = ['html', 'txt']
+
+# Failures that are worth reconnecting for, other SMTP errors (e.g refused recipients) are specific to one email
+EMAIL_CONNECTION_ERRORS = (SMTPServerDisconnected, SMTPConnectError, socket.error)
 
-    bodies = {}
-    for ext in ['html', 'txt']:
+
+def register_mail_template(template_prefix):
+    """
+    Compiles the variants (html and/or txt) of an email template and keeps them in the registry
+    :return: dict of compiled templates by extension
+    """
+    templates = {}
+    for ext in MAIL_TEMPLATE_EXTENSIONS:
         try:
-            template_name = '{0}.{1}'.format(template_prefix, ext)
-            bodies[ext] = render_to_string(template_name,
-                                           context).strip()
+            templates[ext] = get_template('{0}.{1}'.format(template_prefix, ext))
         except TemplateDoesNotExist:
-            if ext == 'txt' and not bodies:
-                # We need at least one body
-                raise
+            pass
+    if not templates:
+        # We need at least one body
+        raise TemplateDoesNotExist('{0}.txt'.format(template_prefix))
+    MAIL_TEMPLATES[template_prefix] = templates
+    return templates
+
+
+def load_mail_templates():
+    """
+    Registers every email template in the template directories, so variants are resolved and compiled once at startup
+    :return: registered template prefixes
+    """
+    template_prefixes = set()
+    for template_dir in engines['django'].template_dirs:
+        mail_dir = os.path.join(template_dir, MAIL_TEMPLATE_DIRECTORY)
+        if not os.path.isdir(mail_dir):
+            continue
+        for filename in os.listdir(mail_dir):
+            name, ext = os.path.splitext(filename)
+            if name.startswith(MAIL_TEMPLATE_PREFIX) and ext[1:] in MAIL_TEMPLATE_EXTENSIONS:
+                template_prefixes.add('{0}/{1}'.format(MAIL_TEMPLATE_DIRECTORY, name))
+    for template_prefix in template_prefixes:
+        register_mail_template(template_prefix)
+    return template_prefixes
+
+
+def get_mail_templates(template_prefix):
+    """
+    :return: dict of the compiled templates of an email by extension, templates outside the registry are added on first use
+    """
+    templates = MAIL_TEMPLATES.get(template_prefix, None)
+    if templates is None:
+        templates = register_mail_template(template_prefix)
+    return templates
+
+
+def render_many(template_prefix, contexts):
+    """
+    Renders the compiled variants of one email template for each context e.g once per recipient
+    :return: list with a dict of rendered bodies by extension for each context
+    """
+    templates = get_mail_templates(template_prefix).items()
+    return [dict([(ext, template.render(context).strip()) for ext, template in templates]) for context in contexts]
+
+
+def build_mail(subject, bodies, to_emails, bcc=None, cc=None):
+    """
+    Creates an email from rendered bodies, the txt body is the main content and html an alternative when both exist
+    """
+    from_email = DEFAULT_FROM_EMAIL
     if 'txt' in bodies:
         msg = EmailMultiAlternatives(subject, bodies['txt'], from_email, to_emails, bcc=bcc, cc=cc)
         if 'html' in bodies:
@@ -33,9 +102,63 @@ def render_mail(subject, template_prefix, to_emails, context, bcc=None, cc=None,
     return msg
 
 
+def render_mail(subject, template_prefix, to_emails, context, bcc=None, cc=None, **kwargs):
+    return build_mail(subject, render_many(template_prefix, [context])[0], to_emails, bcc=bcc, cc=cc)
+
+
+def send_mails(
+        messages, connection=None, retries=EMAIL_SEND_RETRIES, backoff=EMAIL_SEND_RETRY_BACKOFF, fail_silently=True):
+    """
+    Sends rendered emails over one mail server connection.
+    When the connection fails, it's reopened with exponential backoff and sending resumes from the failed email.
+    Rejected emails and batches that are given up on are logged.
+    :param messages: Emails e.g from render_mail
+    :param connection: Mail backend connection, a new one from the EMAIL_BACKEND by default
+    :param retries: Reconnect attempts per email before the rest of the batch is given up on
+    :param backoff: Seconds to wait before the first reconnect, doubled after each failed attempt
+    :param fail_silently: False raises the first failure instead of moving on to the next email
+    :return: list with whether each email was sent
+    """
+    connection = connection or get_connection()
+    sent = [False] * len(messages)
+    attempts = 0
+    index = 0
+    try:
+        while index < len(messages):
+            try:
+                connection.open()
+                sent[index] = bool(connection.send_messages([messages[index]]))
+            except EMAIL_CONNECTION_ERRORS:
+                connection.close()
+                attempts += 1
+                if attempts > retries:
+                    logger.exception(
+                        'Gave up sending %s of %s emails after %s attempts',
+                        len(messages) - index, len(messages), attempts
+                    )
+                    if not fail_silently:
+                        raise
+                    break
+                time.sleep(backoff * 2 ** (attempts - 1))
+                continue
+            except SMTPException:
+                # This email was rejected, the connection is still good for the rest
+                logger.exception(
+                    'Email "%s" to %s was rejected', messages[index].subject, ', '.join(messages[index].recipients())
+                )
+                if not fail_silently:
+                    raise
+            attempts = 0
+            index += 1
+    finally:
+        connection.close()
+    return sent
+
+
 def send_mail(subject, template_prefix, to_emails, context, bcc=None, cc=None, **kwargs):
     msg = render_mail(subject, template_prefix, to_emails, context, bcc=bcc, cc=cc, **kwargs)
-    return msg.send()
+    # Failures fail the calling job so it ends up in the failed queue, instead of holding its worker for retries
+    return send_mails([msg], retries=0, fail_silently=False)[0]
 
 
 @job
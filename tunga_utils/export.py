@@ -0,0 +1,91 @@
+"""
+Streaming exports of querysets as CSV or JSON lines.
+
+Rows are read as values_list projections in id ordered chunks of EXPORT_CHUNK_SIZE, each chunk starting after
+the last id of the previous one, and written through Echo as the response is sent.
+Memory stays constant and every chunk is an index range scan however large the export is.
+"""
+import csv
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http.response import StreamingHttpResponse
+
+from tunga.settings.base import EXPORT_CHUNK_SIZE
+from tunga_utils.views import Echo
+
+EXPORT_FORMAT_CSV = 'csv'
+EXPORT_FORMAT_NDJSON = 'ndjson'
+
+EXPORT_FORMAT_CHOICES = (
+    (EXPORT_FORMAT_CSV, 'CSV'),
+    (EXPORT_FORMAT_NDJSON, 'JSON lines')
+)
+
+EXPORT_CONTENT_TYPES = {
+    EXPORT_FORMAT_CSV: 'text/csv',
+    EXPORT_FORMAT_NDJSON: 'application/x-ndjson'
+}
+
+
+def iterate_values(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Streams the values of the fields of every object in a queryset in id order
+    :param fields: field lookups to read e.g task__title, the id is read first and yielded with them
+    :return: generator of tuples of the id and the fields
+    """
+    # Filters that join to many valued relations repeat rows, distinct keeps one per object
+    queryset = queryset.order_by('id').values_list('id', *fields).distinct()
+    last_id = None
+    while True:
+        chunk = queryset
+        if last_id is not None:
+            chunk = queryset.filter(id__gt=last_id)
+        count = 0
+        for row in chunk[:chunk_size].iterator():
+            count += 1
+            last_id = row[0]
+            yield row
+        if count < chunk_size:
+            break
+
+
+def get_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def stream_csv(headers, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow([get_csv_value(value) for value in row])
+
+
+def stream_ndjson(headers, rows):
+    for row in rows:
+        yield json.dumps(OrderedDict(zip(headers, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def export_queryset(queryset, columns, filename, export_format=EXPORT_FORMAT_CSV, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Streams a queryset as a CSV or JSON lines download
+    :param columns: list of (header, field lookup) tuples, the object's id is always the first column
+    :param filename: name of the download without its extension
+    """
+    headers = ['id'] + [header for header, field in columns]
+    rows = iterate_values(queryset, [field for header, field in columns], chunk_size=chunk_size)
+    if export_format == EXPORT_FORMAT_NDJSON:
+        content = stream_ndjson(headers, rows)
+    else:
+        content = stream_csv(headers, rows)
+    response = StreamingHttpResponse(content, content_type=EXPORT_CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = 'attachment; filename=%s.%s' % (filename, export_format)
+    return response
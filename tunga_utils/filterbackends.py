@@ -2,8 +2,13 @@ from functools import wraps
 
 from rest_framework.filters import DjangoFilterBackend, SearchFilter
 
+from tunga_utils.search import FullTextSearchFilter
+
 DEFAULT_FILTER_BACKENDS = (DjangoFilterBackend, SearchFilter)
 
+# For views of models with a full text search index, see tunga_utils.search
+FULL_TEXT_FILTER_BACKENDS = (DjangoFilterBackend, FullTextSearchFilter)
+
 
 def dont_filter_staff_or_superuser(func):
     """
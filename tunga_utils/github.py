@@ -1,5 +1,18 @@
+import hashlib
+import hmac
+import json
+import math
+import time
+from operator import itemgetter
+
 import requests
+from dateutil.parser import parse
+from django.core.cache import cache
+from django.utils.dateparse import parse_datetime
+from requests.adapters import HTTPAdapter
 
+from tunga.settings.base import GITHUB_API_URL, GITHUB_API_TIMEOUT, GITHUB_RESPONSE_CACHE_TIMEOUT, \
+    GITHUB_RATE_LIMIT_MAX_WAIT, GITHUB_MAX_PAGES
 from tunga_tasks import slugs
 
 EVENT_PUSH = 'push'
@@ -15,6 +28,9 @@ EVENT_RELEASE = 'release'
 
 HEADER_EVENT_NAME = 'HTTP_X_GITHUB_EVENT'
 HEADER_DELIVERY_ID = 'HTTP_X_GITHUB_DELIVERY'
+HEADER_SIGNATURE = 'HTTP_X_HUB_SIGNATURE'
+
+SIGNATURE_PREFIX = 'sha1='
 
 PAYLOAD_ACTION = 'action'
 PAYLOAD_ACTION_CREATED = 'created'
@@ -62,6 +78,7 @@ PAYLOAD_MERGED_AT = 'merged_at'
 PAYLOAD_ISSUE = 'issue'
 PAYLOAD_RELEASE = 'release'
 PAYLOAD_TAG_NAME = 'tag_name'
+PAYLOAD_NAME = 'name'
 
 REPOSITORY_FIELDS = ['id', 'name', 'description', 'full_name', 'private', 'url', 'html_url']
 
@@ -111,13 +128,429 @@ def extract_repo_info(repo):
     return repo_info
 
 
-def api(endpoint, method, params=None, data=None, access_token=None):
-    headers = {
-        'Accept': 'application/vnd.github.v3+json',
-        'Content-Type': 'application.json'
+class ActivityExtractor(object):
+    """
+    Declarative mapping of a GitHub event payload to integration activity fields.
+    Paths are compiled into accessors once, when the extractor is built at import,
+    and the object the fields are read from (root) is looked up once per payload.
+    """
+
+    def __init__(self, root=None, actions=None, condition=None, fields=None, payload_fields=None, values=None):
+        """
+        :param root: Path (or callable) of the payload object fields are read from, nothing is extracted if it's empty
+        :param actions: Payload actions to extract activities for, all actions if not set
+        :param condition: Callable(payload, root) that must be true to extract an activity
+        :param fields: Activity field -> path relative to the root, or (path, transform)
+        :param payload_fields: Activity field -> path relative to the payload, or (path, transform)
+        :param values: Activity field -> callable(event, payload, root) for derived values
+        """
+        self.root = root is not None and compile_path(root) or None
+        self.actions = actions is not None and frozenset(actions) or None
+        self.condition = condition
+        self.fields = compile_fields(fields) + [
+            (name, accessor, transform, True) for name, accessor, transform, _ in compile_fields(payload_fields)
+        ]
+        self.values = (values or {}).items()
+
+    def extract(self, event, payload):
+        if self.actions is not None and payload[PAYLOAD_ACTION] not in self.actions:
+            return {}
+        root = self.root(payload) if self.root else payload
+        if not root or (self.condition and not self.condition(payload, root)):
+            return {}
+
+        activity = {}
+        for name, accessor, transform, from_payload in self.fields:
+            value = accessor(from_payload and payload or root)
+            if transform:
+                value = transform(value)
+            activity[name] = value
+        for name, get_value in self.values:
+            activity[name] = get_value(event, payload, root)
+        return activity
+
+
+def compile_path(path):
+    """
+    Compiles a payload path e.g (PAYLOAD_SENDER, PAYLOAD_USERNAME) into a single accessor
+    """
+    if callable(path):
+        return path
+    if not isinstance(path, (list, tuple)):
+        path = (path,)
+    getters = [itemgetter(key) for key in path]
+    if len(getters) == 1:
+        return getters[0]
+
+    def accessor(payload):
+        for getter in getters:
+            payload = getter(payload)
+        return payload
+    return accessor
+
+
+def compile_fields(fields):
+    compiled = []
+    for name, spec in (fields or {}).iteritems():
+        transform = None
+        if isinstance(spec, tuple) and len(spec) == 2 and callable(spec[1]):
+            spec, transform = spec
+        compiled.append((name, compile_path(spec), transform, False))
+    return compiled
+
+
+ACTIVITY_EXTRACTORS = dict()
+
+
+def register_activity_extractor(events, extractor):
+    """
+    Registers the extractor for one or more GitHub events, extract_activity picks it up without any view changes
+    """
+    if not isinstance(events, (list, tuple)):
+        events = [events]
+    for event in events:
+        ACTIVITY_EXTRACTORS[event] = extractor
+
+
+def extract_activity(event, payload):
+    """
+    Extracts a Tunga integration activity from a GitHub web hook payload
+    :param event: GitHub event name e.g push
+    :param payload: Decoded payload
+    :return: dict of activity fields or an empty dict if the event isn't tracked
+    """
+    extractor = ACTIVITY_EXTRACTORS.get(event, None)
+    if not extractor:
+        return {}
+    activity = extractor.extract(event, payload)
+    if activity and not activity.get(slugs.ACTIVITY_EVENT_ID, None):
+        activity[slugs.ACTIVITY_EVENT_ID] = transform_to_tunga_event(event)
+    return activity
+
+
+def parse_timestamp(value):
+    """
+    Parses GitHub's ISO 8601 timestamps with django's regex parser, dateutil is only used for anything else
+    """
+    return parse_datetime(value) or parse(value)
+
+
+def get_payload_action(event, payload, root):
+    return payload[PAYLOAD_ACTION]
+
+
+def get_pull_request_action(event, payload, root):
+    if payload[PAYLOAD_ACTION] == PAYLOAD_ACTION_CLOSED and root[PAYLOAD_MERGED]:
+        return slugs.ACTION_MERGED
+    return payload[PAYLOAD_ACTION]
+
+
+def get_ref_event_id(event, payload, root):
+    return payload[PAYLOAD_REF_TYPE] == PAYLOAD_REF_TYPE_BRANCH and slugs.BRANCH or slugs.TAG
+
+
+def get_ref_action(event, payload, root):
+    return event == EVENT_CREATE and slugs.ACTION_CREATED or slugs.ACTION_DELETED
+
+
+def get_ref_url(event, payload, root):
+    return '%s/tree/%s' % (payload[PAYLOAD_REPOSITORY][PAYLOAD_HTML_URL], payload[PAYLOAD_REF])
+
+
+def get_wiki_action(event, payload, root):
+    return root[PAYLOAD_ACTION] == PAYLOAD_ACTION_CREATED and slugs.ACTION_CREATED or slugs.ACTION_EDITED
+
+
+def get_first_page(payload):
+    pages = payload[PAYLOAD_PAGES]
+    return pages and pages[0] or None
+
+
+SENDER_ACTIVITY_FIELDS = {
+    slugs.ACTIVITY_USERNAME: (PAYLOAD_SENDER, PAYLOAD_USERNAME),
+    slugs.ACTIVITY_AVATAR_URL: (PAYLOAD_SENDER, PAYLOAD_AVATAR_URL),
+}
+
+TRACKED_ISSUE_ACTIONS = [PAYLOAD_ACTION_OPENED, PAYLOAD_ACTION_CLOSED, PAYLOAD_ACTION_EDITED, PAYLOAD_ACTION_REOPENED]
+
+# Push event
+register_activity_extractor(EVENT_PUSH, ActivityExtractor(
+    root=PAYLOAD_HEAD_COMMIT,
+    fields={
+        slugs.ACTIVITY_URL: PAYLOAD_URL,
+        slugs.ACTIVITY_REF: PAYLOAD_ID,
+        slugs.ACTIVITY_REF_NAME: PAYLOAD_TREE_ID,
+        slugs.ACTIVITY_BODY: PAYLOAD_MESSAGE,
+        slugs.ACTIVITY_CREATED_AT: (PAYLOAD_TIMESTAMP, parse_timestamp),
+    },
+    payload_fields=SENDER_ACTIVITY_FIELDS
+))
+
+# Issue and Pull Request
+ISSUE_ACTIVITY_FIELDS = {
+    slugs.ACTIVITY_URL: PAYLOAD_HTML_URL,
+    slugs.ACTIVITY_REF: PAYLOAD_ID,
+    slugs.ACTIVITY_REF_NAME: PAYLOAD_NUMBER,
+    slugs.ACTIVITY_TITLE: PAYLOAD_TITLE,
+    slugs.ACTIVITY_BODY: PAYLOAD_BODY,
+    slugs.ACTIVITY_CREATED_AT: (PAYLOAD_CREATED_AT, parse_timestamp),
+}
+
+register_activity_extractor(EVENT_ISSUE, ActivityExtractor(
+    root=PAYLOAD_ISSUE, actions=TRACKED_ISSUE_ACTIONS, fields=ISSUE_ACTIVITY_FIELDS, payload_fields=SENDER_ACTIVITY_FIELDS,
+    values={slugs.ACTIVITY_ACTION: get_payload_action}
+))
+
+register_activity_extractor(EVENT_PULL_REQUEST, ActivityExtractor(
+    root=PAYLOAD_PULL_REQUEST, actions=TRACKED_ISSUE_ACTIONS, fields=ISSUE_ACTIVITY_FIELDS, payload_fields=SENDER_ACTIVITY_FIELDS,
+    values={slugs.ACTIVITY_ACTION: get_pull_request_action}
+))
+
+# Branch and Tag creation and deletion
+register_activity_extractor([EVENT_CREATE, EVENT_DELETE], ActivityExtractor(
+    condition=lambda payload, root: payload[PAYLOAD_REF_TYPE] in [PAYLOAD_REF_TYPE_BRANCH, PAYLOAD_REF_TYPE_TAG],
+    fields={slugs.ACTIVITY_REF: PAYLOAD_REF},
+    payload_fields=SENDER_ACTIVITY_FIELDS,
+    values={
+        slugs.ACTIVITY_EVENT_ID: get_ref_event_id,
+        slugs.ACTIVITY_ACTION: get_ref_action,
+        slugs.ACTIVITY_URL: get_ref_url,
     }
-    if access_token:
-        headers['Authorization'] = 'token %s' % access_token
-    return requests.request(
-            method=method, url='https://api.github.com'+endpoint, params=params, json=data, headers=headers
+))
+
+# Commit, Issue and Pull Request comments
+register_activity_extractor(
+    [EVENT_COMMIT_COMMENT, EVENT_ISSUE_COMMENT, EVENT_PULL_REQUEST_REVIEW_COMMENT],
+    ActivityExtractor(
+        root=PAYLOAD_COMMENT, actions=[PAYLOAD_ACTION_CREATED],
+        fields={
+            slugs.ACTIVITY_URL: PAYLOAD_HTML_URL,
+            slugs.ACTIVITY_REF: PAYLOAD_ID,
+            slugs.ACTIVITY_BODY: PAYLOAD_BODY,
+            slugs.ACTIVITY_CREATED_AT: (PAYLOAD_CREATED_AT, parse_timestamp),
+        },
+        payload_fields=SENDER_ACTIVITY_FIELDS,
+        values={slugs.ACTIVITY_ACTION: lambda event, payload, root: slugs.ACTION_CREATED}
     )
+)
+
+# Release
+register_activity_extractor(EVENT_RELEASE, ActivityExtractor(
+    root=PAYLOAD_RELEASE, actions=[PAYLOAD_ACTION_PUBLISHED],
+    fields={
+        slugs.ACTIVITY_URL: PAYLOAD_HTML_URL,
+        slugs.ACTIVITY_REF: PAYLOAD_ID,
+        slugs.ACTIVITY_REF_NAME: PAYLOAD_TAG_NAME,
+        slugs.ACTIVITY_TITLE: PAYLOAD_NAME,
+        slugs.ACTIVITY_BODY: PAYLOAD_BODY,
+        slugs.ACTIVITY_CREATED_AT: (PAYLOAD_CREATED_AT, parse_timestamp),
+    },
+    payload_fields=SENDER_ACTIVITY_FIELDS,
+    values={slugs.ACTIVITY_ACTION: get_payload_action}
+))
+
+# Wiki creation and updates
+register_activity_extractor(EVENT_GOLLUM, ActivityExtractor(
+    root=get_first_page,
+    fields={
+        slugs.ACTIVITY_URL: PAYLOAD_HTML_URL,
+        slugs.ACTIVITY_REF: PAYLOAD_PAGE_NAME,
+        slugs.ACTIVITY_BODY: PAYLOAD_SUMMARY,
+    },
+    payload_fields=SENDER_ACTIVITY_FIELDS,
+    values={slugs.ACTIVITY_ACTION: get_wiki_action}
+))
+
+
+def verify_signature(secret, body, signature):
+    """
+    Checks the X-Hub-Signature header GitHub signs web hook payloads with
+    :param secret: Secret the hook was registered with
+    :param body: Raw request body
+    :param signature: Header value e.g sha1=<hex digest>
+    """
+    if not signature or not signature.startswith(SIGNATURE_PREFIX):
+        return False
+    digest = hmac.new(str(secret), body, hashlib.sha1).hexdigest()
+    return hmac.compare_digest(str(SIGNATURE_PREFIX + digest), str(signature))
+
+
+GITHUB_API_POOL_SIZE = 10
+
+_session = None
+
+
+class GitHubError(Exception):
+    """
+    A GitHub API request that failed, views respond with its status code and data
+    """
+
+    def __init__(self, status_code, data):
+        super(GitHubError, self).__init__('GitHub API request failed with status %s' % status_code)
+        self.status_code = status_code
+        self.data = data
+
+
+class GitHubRateLimitError(GitHubError):
+
+    def __init__(self, retry_after):
+        super(GitHubRateLimitError, self).__init__(
+            429, {'status': 'GitHub rate limit exceeded', 'retry_after': retry_after}
+        )
+        self.retry_after = retry_after
+
+
+def get_session():
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GITHUB_API_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Accept': 'application/vnd.github.v3+json'})
+        _session = session
+    return _session
+
+
+def get_response_data(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {'status': response.reason}
+
+
+class GitHubClient(object):
+    """
+    GitHub API client for one access token.
+
+    Requests share a pooled session and have timeouts. GET requests are conditional: the ETag and data of
+    every page are cached and sent back as If-None-Match, so unchanged pages are a 304 that GitHub doesn't
+    count against the rate limit. Lists are read by following the Link headers one page at a time.
+    When GitHub reports the rate limit is used up, its reset is stored so that the token's next requests
+    wait for it if it's within GITHUB_RATE_LIMIT_MAX_WAIT, and fail with GitHubRateLimitError otherwise.
+    """
+
+    def __init__(self, access_token=None):
+        self.access_token = access_token
+        self.cache_prefix = 'github:%s' % hashlib.sha1(access_token or 'anonymous').hexdigest()
+
+    def get_headers(self):
+        if self.access_token:
+            return {'Authorization': 'token %s' % self.access_token}
+        return {}
+
+    def get_rate_limit_key(self):
+        return '%s:rate_limit_reset' % self.cache_prefix
+
+    def get_response_key(self, url, params):
+        return '%s:response:%s' % (
+            self.cache_prefix, hashlib.sha1(json.dumps([url, params], sort_keys=True)).hexdigest()
+        )
+
+    def set_rate_limit_reset(self, reset_at):
+        cache.set(self.get_rate_limit_key(), reset_at, timeout=max(int(math.ceil(reset_at - time.time())), 1))
+
+    def wait_for_rate_limit(self):
+        reset_at = cache.get(self.get_rate_limit_key())
+        if not reset_at:
+            return
+        wait = reset_at - time.time()
+        if wait > GITHUB_RATE_LIMIT_MAX_WAIT:
+            raise GitHubRateLimitError(int(math.ceil(wait)))
+        if wait > 0:
+            time.sleep(wait)
+
+    def get_rate_limit_reset(self, response):
+        """
+        :return: when the token's rate limit resets if the response used it up or was rate limited, None otherwise
+        """
+        retry_after = response.headers.get('Retry-After', None)
+        if retry_after and response.status_code in [403, 429]:
+            # Secondary rate limits ask clients to wait without a reset
+            return time.time() + int(retry_after)
+        if response.headers.get('X-RateLimit-Remaining', None) == '0':
+            return int(response.headers.get('X-RateLimit-Reset', 0))
+        return None
+
+    def send(self, method, url, params=None, data=None, headers=None):
+        """
+        Sends a request, backing off until the rate limit resets and retrying once if it's rate limited
+        :raises GitHubError: if GitHub can't be reached
+        :raises GitHubRateLimitError: if the rate limit resets later than GITHUB_RATE_LIMIT_MAX_WAIT
+        """
+        response = None
+        for attempt in range(2):
+            self.wait_for_rate_limit()
+            try:
+                response = get_session().request(
+                    method=method, url=url, params=params, json=data,
+                    headers=dict(self.get_headers(), **(headers or {})), timeout=GITHUB_API_TIMEOUT
+                )
+            except requests.RequestException:
+                raise GitHubError(502, {'status': 'GitHub is unavailable'})
+            reset_at = self.get_rate_limit_reset(response)
+            if reset_at:
+                self.set_rate_limit_reset(reset_at)
+            if response.status_code not in [403, 429] or not reset_at:
+                break
+        return response
+
+    def request(self, method, endpoint, params=None, data=None):
+        """
+        :param endpoint: API path e.g /user/repos
+        :return: the requests.Response
+        """
+        return self.send(method, GITHUB_API_URL + endpoint, params=params, data=data)
+
+    def get_page(self, url, params=None):
+        """
+        Reads a page, from the cache if GitHub says it hasn't changed
+        :return: (data of the page, url of the next page or None)
+        :raises GitHubError: if GitHub doesn't return the page
+        """
+        response_key = self.get_response_key(url, params)
+        cached = cache.get(response_key)
+        headers = cached and {'If-None-Match': cached['etag']} or None
+        response = self.send('get', url, params=params, headers=headers)
+        if response.status_code == 304 and cached:
+            return cached['data'], cached['next']
+        if response.status_code != 200:
+            raise GitHubError(response.status_code, get_response_data(response))
+
+        data = response.json()
+        next_url = response.links.get('next', {}).get('url', None)
+        etag = response.headers.get('ETag', None)
+        if etag:
+            cache.set(
+                response_key, {'etag': etag, 'data': data, 'next': next_url}, timeout=GITHUB_RESPONSE_CACHE_TIMEOUT
+            )
+        return data, next_url
+
+    def get(self, endpoint, params=None):
+        return self.get_page(GITHUB_API_URL + endpoint, params=params)[0]
+
+    def iterate_pages(self, endpoint, params=None, max_pages=GITHUB_MAX_PAGES):
+        """
+        Follows the next links of a list and yields its pages as they're read
+        """
+        url = GITHUB_API_URL + endpoint
+        params = dict(params or {}, per_page=100)
+        for page in range(max_pages):
+            data, url = self.get_page(url, params=params)
+            yield data
+            if not url:
+                break
+            # Next links carry the query
+            params = None
+
+    def iterate(self, endpoint, params=None, max_pages=GITHUB_MAX_PAGES):
+        """
+        Yields the items of a list across its pages
+        """
+        for page in self.iterate_pages(endpoint, params=params, max_pages=max_pages):
+            for item in page:
+                yield item
+
+
+def api(endpoint, method, params=None, data=None, access_token=None):
+    return GitHubClient(access_token).request(method, endpoint, params=params, data=data)
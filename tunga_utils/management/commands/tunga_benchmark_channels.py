@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from tunga_utils.benchmark import benchmark_channel_creation, CHANNEL_BENCHMARK_SIZES
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=CHANNEL_BENCHMARK_SIZES, help='Participants per channel'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Benchmarks creating channels one participant at a time against batched participant inserts
+        in a throw away test database.
+        """
+        # command to run: python manage.py tunga_benchmark_channels
+
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            results = benchmark_channel_creation(sizes=options['sizes'])
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        print "%-12s %10s %12s %10s %12s" % ('participants', 'single', 'single (ms)', 'batched', 'batched (ms)')
+        for result in results:
+            print "%-12s %10s %12.1f %10s %12.1f" % (
+                result['size'], result['single_queries'], result['single_time'] * 1000,
+                result['batch_queries'], result['batch_time'] * 1000
+            )
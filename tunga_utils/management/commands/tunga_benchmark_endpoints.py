@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from tunga_utils.benchmark import seed_dataset, benchmark_endpoints, read_budgets, write_budgets, check_budgets, \
+    describe_budget_failure
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', type=int, default=None,
+            help='Dataset size multiplier, defaults to the size the budgets were recorded with'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=None,
+            help='Random seed for the dataset, defaults to the seed the budgets were recorded with'
+        )
+        parser.add_argument(
+            '--update-budgets', action='store_true', dest='update_budgets', default=False,
+            help='Write the measured query counts and status codes to the budget file'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Seeds a synthetic dataset in a throw away test database and benchmarks every api router endpoint.
+        Fails if any endpoint goes over its query budget
+        or answers with another status than its budget was recorded with.
+        """
+        # command to run: python manage.py tunga_benchmark_endpoints
+
+        budgets = read_budgets()
+        size = options['size'] or budgets['size']
+        seed = options['seed']
+        if seed is None:
+            seed = budgets['seed']
+
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            users = seed_dataset(size=size, seed=seed)
+            results = benchmark_endpoints(users)
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        print "%-30s %-14s %6s %8s %10s %10s %10s" % (
+            'endpoint', 'role', 'status', 'queries', 'sql (ms)', 'ser (ms)', 'size (kb)'
+        )
+        for result in results:
+            print "%-30s %-14s %6s %8s %10.1f %10.1f %10.1f" % (
+                result['endpoint'], result['role'], result['status'], result['queries'],
+                result['sql_time'] * 1000, result['serialization_time'] * 1000, result['size'] / 1024.0
+            )
+
+        if options['update_budgets']:
+            write_budgets(results, size, seed)
+            print "Query budgets updated"
+            return
+
+        if size != budgets['size'] or seed != budgets['seed']:
+            # Query counts of nested collections grow with the dataset so budgets only apply to their own dataset
+            print "Budgets were recorded with size=%s and seed=%s, skipping budget check" % (
+                budgets['size'], budgets['seed']
+            )
+            return
+
+        failures = check_budgets(results, budgets['budgets'])
+        if failures:
+            raise CommandError(
+                'Query budgets failed: %s' % ', '.join([describe_budget_failure(failure) for failure in failures])
+            )
+        print "All endpoints within their query budgets"
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from tunga_utils.benchmark import read_github_payloads, benchmark_github_extractors
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=10000, help='Extractions timed per recorded payload'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Benchmarks the GitHub activity extractors against the recorded web hook payloads.
+        """
+        # command to run: python manage.py tunga_benchmark_github_extractors
+
+        results = benchmark_github_extractors(read_github_payloads(), iterations=options['iterations'])
+
+        print "%-30s %6s %12s %12s" % ('event', 'fields', 'decode (us)', 'extract (us)')
+        for result in results:
+            print "%-30s %6s %12.2f %12.2f" % (
+                result['event'], result['fields'], result['decode_time'] * 1000000, result['extract_time'] * 1000000
+            )
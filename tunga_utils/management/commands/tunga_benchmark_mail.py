@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from tunga_utils.benchmark import benchmark_mail_dispatch, benchmark_mail_rendering
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=100, help='Reminder emails rendered and sent per strategy'
+        )
+        parser.add_argument(
+            '--smtp', action='store_true', default=False,
+            help='Send to a local SMTP server instead of the in-memory mail backend'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Benchmarks rendering reminder emails with and without the template registry
+        and sending them one by one against the batched mail dispatcher.
+        """
+        # command to run: python manage.py tunga_benchmark_mail
+
+        result = benchmark_mail_rendering(count=options['count'])
+
+        print "%-10s %12s" % ('rendering', 'email (ms)')
+        print "%-10s %12.3f" % ('lookup', result['lookup_time'] * 1000)
+        print "%-10s %12.3f" % ('registry', result['registry_time'] * 1000)
+        print
+
+        result = benchmark_mail_dispatch(count=options['count'], smtp=options['smtp'])
+
+        print "%-10s %12s" % ('strategy', 'email (ms)')
+        print "%-10s %12.3f" % ('single', result['single_time'] * 1000)
+        print "%-10s %12.3f" % ('batched', result['batch_time'] * 1000)
+        print "%s of %s batched emails sent" % (result['sent'], result['count'])
@@ -0,0 +1,35 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from tunga_utils.search import SEARCH_INDEXES, rebuild_search_index
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', help='Models to reindex as app_label.ModelName, all searchable models by default'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=500, help='Objects indexed per insert'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Rebuild the full text search documents of searchable models e.g after bulk inserts or changing a document.
+        """
+        # command to run: python manage.py tunga_rebuild_search_index
+
+        models = SEARCH_INDEXES.keys()
+        if options['models']:
+            try:
+                models = [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as e:
+                raise CommandError(e)
+            for model in models:
+                if model not in SEARCH_INDEXES:
+                    raise CommandError('%s is not searchable' % model._meta.label)
+
+        for model in models:
+            total = rebuild_search_index(model, batch_size=options['batch_size'])
+            print "%s %s documents indexed" % (total, model._meta.label)
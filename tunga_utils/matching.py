@@ -0,0 +1,81 @@
+"""
+Skill matching engine.
+
+Candidates are scored in SQL by counting their skills among the skills to match with a correlated subquery
+on the tagulous skills M2M, which is answered from the M2M's (object, skill) index,
+rather than one CASE per skill over a join.
+"""
+from django.db import connection
+from django.db.models.expressions import Value
+from django.db.models.fields import IntegerField
+
+
+def get_skill_ids(instance):
+    """
+    :param instance: Task or user profile
+    :return: ids of the instance's skills, read from its skills M2M
+    """
+    skills_field = instance._meta.get_field('skills')
+    return list(skills_field.rel.through.objects.filter(
+        **{skills_field.m2m_field_name(): instance.id}
+    ).values_list('%s_id' % skills_field.m2m_reverse_field_name(), flat=True))
+
+
+def get_skill_matches_sql(skills_model, id_column, skill_ids, owner_field=None):
+    """
+    :param skills_model: Model with the skills M2M e.g Task or UserProfile
+    :param id_column: Quoted id column of the candidates the count is correlated on
+    :param owner_field: Foreign key from skills_model to the candidates e.g user, None if they're skills_model
+    :return: sql that counts a candidate's skills among skill_ids, it takes skill_ids as its params
+    """
+    quote_name = connection.ops.quote_name
+    skills_field = skills_model._meta.get_field('skills')
+    through = skills_field.rel.through
+    through_table = quote_name(through._meta.db_table)
+    object_column = '%s.%s' % (through_table, quote_name(
+        through._meta.get_field(skills_field.m2m_field_name()).column
+    ))
+    skill_column = '%s.%s' % (through_table, quote_name(
+        through._meta.get_field(skills_field.m2m_reverse_field_name()).column
+    ))
+    from_sql = through_table
+    owner_column = object_column
+    if owner_field:
+        owner_table = quote_name(skills_model._meta.db_table)
+        from_sql = '%s INNER JOIN %s ON %s.%s = %s' % (
+            through_table, owner_table, owner_table, quote_name(skills_model._meta.pk.column), object_column
+        )
+        owner_column = '%s.%s' % (owner_table, quote_name(skills_model._meta.get_field(owner_field).column))
+    return 'SELECT COUNT(*) FROM %s WHERE %s = %s AND %s IN (%s)' % (
+        from_sql, owner_column, id_column, skill_column, ', '.join(['%s'] * len(skill_ids))
+    )
+
+
+def annotate_skill_matches(skill_ids, queryset, skills_model=None, owner_field=None, only_matches=True):
+    """
+    Annotates the queryset with the number of skills matching skill_ids as `matches`.
+    Matches are counted in SQL with a subquery on the skills M2M per candidate, which reads its (object, skill)
+    index and takes one param per skill to match, so the queryset stays lazy and can be ordered and
+    paginated in SQL however many candidates there are.
+    :param skill_ids: Ids of the skills to match e.g from get_skill_ids
+    :param skills_model: Model with the skills M2M, the queryset's model by default
+    :param owner_field: Foreign key from skills_model to the queryset's model e.g user of a UserProfile
+    :param only_matches: Exclude objects without any matching skill
+    """
+    if not skill_ids:
+        if only_matches:
+            return queryset.none()
+        return queryset.annotate(matches=Value(0, output_field=IntegerField()))
+
+    id_column = '%s.%s' % (
+        connection.ops.quote_name(queryset.model._meta.db_table),
+        connection.ops.quote_name(queryset.model._meta.pk.column)
+    )
+    matches_sql = '(%s)' % get_skill_matches_sql(
+        skills_model or queryset.model, id_column, skill_ids, owner_field=owner_field
+    )
+    queryset = queryset.extra(select={'matches': matches_sql}, select_params=skill_ids)
+    if only_matches:
+        queryset = queryset.extra(where=['%s > 0' % matches_sql], params=skill_ids)
+    return queryset
+
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2026-10-18 18:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.utils import OperationalError
+
+SEARCH_DOCUMENT_TABLE = 'tunga_utils_searchdocument'
+# SQLite full text table kept in sync with the documents by triggers
+SEARCH_FTS_TABLE = 'tunga_utils_searchdocument_fts'
+# MySQL full text index on the documents
+SEARCH_FULLTEXT_INDEX = 'tunga_utils_searchdocument_document'
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Adds the full text index of the database's search backend, see tunga_utils.search
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE %(fts)s USING fts5("
+                "document, content='%(table)s', content_rowid='id', prefix='2 3')" % {
+                    'fts': SEARCH_FTS_TABLE, 'table': SEARCH_DOCUMENT_TABLE
+                }
+            )
+        except OperationalError:
+            # SQLite was built without FTS5, search falls back to the views' search_fields
+            return
+        for statement in [
+            "CREATE TRIGGER %(fts)s_insert AFTER INSERT ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s(rowid, document) VALUES (new.id, new.document); END",
+            "CREATE TRIGGER %(fts)s_delete AFTER DELETE ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s(%(fts)s, rowid, document) VALUES ('delete', old.id, old.document); END",
+            "CREATE TRIGGER %(fts)s_update AFTER UPDATE ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s(%(fts)s, rowid, document) VALUES ('delete', old.id, old.document); "
+            "INSERT INTO %(fts)s(rowid, document) VALUES (new.id, new.document); END",
+        ]:
+            schema_editor.execute(statement % {'fts': SEARCH_FTS_TABLE, 'table': SEARCH_DOCUMENT_TABLE})
+    elif vendor == 'mysql':
+        schema_editor.execute(
+            'CREATE FULLTEXT INDEX %s ON %s (document)' % (SEARCH_FULLTEXT_INDEX, SEARCH_DOCUMENT_TABLE)
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for trigger in ['insert', 'delete', 'update']:
+            schema_editor.execute('DROP TRIGGER IF EXISTS %s_%s' % (SEARCH_FTS_TABLE, trigger))
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % SEARCH_FTS_TABLE)
+    elif vendor == 'mysql':
+        schema_editor.execute('DROP INDEX %s ON %s' % (SEARCH_FULLTEXT_INDEX, SEARCH_DOCUMENT_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('tunga_utils', '0005_contactrequest_email_sent_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('document', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType', verbose_name='content type')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchdocument',
+            unique_together=set([('content_type', 'object_id')]),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
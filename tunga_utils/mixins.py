@@ -1,4 +1,5 @@
 from tunga_utils.models import Upload
+from tunga_utils.permissions import clear_permission_cache
 
 
 class GetCurrentUserAnnotatedSerializerMixin(object):
@@ -29,3 +30,22 @@ class SaveUploadsMixin(object):
             for uploaded_file in uploads.itervalues():
                 upload = Upload(content_object=content_object, file=uploaded_file, user=self.request.user)
                 upload.save()
+
+
+class ClearPermissionCacheMixin(object):
+    """
+    Drops the request's permission cache after writes that can change the current user's connections,
+    task participation or channel membership, so later checks in the same request see them
+    """
+
+    def perform_create(self, serializer):
+        super(ClearPermissionCacheMixin, self).perform_create(serializer)
+        clear_permission_cache(self.request)
+
+    def perform_update(self, serializer):
+        super(ClearPermissionCacheMixin, self).perform_update(serializer)
+        clear_permission_cache(self.request)
+
+    def perform_destroy(self, instance):
+        super(ClearPermissionCacheMixin, self).perform_destroy(instance)
+        clear_permission_cache(self.request)
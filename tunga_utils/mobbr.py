@@ -0,0 +1,99 @@
+"""
+Mobbr participation scripts of task urls.
+
+Scripts are fetched through one pooled requests.Session with connect and read timeouts and cached per url.
+A script is fresh for MOBBR_SCRIPT_CACHE_TIMEOUT, after that it's still served for MOBBR_SCRIPT_STALE_TIMEOUT
+while an RQ job refreshes it. Urls that aren't cached yet are served without a script while their first fetch
+is queued, so requests never wait on Mobbr.
+"""
+import hashlib
+import time
+
+import requests
+from django.core.cache import cache
+from django_rq.decorators import job
+from requests.adapters import HTTPAdapter
+
+from tunga.settings.base import MOBBR_API_URL, MOBBR_API_TIMEOUT, MOBBR_SCRIPT_CACHE_TIMEOUT, \
+    MOBBR_SCRIPT_STALE_TIMEOUT
+
+MOBBR_API_POOL_SIZE = 4
+
+# Seconds before another refresh of a url can be queued, failed refreshes are retried after it
+MOBBR_REFRESH_LOCK_TIMEOUT = 60
+
+_session = None
+
+
+def get_session():
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MOBBR_API_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Accept': 'application/json'})
+        _session = session
+    return _session
+
+
+def get_mobbr_script_key(url):
+    return 'mobbr:script:%s' % hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def get_mobbr_refresh_lock_key(url):
+    return '%s:refresh' % get_mobbr_script_key(url)
+
+
+def fetch_mobbr_script(url):
+    """
+    :return: participation script of a url, None if Mobbr has none for it
+    :raises requests.RequestException: if Mobbr can't be reached or fails
+    """
+    r = get_session().get(
+        '%s/uris/info' % MOBBR_API_URL, params={'url': url}, timeout=MOBBR_API_TIMEOUT
+    )
+    if r.status_code == 200:
+        return r.json()['result']['script']
+    if r.status_code >= 500:
+        r.raise_for_status()
+    return None
+
+
+@job
+def refresh_mobbr_scripts(urls):
+    """
+    Fetches and caches the participation scripts of urls, failures leave the cached scripts as they are
+    :return: number of scripts refreshed
+    """
+    refreshed = 0
+    for url in urls:
+        try:
+            script = fetch_mobbr_script(url)
+        except (requests.RequestException, ValueError, KeyError):
+            # The stale script is served until the lock expires and another refresh is queued
+            continue
+        cache.set(
+            get_mobbr_script_key(url), {'script': script, 'fetched_at': time.time()},
+            timeout=MOBBR_SCRIPT_CACHE_TIMEOUT + MOBBR_SCRIPT_STALE_TIMEOUT
+        )
+        cache.delete(get_mobbr_refresh_lock_key(url))
+        refreshed += 1
+    return refreshed
+
+
+def queue_mobbr_script_refresh(url):
+    # Only one refresh of a url is queued at a time
+    if cache.add(get_mobbr_refresh_lock_key(url), True, timeout=MOBBR_REFRESH_LOCK_TIMEOUT):
+        refresh_mobbr_scripts.delay([url])
+
+
+def get_mobbr_script(url):
+    """
+    Reads the cached participation script of a url and queues a refresh if it's missing or stale
+    :return: the participation script, None if there's none or it hasn't been fetched yet
+    """
+    entry = cache.get(get_mobbr_script_key(url))
+    if entry is None or time.time() - entry['fetched_at'] > MOBBR_SCRIPT_CACHE_TIMEOUT:
+        queue_mobbr_script_refresh(url)
+    return entry and entry['script'] or None
@@ -129,6 +129,23 @@ class Rating(models.Model):
         unique_together = ('content_type', 'object_id', 'criteria', 'created_by')
 
 
+class SearchDocument(models.Model):
+    """
+    Indexed text of an object, see tunga_utils.search
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, verbose_name=_('content type'))
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    document = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return '%s %s' % (self.content_type, self.object_id)
+
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+
+
 def generate_excerpt(source):
     try:
         return strip_tags(re.sub(r'<br\s*/>', '\n', source)).strip()
@@ -0,0 +1,196 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+import datetime
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.query_utils import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.six.moves.urllib import parse as urlparse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Page number pagination that switches to keyset (cursor) pagination when the cursor query param is sent.
+
+    Keyset pages are filtered on (ordering field, id) of the last row seen instead of being offset,
+    so deep pages cost the same as the first one and rows inserted while scrolling don't shift pages.
+    Send an empty cursor (e.g ?cursor=) for the first page, then follow next for older rows
+    and previous to poll for newer ones.
+
+    The ordering field is the view's cursor_ordering if set, otherwise the queryset's first ordering term
+    (e.g -created_at or -last_message_at).
+    Orderings that aren't model fields, e.g the search_rank of full text searches, can't be filtered on
+    so their cursors hold the offset of the page instead.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.cursor_mode = False
+            return super(KeysetPagination, self).paginate_queryset(queryset, request, view=view)
+
+        self.cursor_mode = True
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.ordering = self.get_cursor_ordering(queryset, view)
+        self.field = self.ordering.lstrip('-')
+        self.offset_mode = not self.is_model_field(queryset.model, self.field)
+        if self.offset_mode:
+            return self.paginate_offset(queryset, request)
+
+        descending = self.ordering.startswith('-')
+        value, object_id, reverse = self.decode_cursor(request)
+
+        # Rows after the cursor in the requested direction
+        if value is not None:
+            comparison = descending != reverse and 'lt' or 'gt'
+            if self.field == 'id':
+                queryset = queryset.filter(**{'id__%s' % comparison: object_id})
+            else:
+                queryset = queryset.filter(
+                    Q(**{'%s__%s' % (self.field, comparison): value}) |
+                    Q(**{self.field: value, 'id__%s' % comparison: object_id})
+                )
+
+        order_prefix = descending != reverse and '-' or ''
+        order_by = ['%s%s' % (order_prefix, self.field)]
+        if self.field != 'id':
+            order_by.append('%sid' % order_prefix)
+
+        results = list(queryset.order_by(*order_by)[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        # Newer rows can always show up so previous is kept for polling, next ends with the oldest row
+        self.has_next = has_more if not reverse else value is not None
+        self.first = results and results[0] or None
+        self.last = results and results[-1] or None
+        self.cursor_value = value
+        self.cursor_id = object_id
+        self.reverse = reverse
+        return results
+
+    def paginate_offset(self, queryset, request):
+        self.offset = self.decode_offset(request)
+        # Ties in the ordering are broken by id so rows don't move between pages
+        results = list(queryset.order_by(self.ordering, 'id')[self.offset:self.offset + self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        return results[:self.page_size]
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super(KeysetPagination, self).get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super(KeysetPagination, self).get_next_link()
+        if not self.has_next:
+            return None
+        if self.offset_mode:
+            return self._build_offset_url(self.offset + self.page_size)
+        if self.last:
+            return self.encode_cursor(self.last, False)
+        # A previous page that came back empty, older rows start at the cursor
+        return self._build_cursor_url(self.cursor_value, self.cursor_id, False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super(KeysetPagination, self).get_previous_link()
+        if self.offset_mode:
+            if not self.offset:
+                return None
+            return self._build_offset_url(max(self.offset - self.page_size, 0))
+        if self.first:
+            return self.encode_cursor(self.first, True)
+        if self.cursor_value is not None:
+            # Nothing newer yet, keep polling from the same position
+            return self._build_cursor_url(self.cursor_value, self.cursor_id, True)
+        return None
+
+    def get_cursor_ordering(self, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if not ordering:
+            ordering = queryset.query.order_by or queryset.model._meta.ordering or ['-id']
+            ordering = ordering[0]
+            if ordering in ['pk', '-pk']:
+                ordering = ordering.replace('pk', 'id')
+        return ordering
+
+    def is_model_field(self, model, field_name):
+        try:
+            model._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            return False
+        return True
+
+    def decode_offset(self, request):
+        """
+        :return: offset of the page of an offset cursor, 0 for the first page
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return 0
+        try:
+            querystring = urlsafe_b64decode(encoded.encode('ascii'))
+            offset = int(urlparse.parse_qs(querystring)['o'][0])
+            if offset < 0:
+                raise ValueError
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise NotFound(self.invalid_cursor_message)
+        return offset
+
+    def decode_cursor(self, request):
+        """
+        :return: (ordering value, id, reverse) of the cursor position, (None, None, False) for the first page
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, None, False
+        try:
+            querystring = urlsafe_b64decode(encoded.encode('ascii'))
+            tokens = urlparse.parse_qs(querystring, keep_blank_values=True)
+            object_id = int(tokens['i'][0])
+            value = tokens['v'][0]
+            if tokens.get('t', [None])[0] == 'd':
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError
+            elif self.field == 'id':
+                value = object_id
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, object_id, reverse
+
+    def encode_cursor(self, obj, reverse):
+        value = getattr(obj, self.field)
+        return self._build_cursor_url(value, obj.id, reverse)
+
+    def _build_offset_url(self, offset):
+        encoded = urlsafe_b64encode(urlparse.urlencode({'o': offset}))
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def _build_cursor_url(self, value, object_id, reverse):
+        tokens = OrderedDict([('i', object_id), ('r', int(reverse))])
+        if isinstance(value, datetime.datetime):
+            tokens['v'] = value.isoformat()
+            tokens['t'] = 'd'
+        else:
+            tokens['v'] = value
+        encoded = urlsafe_b64encode(urlparse.urlencode(tokens))
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
@@ -0,0 +1,133 @@
+from django.db.models.query import prefetch_related_objects
+from django.db.models.query_utils import Q
+
+from tunga_profiles.models import Connection
+
+PERMISSION_CACHE_ATTR = '_tunga_permission_cache'
+
+
+class PermissionCache(object):
+    """
+    Request scoped store of the current user's relations that object permissions depend on.
+    Each set is loaded with a single query the first time a permission check needs it.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._connected_user_ids = None
+        self._task_ids = None
+        self._channel_ids = None
+        self._received_message_ids = None
+
+    def _is_anonymous(self):
+        return not self.user or not self.user.is_authenticated()
+
+    @property
+    def connected_user_ids(self):
+        """
+        Ids of users with an accepted connection to the current user in either direction
+        """
+        if self._connected_user_ids is None:
+            if self._is_anonymous():
+                self._connected_user_ids = set()
+            else:
+                self._connected_user_ids = set()
+                connections = Connection.objects.filter(
+                    Q(from_user=self.user) | Q(to_user=self.user), accepted=True
+                ).values_list('from_user_id', 'to_user_id')
+                for from_user_id, to_user_id in connections:
+                    self._connected_user_ids.add(from_user_id == self.user.id and to_user_id or from_user_id)
+        return self._connected_user_ids
+
+    @property
+    def task_ids(self):
+        """
+        Ids of tasks the current user has accepted or not yet responded to participation in
+        """
+        if self._task_ids is None:
+            if self._is_anonymous():
+                self._task_ids = set()
+            else:
+                self._task_ids = set(
+                    self.user.participation_set.filter(
+                        Q(accepted=True) | Q(responded=False)
+                    ).values_list('task_id', flat=True)
+                )
+        return self._task_ids
+
+    @property
+    def channel_ids(self):
+        """
+        Ids of channels the current user is a member of
+        """
+        if self._channel_ids is None:
+            if self._is_anonymous():
+                self._channel_ids = set()
+            else:
+                self._channel_ids = set(self.user.channeluser_set.values_list('channel_id', flat=True))
+        return self._channel_ids
+
+    @property
+    def received_message_ids(self):
+        """
+        Ids of direct messages the current user received
+        """
+        if self._received_message_ids is None:
+            if self._is_anonymous():
+                self._received_message_ids = set()
+            else:
+                self._received_message_ids = set(self.user.reception_set.values_list('message_id', flat=True))
+        return self._received_message_ids
+
+    def is_connected(self, user_id):
+        return user_id in self.connected_user_ids
+
+    def is_participant(self, task_id):
+        return task_id in self.task_ids
+
+    def is_channel_member(self, channel_id):
+        return channel_id in self.channel_ids
+
+    def is_recipient(self, message_id):
+        return message_id in self.received_message_ids
+
+
+def get_permission_cache(request):
+    """
+    Returns the permission cache for the request's current user, creating it on first use.
+    The cache lives on the underlying django request so views, permission classes and serializers share it.
+    """
+    user = getattr(request, 'user', None)
+    http_request = getattr(request, '_request', request)
+    cache = getattr(http_request, PERMISSION_CACHE_ATTR, None)
+    if cache is None or cache.user != user:
+        cache = PermissionCache(user)
+        setattr(http_request, PERMISSION_CACHE_ATTR, cache)
+    return cache
+
+
+def clear_permission_cache(request):
+    """
+    Drops the request's permission cache e.g after the current user joins a channel or task mid request
+    """
+    http_request = getattr(request, '_request', request)
+    if hasattr(http_request, PERMISSION_CACHE_ATTR):
+        delattr(http_request, PERMISSION_CACHE_ATTR)
+
+
+def filter_permitted(request, objects, action='read', related=None):
+    """
+    Filters objects down to those the current user has object level permission for
+    :param request: Current request
+    :param objects: Iterable of model instances that implement has_object_<action>_permission
+    :param action: Permission to check e.g read, write or update
+    :param related: Relations the permission checks delegate to (e.g ['task']), loaded in bulk before checking
+    :return: list of permitted objects
+    """
+    objects = list(objects)
+    if not objects:
+        return objects
+    if related:
+        prefetch_related_objects(objects, list(related))
+    method_name = 'has_object_%s_permission' % action
+    return [obj for obj in objects if getattr(obj, method_name)(request)]
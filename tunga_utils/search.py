@@ -0,0 +1,257 @@
+"""
+Full text search.
+
+Searchable models register a function that builds the text of an object, their documents are stored in
+SearchDocument and kept in sync from post_save/post_delete (see tunga_utils.search_indexes for the models).
+The database's search backend indexes the documents and filters querysets to the objects whose documents match
+in SQL, so a search is applied with the queryset's other filters and isn't cut off before them.
+Matches are ranked by SQLite's bm25 on an FTS5 table or by MySQL's relevance on a FULLTEXT index.
+Every search term is matched as a prefix and all terms must match.
+
+Views opt in with FullTextSearchFilter in place of SearchFilter, it falls back to the view's search_fields
+when the database has no search backend or the view's model isn't indexed.
+Exact search fields (=field e.g emails) aren't indexed, they're still only matched as a whole.
+"""
+import re
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models.query_utils import Q
+from django.db.models.signals import post_save, post_delete
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+
+from tunga.settings.base import SEARCH_BACKEND
+from tunga_utils.models import SearchDocument
+
+SEARCH_DOCUMENT_TABLE = SearchDocument._meta.db_table
+SEARCH_FTS_TABLE = '%s_fts' % SEARCH_DOCUMENT_TABLE
+SEARCH_FULLTEXT_INDEX = '%s_document' % SEARCH_DOCUMENT_TABLE
+
+SEARCH_TERM_REGEX = re.compile(r'\w+', re.UNICODE)
+
+# Model -> (function that builds the document of an object, function that adds what it reads to a queryset)
+SEARCH_INDEXES = dict()
+
+# Database vendor -> search backend class
+SEARCH_BACKENDS = dict()
+
+_search_backend = dict()
+
+
+def register_search_index(model, get_document, get_queryset=None):
+    """
+    Makes a model searchable and keeps the documents of its objects in sync with them
+    :param get_document: function that returns the list of texts to index for an object e.g its title and body
+    :param get_queryset: function that adds the relations get_document reads to a queryset, used when rebuilding
+    """
+    SEARCH_INDEXES[model] = (get_document, get_queryset)
+    post_save.connect(search_index_handler_saved, sender=model, dispatch_uid='search_index_saved')
+    post_delete.connect(search_index_handler_deleted, sender=model, dispatch_uid='search_index_deleted')
+
+
+def register_search_backend(vendor, backend_class):
+    SEARCH_BACKENDS[vendor] = backend_class
+
+
+def get_search_terms(query):
+    return SEARCH_TERM_REGEX.findall(query.lower())
+
+
+class SearchBackend(object):
+
+    def is_available(self):
+        return SEARCH_DOCUMENT_TABLE in connection.introspection.table_names()
+
+    def get_search_sql(self, model, terms, id_column):
+        """
+        :param terms: Words that all have to match, as prefixes
+        :param id_column: Quoted id column of the searched table, the rank is a subquery correlated on it
+        :return: (sql of a subquery of the ids of the matching objects, its params,
+        sql of the rank of the object in the row with the best match lowest, its params)
+        """
+        raise NotImplementedError()
+
+
+class SQLiteSearchBackend(SearchBackend):
+
+    def is_available(self):
+        # SQLite builds without FTS5 skip creating the table, see the SearchDocument migration
+        return SEARCH_FTS_TABLE in connection.introspection.table_names()
+
+    def get_search_sql(self, model, terms, id_column):
+        query = ' '.join(['"%s"*' % term for term in terms])
+        content_type_id = ContentType.objects.get_for_model(model).id
+        return (
+            'SELECT document.object_id FROM {fts} INNER JOIN {table} document ON document.id = {fts}.rowid '
+            'WHERE {fts} MATCH %s AND document.content_type_id = %s'.format(
+                fts=SEARCH_FTS_TABLE, table=SEARCH_DOCUMENT_TABLE
+            ),
+            [query, content_type_id],
+            'SELECT bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND {fts}.rowid = ('
+            'SELECT document.id FROM {table} document '
+            'WHERE document.content_type_id = %s AND document.object_id = {id})'.format(
+                fts=SEARCH_FTS_TABLE, table=SEARCH_DOCUMENT_TABLE, id=id_column
+            ),
+            [query, content_type_id]
+        )
+
+
+class MySQLSearchBackend(SearchBackend):
+    """
+    Terms shorter than innodb_ft_min_token_size (3 by default) and stopwords aren't indexed by MySQL
+    """
+
+    def is_available(self):
+        if not super(MySQLSearchBackend, self).is_available():
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SHOW INDEX FROM {table} WHERE Key_name = %s'.format(table=SEARCH_DOCUMENT_TABLE),
+                [SEARCH_FULLTEXT_INDEX]
+            )
+            return bool(cursor.fetchall())
+
+    def get_search_sql(self, model, terms, id_column):
+        query = ' '.join(['+%s*' % term for term in terms])
+        content_type_id = ContentType.objects.get_for_model(model).id
+        return (
+            'SELECT document.object_id FROM {table} document WHERE document.content_type_id = %s '
+            'AND MATCH (document.document) AGAINST (%s IN BOOLEAN MODE)'.format(table=SEARCH_DOCUMENT_TABLE),
+            [content_type_id, query],
+            'SELECT -MATCH (document.document) AGAINST (%s IN BOOLEAN MODE) FROM {table} document '
+            'WHERE document.content_type_id = %s AND document.object_id = {id}'.format(
+                table=SEARCH_DOCUMENT_TABLE, id=id_column
+            ),
+            [query, content_type_id]
+        )
+
+
+register_search_backend('sqlite', SQLiteSearchBackend)
+register_search_backend('mysql', MySQLSearchBackend)
+
+
+def get_search_backend():
+    """
+    :return: the search backend set in SEARCH_BACKEND or the one for the database, None if there's none available
+    """
+    vendor = connection.vendor
+    if vendor not in _search_backend:
+        backend_class = SEARCH_BACKEND and import_string(SEARCH_BACKEND) or SEARCH_BACKENDS.get(vendor, None)
+        backend = backend_class and backend_class() or None
+        if backend and not backend.is_available():
+            backend = None
+        _search_backend[vendor] = backend
+    return _search_backend[vendor]
+
+
+def get_search_document(instance):
+    get_document, get_queryset = SEARCH_INDEXES[type(instance)]
+    return ' '.join([part for part in get_document(instance) if part])
+
+
+def update_search_document(instance):
+    SearchDocument.objects.update_or_create(
+        content_type=ContentType.objects.get_for_model(instance), object_id=instance.id,
+        defaults={'document': get_search_document(instance)}
+    )
+
+
+def update_search_documents(instances):
+    """
+    Indexes objects of one model with one insert e.g objects that were bulk created without post_save
+    """
+    if not instances:
+        return
+    content_type = ContentType.objects.get_for_model(instances[0])
+    SearchDocument.objects.filter(
+        content_type=content_type, object_id__in=[instance.id for instance in instances]
+    ).delete()
+    SearchDocument.objects.bulk_create([
+        SearchDocument(
+            content_type=content_type, object_id=instance.id, document=get_search_document(instance)
+        ) for instance in instances
+    ])
+
+
+def delete_search_document(instance):
+    SearchDocument.objects.filter(
+        content_type=ContentType.objects.get_for_model(instance), object_id=instance.id
+    ).delete()
+
+
+def search_index_handler_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_search_document(instance)
+
+
+def search_index_handler_deleted(sender, instance, **kwargs):
+    delete_search_document(instance)
+
+
+def rebuild_search_index(model, batch_size=500):
+    """
+    Replaces the documents of a model with documents built from its current objects e.g after bulk inserts
+    :return: number of documents indexed
+    """
+    get_document, get_queryset = SEARCH_INDEXES[model]
+    content_type = ContentType.objects.get_for_model(model)
+    SearchDocument.objects.filter(content_type=content_type).delete()
+
+    queryset = model._default_manager.order_by('id')
+    if get_queryset:
+        queryset = get_queryset(queryset)
+    total = 0
+    last_id = 0
+    while True:
+        instances = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not instances:
+            break
+        update_search_documents(instances)
+        total += len(instances)
+        last_id = instances[-1].id
+    return total
+
+
+def search_queryset(queryset, query):
+    """
+    Filters a queryset to the objects that match a search query and orders them by rank
+    :return: the filtered queryset annotated with search_rank, None if the queryset's model can't be searched
+    """
+    backend = get_search_backend()
+    if backend is None or queryset.model not in SEARCH_INDEXES:
+        return None
+    terms = get_search_terms(query)
+    if not terms:
+        return queryset.none()
+    id_column = '%s.%s' % (
+        connection.ops.quote_name(queryset.model._meta.db_table),
+        connection.ops.quote_name(queryset.model._meta.pk.column)
+    )
+    match_sql, match_params, rank_sql, rank_params = backend.get_search_sql(queryset.model, terms, id_column)
+    return queryset.extra(
+        select={'search_rank': '(%s)' % rank_sql}, select_params=rank_params,
+        where=['%s IN (%s)' % (id_column, match_sql)], params=match_params
+    ).order_by('search_rank')
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    Search filter backed by the full text search index, see tunga_utils.search
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if search_terms:
+            results = search_queryset(queryset, ' '.join(search_terms))
+            if results is not None:
+                exact_fields = [field[1:] for field in getattr(view, 'search_fields', []) if field.startswith('=')]
+                if exact_fields:
+                    exact_query = Q()
+                    for term in search_terms:
+                        for field in exact_fields:
+                            exact_query |= Q(**{'%s__iexact' % field: term})
+                    # Exact matches aren't ranked, they're listed first
+                    results = (results | queryset.filter(exact_query)).order_by('search_rank')
+                return results
+        return super(FullTextSearchFilter, self).filter_queryset(request, queryset, view)
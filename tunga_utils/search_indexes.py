@@ -0,0 +1,84 @@
+"""
+Searchable models, see tunga_utils.search
+"""
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch.dispatcher import receiver
+
+from tunga_comments.models import Comment
+from tunga_messages.models import Message, Reply
+from tunga_messages.tasks import messages_added
+from tunga_profiles.models import UserProfile
+from tunga_tasks.models import Task, ProgressReport
+from tunga_utils.models import generate_excerpt
+from tunga_utils.search import register_search_index, update_search_document, update_search_documents
+
+
+def get_skill_names(instance):
+    return [skill.name for skill in instance.skills.all()]
+
+
+def get_user_names(user):
+    return [user.username, user.first_name, user.last_name]
+
+
+def get_user_document(user):
+    try:
+        skills = get_skill_names(user.userprofile)
+    except UserProfile.DoesNotExist:
+        skills = []
+    # Emails are only matched exactly, see FullTextSearchFilter
+    return get_user_names(user) + skills
+
+
+register_search_index(
+    get_user_model(), get_user_document,
+    lambda queryset: queryset.select_related('userprofile').prefetch_related('userprofile__skills')
+)
+register_search_index(
+    Task, lambda task: [task.title, generate_excerpt(task.description)] + get_skill_names(task),
+    lambda queryset: queryset.prefetch_related('skills')
+)
+register_search_index(
+    ProgressReport, lambda report: get_user_names(report.user) + [
+        report.accomplished, report.next_steps, report.remarks, report.event.task.title
+    ] + get_skill_names(report.event.task),
+    lambda queryset: queryset.select_related('user', 'event__task').prefetch_related('event__task__skills')
+)
+register_search_index(
+    Message, lambda message: [message.user.username, message.subject, generate_excerpt(message.body)] + [
+        generate_excerpt(reply.body) for reply in message.replies.all()
+    ],
+    lambda queryset: queryset.select_related('user').prefetch_related('replies')
+)
+register_search_index(
+    Comment, lambda comment: [comment.user.username, generate_excerpt(comment.body)],
+    lambda queryset: queryset.select_related('user')
+)
+
+
+@receiver(post_save, sender=Reply)
+@receiver(post_delete, sender=Reply)
+def search_index_handler_reply(sender, instance, **kwargs):
+    update_search_document(instance.message)
+
+
+@receiver(messages_added, sender=Message)
+def search_index_handler_messages_added(sender, messages, **kwargs):
+    update_search_documents(messages)
+
+
+@receiver(post_save, sender=UserProfile)
+def search_index_handler_profile(sender, instance, **kwargs):
+    update_search_document(instance.user)
+
+
+@receiver(m2m_changed, sender=Task._meta.get_field('skills').rel.through)
+@receiver(m2m_changed, sender=UserProfile._meta.get_field('skills').rel.through)
+def search_index_handler_skills_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear'] or reverse:
+        # Skills aren't renamed, so only changes from a task's or a profile's side matter
+        return
+    if isinstance(instance, UserProfile):
+        instance = instance.user
+    update_search_document(instance)
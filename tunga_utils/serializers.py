@@ -3,8 +3,10 @@ from django.contrib.contenttypes.models import ContentType
 from django_countries.serializer_fields import CountryField
 from rest_framework import serializers
 from rest_framework.fields import SkipField
+from tagulous.utils import render_tags
 
 from tunga_profiles.models import Skill, City, UserProfile, Education, Work, Connection
+from tunga_utils.cache import FragmentCacheSerializerMixin
 from tunga_utils.models import GenericUpload, ContactRequest, Upload, AbstractExperience, Rating
 
 
@@ -42,6 +44,26 @@ class DetailAnnotatedModelSerializer(serializers.ModelSerializer):
             return None
 
 
+def get_prefetched_tags(instance, field_name):
+    """
+    Tags of a tagulous TagField, read from `prefetched_<field_name>` when the queryset loaded them there.
+    Tagulous reloads tags whenever its manager is created which bypasses Django's prefetch cache
+    """
+    tags = getattr(instance, 'prefetched_%s' % field_name, None)
+    if tags is None:
+        tags = getattr(instance, field_name).tags
+    return tags
+
+
+class TagStringField(serializers.CharField):
+    """
+    Writable tag string for a tagulous TagField that reads prefetched tags when available
+    """
+
+    def get_attribute(self, instance):
+        return render_tags(get_prefetched_tags(instance, self.source))
+
+
 class SkillSerializer(serializers.ModelSerializer):
     class Meta:
         model = Skill
@@ -54,7 +76,7 @@ class CitySerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'slug')
 
 
-class SimpleUserSerializer(serializers.ModelSerializer):
+class SimpleUserSerializer(FragmentCacheSerializerMixin, serializers.ModelSerializer):
     company = serializers.CharField(read_only=True, required=False, source='userprofile.company')
     avatar_url = serializers.SerializerMethodField(required=False, read_only=True)
 
@@ -74,6 +96,18 @@ class SimpleUserSerializer(serializers.ModelSerializer):
         return None
 
 
+def prefetch_simple_users(queryset, *fields):
+    """
+    Loads the users behind the given relations together with everything SimpleUserSerializer reads from them
+    """
+    select_fields = []
+    prefetch_fields = []
+    for field in fields:
+        select_fields.extend([field, '%s__userprofile' % field])
+        prefetch_fields.append('%s__socialaccount_set' % field)
+    return queryset.select_related(*select_fields).prefetch_related(*prefetch_fields)
+
+
 class SimpleProfileSerializer(serializers.ModelSerializer):
     city = serializers.CharField()
     skills = SkillSerializer(many=True)
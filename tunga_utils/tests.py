@@ -1,3 +1,432 @@
-from django.test import TestCase
+import json
+import threading
+import time
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from smtplib import SMTPServerDisconnected, SMTPRecipientsRefused
 
-# Create your tests here.
+from allauth.socialaccount.models import SocialApp, SocialAccount, SocialToken
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core import mail
+from django.core.management import call_command
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import SimpleTestCase
+from django.utils.crypto import get_random_string
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase, APIRequestFactory
+
+from tunga_auth.models import USER_TYPE_DEVELOPER
+from tunga_profiles.models import Skill
+from tunga_settings.models import SwitchSetting, UserSwitchSetting
+from tunga_tasks import slugs
+from tunga_tasks.models import Task
+from tunga_tasks.serializers import SimpleTaskSerializer
+from tunga_utils.cache import bump_cache_version, CACHE_NAMESPACE_SKILLS, CACHE_NAMESPACE_SETTINGS, \
+    CACHE_NAMESPACE_USER_SETTINGS
+from tunga_utils.benchmark import seed_dataset, benchmark_endpoints, read_budgets, check_budgets, read_github_payloads, \
+    describe_budget_failure
+from tunga_utils.emails import render_mail, send_mails, render_many, MAIL_TEMPLATES
+from tunga_utils import github
+from tunga_utils.github import extract_activity, GitHubClient
+from tunga_utils.models import SearchDocument
+from tunga_utils.serializers import SimpleUserSerializer
+
+
+class APIQueryBudgetTestCase(APITestCase):
+
+    def test_endpoint_query_budgets(self):
+        """
+        No router endpoint can run more queries than its committed budget or change the status it was recorded with
+        """
+        budgets = read_budgets()
+        users = seed_dataset(size=budgets['size'], seed=budgets['seed'])
+        results = benchmark_endpoints(users)
+
+        self.assertEqual(
+            [], [describe_budget_failure(failure) for failure in check_budgets(results, budgets['budgets'])]
+        )
+        self.assertFalse([result for result in results if result['status'] >= 500])
+
+        # A budget recorded from a denied request doesn't cover the endpoint once it answers
+        denied = {'endpoint': 'task-list', 'role': 'developer', 'status': 200, 'queries': 1}
+        self.assertEqual(
+            [describe_budget_failure(failure) for failure in check_budgets(
+                [denied], {'task-list': {'developer': {'status': 403, 'queries': 1}}}
+            )],
+            ['task-list as developer (status 200, budget recorded with 403)']
+        )
+
+
+class GitHubActivityExtractorTestCase(SimpleTestCase):
+
+    def test_extract_recorded_payloads(self):
+        """
+        Every recorded GitHub payload maps to an activity of its Tunga event
+        """
+        events = dict()
+        for sample in read_github_payloads():
+            activity = extract_activity(sample['event'], sample['payload'])
+            events[sample['event']] = activity[slugs.ACTIVITY_EVENT_ID]
+            self.assertTrue(activity[slugs.ACTIVITY_URL].startswith('https://github.com/'))
+            self.assertEqual(activity[slugs.ACTIVITY_USERNAME], sample['payload']['sender']['login'])
+        self.assertEqual(events, {
+            'push': slugs.PUSH, 'issue': slugs.ISSUE, 'pull_request': slugs.PULL_REQUEST, 'create': slugs.BRANCH,
+            'delete': slugs.TAG, 'commit_comment': slugs.COMMIT_COMMENT, 'issue_comment': slugs.ISSUE_COMMENT,
+            'pull_request_review_comment': slugs.PULL_REQUEST_COMMENT, 'release': slugs.RELEASE, 'gollum': slugs.WIKI
+        })
+
+        merged_pull_request = [sample for sample in read_github_payloads() if sample['event'] == 'pull_request'][0]
+        self.assertEqual(
+            extract_activity('pull_request', merged_pull_request['payload'])[slugs.ACTIVITY_ACTION], slugs.ACTION_MERGED
+        )
+        self.assertEqual(extract_activity('issue', {'action': 'labeled', 'issue': {}}), {})
+        self.assertEqual(extract_activity('watch', {'action': 'started'}), {})
+
+
+class FlakyEmailBackend(EmailBackend):
+    """
+    In memory mail backend that drops the connection on chosen attempts and refuses chosen recipients
+    """
+
+    def __init__(self, failures=None, refused=None, *args, **kwargs):
+        super(FlakyEmailBackend, self).__init__(*args, **kwargs)
+        self.failures = failures or []
+        self.refused = refused or []
+        self.attempts = 0
+        self.opened = 0
+
+    def open(self):
+        self.opened += 1
+
+    def send_messages(self, messages):
+        self.attempts += 1
+        if self.attempts in self.failures:
+            raise SMTPServerDisconnected('Connection unexpectedly closed')
+        if [message for message in messages if set(message.to) & set(self.refused)]:
+            raise SMTPRecipientsRefused(dict([(email, (550, 'Unknown user')) for email in self.refused]))
+        return super(FlakyEmailBackend, self).send_messages(messages)
+
+
+class MailDispatcherTestCase(SimpleTestCase):
+
+    def get_messages(self, count):
+        return [
+            render_mail(
+                'Reminder %s' % i, 'tunga/email/email_progress_event_reminder', ['dev%s@example.com' % i],
+                {'owner': {'display_name': 'Owner'}, 'event': {'title': 'Update %s' % i}}
+            ) for i in xrange(count)
+        ]
+
+    def test_send_mails(self):
+        """
+        Emails are sent over one connection, resumed after dropped connections and skipped when refused
+        """
+        mail.outbox = []
+        connection = FlakyEmailBackend(failures=[2, 3], refused=['dev3@example.com'])
+        sent = send_mails(self.get_messages(5), connection=connection, backoff=0)
+
+        self.assertEqual(sent, [True, True, True, False, True])
+        self.assertEqual(['Reminder %s' % i for i in [0, 1, 2, 4]], [message.subject for message in mail.outbox])
+        self.assertEqual(connection.opened, 7)
+        self.assertIn('Update 1', mail.outbox[1].body)
+
+        mail.outbox = []
+        connection = FlakyEmailBackend(failures=[2, 3, 4])
+        sent = send_mails(self.get_messages(3), connection=connection, retries=2, backoff=0)
+        self.assertEqual(sent, [True, False, False])
+        self.assertEqual(len(mail.outbox), 1)
+
+        # Single emails raise their failures so their jobs fail
+        connection = FlakyEmailBackend(refused=['dev0@example.com'])
+        with self.assertRaises(SMTPRecipientsRefused):
+            send_mails(self.get_messages(1), connection=connection, fail_silently=False)
+        connection = FlakyEmailBackend(failures=[1])
+        with self.assertRaises(SMTPServerDisconnected):
+            send_mails(self.get_messages(1), connection=connection, retries=0, fail_silently=False)
+
+    def test_render_many(self):
+        """
+        Email templates are registered at startup and rendered once per context
+        """
+        self.assertIn('tunga/email/email_task_application_not_selected', MAIL_TEMPLATES)
+        self.assertEqual(set(MAIL_TEMPLATES['tunga/email/email_new_user'].keys()), {'html', 'txt'})
+        self.assertNotIn('tunga/email/base', MAIL_TEMPLATES)
+
+        bodies = render_many(
+            'tunga/email/email_task_application_not_selected', [
+                {'task': {'summary': 'Task %s' % i}, 'applicant': {'first_name': 'Dev %s' % i}} for i in xrange(3)
+            ]
+        )
+        self.assertEqual(len(bodies), 3)
+        for i, email_bodies in enumerate(bodies):
+            for body in [email_bodies['txt'], email_bodies['html']]:
+                self.assertIn('Task %s' % i, body)
+                self.assertIn('Hello Dev %s,' % i, body)
+
+
+class ResponseCacheTestCase(APITestCase):
+
+    def setUp(self):
+        self.developer = get_user_model().objects.create_user(
+            'developer', 'developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER})
+        # User ids repeat across test databases, so start from versions no earlier run has cached
+        for namespace in [
+            CACHE_NAMESPACE_SKILLS, CACHE_NAMESPACE_SETTINGS, CACHE_NAMESPACE_USER_SETTINGS.format(user=self.developer.id)
+        ]:
+            bump_cache_version(namespace)
+        self.client.force_authenticate(user=self.developer)
+
+    def test_cached_settings(self):
+        """
+        Settings are served from the cache with an ETag until settings or the user's settings change
+        """
+        url = reverse('user-settings')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        setting = SwitchSetting.objects.create(slug='cache_test', name='Cache Test', default_value=False)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['switches']['cache_test'])
+        etag = response['ETag']
+
+        UserSwitchSetting.objects.create(user=self.developer, setting=setting, value=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['switches']['cache_test'])
+
+    def test_cached_skills(self):
+        """
+        Skills are served from the cache until a skill changes
+        """
+        url = reverse('skill-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(url)
+        self.assertEqual(cached_response.data, response.data)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+
+        Skill.objects.create(name='Cache Test')
+        response = self.client.get(url)
+        self.assertEqual(response.data['count'], cached_response.data['count'] + 1)
+        self.assertNotEqual(cached_response['ETag'], response['ETag'])
+
+        response = self.client.get(reverse('countries'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('countries'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_fragment_cache(self):
+        """
+        Simple tasks and users are served from the fragment cache until the task, its user or the user's profile change
+        """
+        for i in xrange(3):
+            Task.objects.create(title='Task %s' % i, fee=15, user=self.developer)
+
+        data = SimpleTaskSerializer(Task.objects.all(), many=True).data
+        self.assertEqual(len(data), 3)
+
+        with self.assertNumQueries(1):
+            cached_data = SimpleTaskSerializer(Task.objects.all(), many=True).data
+        self.assertEqual(cached_data, data)
+
+        self.developer.first_name = 'Cached'
+        self.developer.save()
+        task = Task.objects.first()
+        task.title = 'Changed'
+        task.save()
+        data = SimpleTaskSerializer(Task.objects.all(), many=True).data
+        self.assertEqual(set([item['user']['first_name'] for item in data]), {'Cached'})
+        self.assertIn('Changed', [item['title'] for item in data])
+
+        # Image urls are cached relative and made absolute on the host of the request they're read for
+        self.developer.image = 'photos/developer.png'
+        self.developer.save()
+        context = {'request': APIRequestFactory().get('/')}
+        data = SimpleTaskSerializer(Task.objects.all(), many=True, context=context).data
+        self.assertEqual(
+            set([item['user']['image'] for item in data]), {'http://testserver/media/photos/developer.png'}
+        )
+        data = SimpleTaskSerializer(Task.objects.all(), many=True).data
+        self.assertEqual(set([item['user']['image'] for item in data]), {'/media/photos/developer.png'})
+        self.assertEqual(SimpleUserSerializer(self.developer).data['image'], '/media/photos/developer.png')
+
+
+class FullTextSearchTestCase(APITestCase):
+
+    def setUp(self):
+        self.developer = get_user_model().objects.create_user(
+            'developer', 'developer@example.com', 'secret', **{'type': USER_TYPE_DEVELOPER}
+        )
+
+    def test_search_tasks(self):
+        """
+        Tasks are searched by word prefixes in their index documents, best matches first
+        """
+        python_task = Task.objects.create(
+            title='Python scraper', description='Scrape python docs', fee=15, user=self.developer
+        )
+        django_task = Task.objects.create(
+            title='Django site', description='A python web site', fee=15, user=self.developer
+        )
+        Task.objects.create(title='Logo design', fee=15, user=self.developer)
+        url = reverse('task-list')
+
+        self.client.force_authenticate(user=self.developer)
+        response = self.client.get(url, {'search': 'pyth'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([task['id'] for task in response.data['results']], [python_task.id, django_task.id])
+
+        response = self.client.get(url, {'search': 'python site', 'cursor': ''})
+        self.assertEqual([task['id'] for task in response.data['results']], [django_task.id])
+
+        django_task.title = 'Flask site'
+        django_task.save()
+        self.assertEqual(self.client.get(url, {'search': 'django'}).data['count'], 0)
+
+        SearchDocument.objects.all().delete()
+        self.assertEqual(self.client.get(url, {'search': 'flask'}).data['count'], 0)
+        call_command('tunga_rebuild_search_index', 'tunga_tasks.Task')
+        response = self.client.get(url, {'search': 'flask'})
+        self.assertEqual([task['id'] for task in response.data['results']], [django_task.id])
+
+    def test_search_filtered_tasks(self):
+        """
+        Searches are matched within the view's other filters, not cut off before them
+        """
+        owner = get_user_model().objects.create_user('owner', 'owner@example.com', 'secret')
+        tasks = [
+            Task.objects.create(title='Python task %s' % i, fee=15, user=user)
+            for i, user in enumerate([owner] * 3 + [self.developer] * 2)
+        ]
+        self.client.force_authenticate(user=self.developer)
+        response = self.client.get(reverse('task-list'), {'search': 'python', 'user': self.developer.id})
+        self.assertEqual(set([task['id'] for task in response.data['results']]), {tasks[3].id, tasks[4].id})
+        self.assertEqual(response.data['count'], 2)
+
+    def test_search_cursor_pagination(self):
+        """
+        Ranked search results are paged with offset cursors since their rank can't be filtered on
+        """
+        tasks = [Task.objects.create(title='Widget %s' % i, fee=15, user=self.developer) for i in range(20)]
+        url = reverse('task-list')
+
+        self.client.force_authenticate(user=self.developer)
+        task_ids = []
+        next_url = url + '?search=widget&cursor='
+        while next_url:
+            response = self.client.get(next_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            task_ids.extend([item['id'] for item in response.data['results']])
+            previous_url = response.data['previous']
+            next_url = response.data['next']
+        self.assertEqual(sorted(task_ids), [task.id for task in tasks])
+
+        response = self.client.get(previous_url)
+        self.assertEqual([item['id'] for item in response.data['results']], task_ids[:15])
+        self.assertIsNone(response.data['previous'])
+
+    def test_search_users(self):
+        """
+        Users are searched by their names, emails only match as a whole
+        """
+        other_user = get_user_model().objects.create_user('other', 'other@example.com', 'secret')
+        url = reverse('tungauser-list')
+
+        self.client.force_authenticate(user=other_user)
+        response = self.client.get(url, {'search': 'develop'})
+        self.assertEqual([user['id'] for user in response.data['results']], [self.developer.id])
+
+        self.assertEqual(self.client.get(url, {'search': 'example'}).data['count'], 0)
+        response = self.client.get(url, {'search': 'developer@example.com'})
+        self.assertEqual([user['id'] for user in response.data['results']], [self.developer.id])
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    """
+    Serves /user/repos in pages of one repo with ETags and the rate limit headers of the fake server
+    """
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        page = int(urlparse.parse_qs(url.query).get('page', ['1'])[0])
+        etag = '"repos-%s"' % page
+        status_code = self.headers.get('If-None-Match') == etag and 304 or 200
+        self.server.requests.append((page, status_code))
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('X-RateLimit-Remaining', str(self.server.remaining))
+        self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+        if page < len(self.server.repos):
+            self.send_header('Link', '<http://%s:%s/user/repos?per_page=100&page=%s>; rel="next"' % (
+                self.server.server_address + (page + 1,)
+            ))
+        self.end_headers()
+        if status_code == 200:
+            self.wfile.write(json.dumps([self.server.repos[page - 1]]))
+
+    def log_message(self, *args):
+        pass
+
+
+class GitHubClientTestCase(APITestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), FakeGitHubHandler)
+        self.server.requests = []
+        self.server.remaining = 5000
+        self.server.repos = [
+            dict(id=repo_id, name='repo%s' % repo_id, description='', full_name='tunga/repo%s' % repo_id,
+                 private=False, url='', html_url='') for repo_id in [1, 2]
+        ]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.shutdown)
+
+        api_url = github.GITHUB_API_URL
+        github.GITHUB_API_URL = 'http://%s:%s' % self.server.server_address
+        self.addCleanup(setattr, github, 'GITHUB_API_URL', api_url)
+
+        self.user = get_user_model().objects.create_user('developer', 'developer@example.com', 'secret')
+        app = SocialApp.objects.create(provider='github', name='GitHub', client_id='id', secret='secret')
+        account = SocialAccount.objects.create(user=self.user, provider='github', uid='1')
+        token = SocialToken.objects.create(app=app, account=account, token=get_random_string())
+        self.addCleanup(cache.delete_pattern, '%s:*' % GitHubClient(token.token).cache_prefix)
+
+    def test_list_repos(self):
+        """
+        Repos are read across pages, unchanged pages come from the cache and a used up rate limit fails fast
+        """
+        url = reverse('repo-list', kwargs={'provider': 'github'})
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([repo['full_name'] for repo in response.data], ['tunga/repo1', 'tunga/repo2'])
+        self.assertEqual(self.server.requests, [(1, 200), (2, 200)])
+
+        response = self.client.get(url)
+        self.assertEqual([repo['full_name'] for repo in response.data], ['tunga/repo1', 'tunga/repo2'])
+        self.assertEqual(self.server.requests[2:], [(1, 304), (2, 304)])
+
+        self.server.remaining = 0
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(response.data['retry_after'], 3500)
+        self.assertEqual(self.server.requests[4:], [(1, 304)])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(len(self.server.requests), 5)
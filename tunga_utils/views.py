@@ -5,6 +5,7 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 
 from tunga_auth.models import USER_TYPE_DEVELOPER, USER_TYPE_PROJECT_OWNER
 from tunga_profiles.models import Skill
+from tunga_utils.cache import cache_response, CACHE_NAMESPACE_SKILLS
 from tunga_utils.models import ContactRequest
 from tunga_utils.serializers import SkillSerializer, ContactRequestSerializer
 
@@ -18,6 +19,14 @@ class SkillViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
     search_fields = ('name', )
 
+    @cache_response([CACHE_NAMESPACE_SKILLS])
+    def list(self, request, *args, **kwargs):
+        return super(SkillViewSet, self).list(request, *args, **kwargs)
+
+    @cache_response([CACHE_NAMESPACE_SKILLS])
+    def retrieve(self, request, *args, **kwargs):
+        return super(SkillViewSet, self).retrieve(request, *args, **kwargs)
+
 
 class ContactRequestView(generics.CreateAPIView):
     """